@@ -1,27 +1,32 @@
 # app.py
-import asyncio
+import logging
 from telegram.ext import Application, MessageHandler, filters, CommandHandler
 from telegram import Update
 from config.settings import TELEGRAM_BOT_TOKEN, PRIVATE_GROUP_CHAT_ID, LOGGING_BOT_TOKEN, LOGGING_CHAT_ID
-from handlers.message_handler import handle_message
-from handlers.commands_handler import handle_stats_command, handle_zero_command
+from handlers.message_handler import BULK_DOCUMENT_FILTER, handle_message, handle_document
+from handlers.lifecycle import post_init, post_stop, post_shutdown
+from handlers.commands_handler import handle_stats_command, handle_zero_command, handle_export_command, handle_profile_command, handle_memory_command, handle_endpoints_command, handle_metrics_command
+from utils.logger_config import setup_logging
+
+logger = logging.getLogger(__name__)
 
 def main():
     """Запускает объединенного Telegram-бота."""
+    setup_logging("app")
     # Проверяем, что токены и ID группы установлены
     if not TELEGRAM_BOT_TOKEN:
-        print("Ошибка: Токен основного Telegram-бота не найден. Убедитесь, что он указан в файле .env")
+        logger.error("Токен основного Telegram-бота не найден. Убедитесь, что он указан в файле .env")
         return
     if not PRIVATE_GROUP_CHAT_ID:
-        print("Ошибка: Chat ID приватной группы не найден. Убедитесь, что он указан в файле .env")
+        logger.error("Chat ID приватной группы не найден. Убедитесь, что он указан в файле .env")
         return
     # LOGGING_BOT_TOKEN и LOGGING_CHAT_ID проверяются внутри telegram_logger.py
     # и их отсутствие не должно прерывать работу основного бота.
 
-    print("Инициализация Telegram-бота...")
+    logger.info("Инициализация Telegram-бота...")
     # Создаем один объект Application для всего бота
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    print("Бот инициализирован.")
+    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown).build()
+    logger.info("Бот инициализирован.")
 
     # Явный вызов initialize() убран, так как run_polling() вызывает его автоматически.
     # Это должно решить проблему с циклом событий.
@@ -29,25 +34,39 @@ def main():
     # Регистрируем обработчик для текстовых сообщений (НЕ команд)
     # Это предотвратит обработку команд как обычных сообщений
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    print("Обработчик текстовых сообщений зарегистрирован (исключая команды).")
+    logger.debug("Обработчик текстовых сообщений зарегистрирован (исключая команды).")
+    # Документы с пакетом новостей (JSONL, CSV, TXT)
+    application.add_handler(MessageHandler(BULK_DOCUMENT_FILTER, handle_document))
+    logger.debug("Обработчик документов с пакетом новостей зарегистрирован.")
 
-    # Регистрируем обработчики команд /stats и /zero
+    # Регистрируем обработчики команд /stats, /zero, /export, /profile, /memory, /endpoints и /metrics
     # Эти обработчики будут реагировать только на команды с соответствующим именем
     application.add_handler(CommandHandler("stats", handle_stats_command))
-    print("Обработчик команды /stats зарегистрирован.")
+    logger.debug("Обработчик команды /stats зарегистрирован.")
     application.add_handler(CommandHandler("zero", handle_zero_command))
-    print("Обработчик команды /zero зарегистрирован.")
+    logger.debug("Обработчик команды /zero зарегистрирован.")
+    application.add_handler(CommandHandler("export", handle_export_command))
+    logger.debug("Обработчик команды /export зарегистрирован.")
+    # block=False: профилирование длится секунды и не должно задерживать обработку других апдейтов
+    application.add_handler(CommandHandler("profile", handle_profile_command, block=False))
+    logger.debug("Обработчик команды /profile зарегистрирован.")
+    application.add_handler(CommandHandler("memory", handle_memory_command))
+    logger.debug("Обработчик команды /memory зарегистрирован.")
+    application.add_handler(CommandHandler("endpoints", handle_endpoints_command))
+    logger.debug("Обработчик команды /endpoints зарегистрирован.")
+    application.add_handler(CommandHandler("metrics", handle_metrics_command))
+    logger.debug("Обработчик команды /metrics зарегистрирован.")
 
-    print("Запуск прослушивания новых сообщений для бота...")
+    logger.info("Запуск прослушивания новых сообщений для бота...")
     try:
         # Запускаем Application в режиме опроса.
         # Этот метод блокирует выполнение до тех пор, пока бот не будет остановлен (например, Ctrl+C).
         application.run_polling(allowed_updates=Update.ALL_TYPES)
-        print("Бот остановлен.") # Эта строка выполнится только после остановки бота
+        logger.info("Бот остановлен.") # Эта строка выполнится только после остановки бота
     except Exception as e:
-        print(f"Ошибка при запуске бота: {e}")
+        logger.exception("Ошибка при запуске бота: %s", e)
     finally:
-        print("Бот завершил работу.")
+        logger.info("Бот завершил работу.")
 
 
 if __name__ == '__main__':
@@ -55,7 +74,7 @@ if __name__ == '__main__':
         # Запускаем неасинхронную функцию main
         main()
     except KeyboardInterrupt:
-        print("Бот остановлен пользователем (KeyboardInterrupt).")
+        logger.info("Бот остановлен пользователем (KeyboardInterrupt).")
     except Exception as e:
-        print(f"Произошла непредвиденная ошибка во время выполнения: {e}")
+        logger.exception("Произошла непредвиденная ошибка во время выполнения: %s", e)
 
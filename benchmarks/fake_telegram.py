@@ -0,0 +1,82 @@
+# benchmarks/fake_telegram.py
+"""
+Минимальные заменители объектов python-telegram-bot для запуска обработчиков без сети.
+
+Реализуют только те атрибуты и методы, которые используют handle_message и команды:
+update.message.text/chat_id/message_id/date/reply_text, update.effective_chat/effective_user
+и context.bot.send_message. Все отправленные сообщения сохраняются в FakeBot.sent_messages.
+"""
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+_message_ids = itertools.count(1)
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeSentMessage:
+    def __init__(self, chat_id, text: str):
+        self.chat_id = chat_id
+        self.text = text
+        self.message_id = next(_message_ids)
+
+class FakeBot:
+    """
+    Бот, который не отправляет ничего в сеть, а запоминает отправленные сообщения.
+    """
+    def __init__(self, send_delay: float = 0.0):
+        self.send_delay = send_delay
+        self.sent_messages = []
+
+    async def send_message(self, chat_id, text: str, **kwargs) -> FakeSentMessage:
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        message = FakeSentMessage(chat_id, text)
+        self.sent_messages.append(message)
+        return message
+
+    async def send_document(self, chat_id, document, **kwargs) -> FakeSentMessage:
+        message = FakeSentMessage(chat_id, kwargs.get("caption") or "")
+        self.sent_messages.append(message)
+        return message
+
+class FakeMessage:
+    def __init__(self, text: str, chat_id: int, bot: FakeBot, date: datetime | None = None):
+        self.text = text
+        self.chat_id = chat_id
+        self.message_id = next(_message_ids)
+        self.date = date or datetime.now(timezone.utc)
+        self.document = None
+        self._bot = bot
+        self.replies = []
+
+    async def reply_text(self, text: str, **kwargs) -> FakeSentMessage:
+        self.replies.append(text)
+        return await self._bot.send_message(self.chat_id, text, **kwargs)
+
+    async def reply_document(self, document, **kwargs) -> FakeSentMessage:
+        return await self._bot.send_document(self.chat_id, document, **kwargs)
+
+class FakeUpdate:
+    def __init__(self, message: FakeMessage, user_id: int = 1):
+        self.message = message
+        self.effective_message = message
+        self.effective_chat = FakeChat(message.chat_id)
+        self.effective_user = FakeUser(user_id)
+
+class FakeContext:
+    def __init__(self, bot: FakeBot, args: list | None = None):
+        self.bot = bot
+        self.args = args or []
+
+def make_update(text: str, chat_id: int, bot: FakeBot, date: datetime | None = None) -> FakeUpdate:
+    """
+    Создает фейковый апдейт с текстовым сообщением, как если бы его прислал пользователь.
+    """
+    return FakeUpdate(FakeMessage(text, chat_id, bot, date))
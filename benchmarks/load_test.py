@@ -0,0 +1,328 @@
+# benchmarks/load_test.py
+"""
+Сквозной нагрузочный бенчмарк handle_message без сети.
+
+Поднимает заглушку Deepseek (benchmarks/mock_deepseek.py) в отдельном процессе, направляет
+на нее DEEPSEEK_API_URL, и подает в handle_message фейковые Telegram-апдейты
+(benchmarks/fake_telegram.py) с заданной частотой. Статистика пишется во временную базу,
+логирование в отдельный бот отключено.
+
+Отчет: сообщений в секунду, перцентили полной задержки обработки, перцентили по этапам
+Deepseek (метрика deepseek_stage_seconds) и пиковая память процесса.
+
+Режимы подачи:
+    --rate R     — открытая нагрузка: R сообщений в секунду независимо от скорости обработки;
+    --rate 0     — закрытая нагрузка: --concurrency обработчиков работают без пауз.
+
+Для использования в CI как регрессионного гейта:
+    python -m benchmarks.load_test --messages 300 --rate 0 --save-baseline bench_baseline.json
+    python -m benchmarks.load_test --messages 300 --rate 0 --baseline bench_baseline.json --max-regression 0.2
+Во втором случае код возврата 1, если пропускная способность упала или задержка p95/память
+выросли больше чем на max-regression относительно базовой линии.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_deepseek import add_mock_arguments, config_kwargs_from_args, serve
+
+SAMPLE_WORDS = (
+    "мэрия", "города", "объявила", "неожиданный", "конкурс", "жители", "кот", "спас", "пожарных",
+    "депутат", "предложил", "запретить", "понедельники", "ученые", "нашли", "древний", "рецепт",
+    "пельменей", "в", "на", "после", "из-за", "сотрудники", "зоопарка", "научили", "попугая",
+)
+
+def generate_corpus(count: int, seed: int = 42) -> list[str]:
+    """
+    Генерирует синтетические сообщения в формате "текст 1111\\n\\n ссылка".
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(count):
+        words = [rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(30, 120))]
+        text = " ".join(words).capitalize() + "."
+        corpus.append(f"{text}\n1111\n\nhttps://t.me/example_channel/{index}")
+    return corpus
+
+def load_corpus(path: str, count: int) -> list[str]:
+    """
+    Загружает сообщения из JSONL/CSV (тот же формат, что у tools/batch_replay.py).
+    """
+    from tools.batch_replay import iter_input_items, detect_format
+    corpus = []
+    for _, item in iter_input_items(path, detect_format(path)):
+        text = item.get("text") or ""
+        if item.get("link"):
+            text = f"{text}\n1111\n\n{item['link']}"
+        corpus.append(text)
+        if len(corpus) >= count:
+            break
+    return corpus
+
+def start_mock_server(args) -> tuple[multiprocessing.Process, str]:
+    """
+    Запускает заглушку Deepseek в отдельном процессе, чтобы она не влияла на замеры памяти и CPU.
+    """
+    ready = multiprocessing.Event()
+    port = multiprocessing.Value("i", 0)
+    process = multiprocessing.Process(
+        target=serve,
+        args=("127.0.0.1", 0, config_kwargs_from_args(args, "mock-"), ready, port),
+        daemon=True
+    )
+    process.start()
+    if not ready.wait(10):
+        process.terminate()
+        raise RuntimeError("Заглушка Deepseek не запустилась за 10 секунд.")
+    return process, f"http://127.0.0.1:{port.value}/chat/completions"
+
+def configure_environment(api_url: str, database_file: str) -> None:
+    """
+    Настраивает окружение до импорта модулей бота: заглушка вместо Deepseek,
+    отдельные базы статистики и контрольных точек, без бота логирования.
+    """
+    os.environ["DEEPSEEK_API_URL"] = api_url
+    os.environ["STATS_DATABASE_FILE"] = database_file
+    os.environ["CHECKPOINT_DATABASE_FILE"] = os.path.join(os.path.dirname(database_file), "checkpoints.db")
+    os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    os.environ.setdefault("PRIVATE_GROUP_CHAT_ID", "-100")
+    os.environ["LOGGING_BOT_TOKEN"] = ""
+    os.environ["LOGGING_CHAT_ID"] = ""
+    # Журнал — только в консоль (без --verbose она подавляется), без файлов в logs/
+    os.environ.setdefault("LOG_DIR", "")
+
+async def drive(
+    handle_message, corpus: list[str], rate: float, concurrency: int, chats: int, threads: int, telegram_latency: float = 0.0
+) -> dict:
+    """
+    Подает сообщения в handle_message и возвращает длительности обработки и общее время.
+    """
+    from benchmarks.fake_telegram import FakeBot, FakeContext, make_update
+    from services.degradation import start_degradation_monitor, stop_degradation_monitor
+    from services.side_effects import drain
+
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+    bot = FakeBot(send_delay=telegram_latency)
+    context = FakeContext(bot)
+    latencies = []
+    errors = 0
+    # Режимы деградации работают, как в боте, если заданы DEGRADATION_LEVELS
+    start_degradation_monitor()
+
+    async def handle_one(index: int, text: str):
+        nonlocal errors
+        update = make_update(text, chat_id=1000 + index % chats, bot=bot)
+        started_at = time.perf_counter()
+        try:
+            await handle_message(update, context)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    if rate > 0:
+        tasks = []
+        for index, text in enumerate(corpus):
+            delay = started_at + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(handle_one(index, text)))
+        await asyncio.gather(*tasks)
+    else:
+        queue = iter(enumerate(corpus))
+
+        async def worker():
+            for index, text in queue:
+                await handle_one(index, text)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    # Пересылка и логи выполняются в фоне после решения: пропускная способность учитывает и их
+    await drain()
+    duration = time.perf_counter() - started_at
+    await stop_degradation_monitor()
+
+    return {
+        "latencies": latencies,
+        "duration": duration,
+        "errors": errors,
+        "sent": len(bot.sent_messages),
+    }
+
+def build_report(args, outcome: dict, tracemalloc_peak: int | None) -> dict:
+    from services import metrics
+    from services.deepseek_service import endpoint_stats
+    from services.metrics import percentile
+
+    latencies = sorted(outcome["latencies"])
+    snapshot = metrics.snapshot()
+    stages = {
+        key[len('deepseek_stage_seconds{stage="'):-2]: value
+        for key, value in snapshot["histograms"].items()
+        if key.startswith("deepseek_stage_seconds{")
+    }
+    checkpoint_ops = {
+        key[len('checkpoint_seconds{op="'):-2]: value
+        for key, value in snapshot["histograms"].items()
+        if key.startswith("checkpoint_seconds{")
+    }
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "messages": len(latencies),
+        "target_rate": args.rate,
+        "concurrency": args.concurrency if args.rate <= 0 else None,
+        "duration_seconds": round(outcome["duration"], 3),
+        "throughput_msgs_per_sec": round(len(latencies) / outcome["duration"], 3) if outcome["duration"] else 0.0,
+        "errors": outcome["errors"],
+        "forwarded": outcome["sent"],
+        "latency_seconds": {f"p{q}": round(percentile(latencies, q), 4) for q in (50, 95, 99)},
+        "stage_latency_seconds": {
+            stage: {name: round(value, 4) for name, value in values.items()} for stage, values in sorted(stages.items())
+        },
+        "checkpoint_latency_seconds": {
+            op: {name: round(value, 6) for name, value in values.items()} for op, values in sorted(checkpoint_ops.items())
+        },
+        "deepseek_concurrency_limit": metrics.get_gauge("deepseek_concurrency_limit"),
+        "deepseek_congestion_events": metrics.get_counter("deepseek_congestion_total"),
+        "endpoints": [
+            {key: round(value, 4) if isinstance(value, float) else value for key, value in row.items()}
+            for row in endpoint_stats()
+        ],
+        "input_tokens_saved": sum(
+            value for key, value in snapshot["counters"].items() if key.startswith("input_tokens_saved_total{")
+        ),
+        "stage3_calls_skipped": metrics.get_counter("stage3_calls_skipped_total"),
+        "degradation_changes": {
+            direction: metrics.get_counter("degradation_changes_total", direction=direction) for direction in ("up", "down")
+        },
+        "degraded": {
+            key[len('degraded_total{action="'):-2]: value
+            for key, value in snapshot["counters"].items() if key.startswith("degraded_total{")
+        },
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+        "tracemalloc_peak_mb": round(tracemalloc_peak / 1024 / 1024, 1) if tracemalloc_peak is not None else None,
+        "metrics": snapshot,
+    }
+
+def check_regression(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """
+    Сравнивает отчет с базовой линией и возвращает список найденных регрессий.
+    """
+    failures = []
+    for parameter in ("messages", "target_rate", "concurrency"):
+        if report.get(parameter) != baseline.get(parameter):
+            print(f"Внимание: параметр {parameter} отличается от базовой линии "
+                  f"({report.get(parameter)} против {baseline.get(parameter)}), сравнение может быть некорректным.")
+    if report["throughput_msgs_per_sec"] < baseline["throughput_msgs_per_sec"] * (1 - max_regression):
+        failures.append(
+            f"Пропускная способность {report['throughput_msgs_per_sec']} < базовой {baseline['throughput_msgs_per_sec']}"
+        )
+    if report["latency_seconds"]["p95"] > baseline["latency_seconds"]["p95"] * (1 + max_regression):
+        failures.append(
+            f"Задержка p95 {report['latency_seconds']['p95']} с > базовой {baseline['latency_seconds']['p95']} с"
+        )
+    if report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + max_regression):
+        failures.append(f"Пиковая память {report['peak_rss_mb']} МБ > базовой {baseline['peak_rss_mb']} МБ")
+    return failures
+
+def print_report(report: dict) -> None:
+    print(f"Сообщений: {report['messages']} за {report['duration_seconds']} с "
+          f"({report['throughput_msgs_per_sec']} сообщ./с), ошибок: {report['errors']}, переслано: {report['forwarded']}")
+    latency = report["latency_seconds"]
+    print(f"Задержка handle_message: p50={latency['p50']} с, p95={latency['p95']} с, p99={latency['p99']} с")
+    for stage, values in report["stage_latency_seconds"].items():
+        print(f"  {stage:<22} n={values['count']:<6} p50={values['p50']} с p95={values['p95']} с p99={values['p99']} с")
+    for op, values in report["checkpoint_latency_seconds"].items():
+        print(f"  checkpoint_{op:<11} n={values['count']:<6} p50={values['p50']} с p95={values['p95']} с p99={values['p99']} с")
+    print(f"Лимит одновременных запросов к Deepseek в конце прогона: {report['deepseek_concurrency_limit']} "
+          f"(сигналов перегрузки: {int(report['deepseek_congestion_events'])})")
+    for row in report["endpoints"]:
+        print(f"  {row['name']:<22} запросов={row['requests']:<6} ошибок={row['error_rate']:.1%} "
+              f"p50={row['p50']} с p95={row['p95']} с")
+    print(f"Сэкономлено входных токенов сокращением текста (оценка): {int(report['input_tokens_saved'])}")
+    print(f"Пропущено запросов третьего этапа (досрочное завершение): {int(report['stage3_calls_skipped'])}")
+    if report["degraded"]:
+        changes = report["degradation_changes"]
+        print(f"Смен уровня деградации: вверх {int(changes['up'])}, вниз {int(changes['down'])}; упрощений: "
+              + ", ".join(f"{action}={int(count)}" for action, count in sorted(report["degraded"].items())))
+    print(f"Пиковая память (RSS): {report['peak_rss_mb']} МБ", end="")
+    if report["tracemalloc_peak_mb"] is not None:
+        print(f", пик аллокаций Python: {report['tracemalloc_peak_mb']} МБ", end="")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк handle_message с заглушкой Deepseek.")
+    parser.add_argument("--messages", type=int, default=200, help="Количество сообщений.")
+    parser.add_argument("--rate", type=float, default=5.0, help="Сообщений в секунду (0 — закрытая нагрузка).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Число параллельных обработчиков при --rate 0.")
+    parser.add_argument("--threads", type=int, default=32, help="Размер пула потоков по умолчанию (запись в базу и другие вызовы asyncio.to_thread).")
+    parser.add_argument("--chats", type=int, default=1, help="Количество разных chat_id во входящих сообщениях.")
+    parser.add_argument("--telegram-latency-ms", type=float, default=0.0, help="Задержка отправки сообщения фейковым ботом, мс.")
+    parser.add_argument("--corpus", default=None, help="JSONL/CSV с сообщениями (по умолчанию — синтетические).")
+    parser.add_argument("--trace-memory", action="store_true", help="Включить tracemalloc (замедляет прогон).")
+    parser.add_argument("--verbose", action="store_true", help="Не подавлять вывод обработчиков.")
+    parser.add_argument("--output", default=None, help="Сохранить отчет в JSON.")
+    parser.add_argument("--baseline", default=None, help="JSON-отчет базовой линии для проверки регрессий.")
+    parser.add_argument("--save-baseline", default=None, help="Сохранить текущий отчет как базовую линию.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Допустимое ухудшение относительно базовой линии.")
+    add_mock_arguments(parser, "mock-")
+    args = parser.parse_args()
+
+    mock_process, api_url = start_mock_server(args)
+    database_dir = tempfile.mkdtemp(prefix="bench_")
+    configure_environment(api_url, os.path.join(database_dir, "stats.db"))
+
+    try:
+        corpus = load_corpus(args.corpus, args.messages) if args.corpus else generate_corpus(args.messages)
+
+        output_target = contextlib.nullcontext() if args.verbose else open(os.devnull, "w")
+        with output_target as devnull, contextlib.redirect_stdout(devnull or sys.stdout):
+            # Импорт модулей бота — только после настройки окружения
+            from handlers.message_handler import handle_message
+            from services import metrics
+            from utils.logger_config import setup_logging, shutdown_logging
+            # Журнал настраивается внутри перенаправления вывода, поэтому без --verbose записи
+            # форматируются и пишутся как обычно, но в /dev/null
+            setup_logging("load_test")
+            metrics.reset()
+            if args.trace_memory:
+                tracemalloc.start()
+            outcome = asyncio.run(drive(
+                handle_message, corpus, args.rate, args.concurrency, args.chats, args.threads, args.telegram_latency_ms / 1000
+            ))
+            tracemalloc_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+            shutdown_logging()
+    finally:
+        mock_process.terminate()
+
+    report = build_report(args, outcome, tracemalloc_peak)
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = check_regression(report, baseline, args.max_regression)
+        if failures:
+            print("РЕГРЕССИЯ:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("Регрессий относительно базовой линии не обнаружено.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+# benchmarks/mock_deepseek.py
+"""
+Локальная заглушка эндпоинта Deepseek chat completions для тестов и бенчмарков.
+
+Принимает те же запросы, что и https://api.deepseek.com/chat/completions, определяет этап
+пайплайна по тексту промпта и возвращает правдоподобный ответ в формате OpenAI:
+    * rule-based ответы (по умолчанию) — детерминированные по тексту промпта, с заданными
+      долями прохождения первого этапа;
+    * заготовленные ответы из JSON-файла (--canned) вида {"stage1": {...}, "stage3": {...}}.
+
+Задержка моделируется логнормальным распределением с заданной медианой плюс время
+"генерации" на каждый токен ответа; отдельно задаются доли ответов 500 и 429 и лимит одновременных запросов (сверх него — 429).
+
+Пример запуска:
+    python -m benchmarks.mock_deepseek --port 8099 --latency-ms 400 --error-rate 0.01
+    DEEPSEEK_API_URL=http://127.0.0.1:8099/chat/completions python3 main_bot_app.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import prompts
+
+# Этап определяется по фрагменту инструкции, входящему в промпт
+STAGE_MARKERS = (
+    ("stage3_explain", prompts.EXPLAIN_SCORE_INSTRUCTIONS),
+    ("stage1_batch", prompts.BATCH_FILTER_INSTRUCTIONS),
+    ("stage1", prompts.FILTER_INSTRUCTIONS),
+    ("stage2", prompts.CONTEXT_FILTRATION_INSTRUCTIONS),
+    ("stage3", prompts.EMOTION_INSTRUCTIONS),
+    ("stage3", prompts.IMAGE_INSTRUCTIONS),
+    ("stage3", prompts.HEROES_INSTRUCTIONS),
+    ("stage3", prompts.ACTUAL_INSTRUCTIONS),
+    ("stage3", prompts.DRAMA_INSTRUCTIONS),
+)
+
+# Новость внутри промпта первого этапа (одиночного или пакетного)
+NEWS_PATTERN = re.compile(r"Сообщение: (.*?)\nСсылка: ([^\n]*)", re.S)
+BATCH_ITEM_PATTERN = re.compile(r"Новость id=(\d+):\nСообщение: (.*?)\nСсылка: ([^\n]*)", re.S)
+
+CONTEXT_KEYS = ("subject", "object", "which", "action", "time_place", "how", "reason", "consequences")
+
+def detect_stage(prompt: str) -> str:
+    """
+    Определяет этап пайплайна по тексту промпта.
+    """
+    for stage, instructions in STAGE_MARKERS:
+        if instructions.strip()[:200] in prompt:
+            return stage
+    return "recommendations"
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов (для поля usage и моделирования времени генерации).
+    """
+    return max(1, len(text) // 3)
+
+class MockConfig:
+    """
+    Параметры поведения заглушки.
+    """
+    def __init__(
+        self,
+        latency_ms: float = 300.0,
+        latency_sigma: float = 0.3,
+        ms_per_token: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        max_concurrency: int = 0,
+        stage1_pass_rate: float = 0.7,
+        canned: dict | None = None,
+        seed: int = 0
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.ms_per_token = ms_per_token
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_concurrency = max_concurrency
+        self.inflight = 0
+        self.stage1_pass_rate = stage1_pass_rate
+        self.canned = canned or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        with self.lock:
+            return self.latency_ms / 1000 * math.exp(self.random.gauss(0, self.latency_sigma))
+
+    def enter(self) -> bool:
+        """
+        Учитывает начало запроса. Возвращает False, если превышен лимит одновременных запросов.
+        """
+        with self.lock:
+            if self.max_concurrency and self.inflight >= self.max_concurrency:
+                return False
+            self.inflight += 1
+            return True
+
+    def leave(self) -> None:
+        with self.lock:
+            self.inflight -= 1
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+def build_reply(stage: str, prompt: str, config: MockConfig) -> str:
+    """
+    Формирует текст ответа модели для этапа: заготовленный или rule-based.
+    Rule-based ответы зависят только от промпта, поэтому повторные прогоны дают те же решения.
+    """
+    if stage in config.canned:
+        canned = config.canned[stage]
+        return canned if isinstance(canned, str) else json.dumps(canned, ensure_ascii=False)
+
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    if stage == "stage1":
+        match = NEWS_PATTERN.search(prompt)
+        reply = stage1_verdict(match.group(1) if match else prompt, config)
+    elif stage == "stage1_batch":
+        reply = {"items": [
+            {"id": int(item_id), **stage1_verdict(news, config)}
+            for item_id, news, _ in BATCH_ITEM_PATTERN.findall(prompt)
+        ]}
+    elif stage == "stage2":
+        reply = {key: rng.randint(3, 10) for key in CONTEXT_KEYS}
+        reply["explain"] = "Ответ заглушки: оценки контекста сгенерированы по правилам."
+    elif stage == "stage3":
+        reply = {"score": rng.randint(0, 10)}
+        if prompts.SCORE_ONLY_INSTRUCTIONS.strip() not in prompt:
+            reply["explain"] = "Ответ заглушки: оценка характеристики сгенерирована по правилам."
+    elif stage == "stage3_explain":
+        return "Ответ заглушки: оценку определили яркие детали новости."
+    else:
+        return "Ответ заглушки: обыграйте неожиданный поворот новости и сделайте акцент на героях."
+    return json.dumps(reply, ensure_ascii=False)
+
+def stage1_verdict(news: str, config: MockConfig) -> dict:
+    """
+    Вердикт первого этапа зависит только от текста новости, поэтому одиночный
+    и пакетный запросы дают для нее одинаковый ответ.
+    """
+    rng = random.Random(hashlib.sha256(news.encode("utf-8")).digest())
+    verdict = "Да" if rng.random() < config.stage1_pass_rate else "Нет"
+    return {"filter": verdict, "explain": "Ответ заглушки: решение сгенерировано по правилам."}
+
+def make_handler(config: MockConfig):
+    class MockDeepseekHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass # Не засоряем вывод бенчмарка логами каждого запроса
+
+        def _send_json(self, status: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            prompt = "\n".join(message.get("content", "") for message in payload.get("messages", []))
+            stage = detect_stage(prompt)
+
+            # Имитация лимита аккаунта: запросы сверх max_concurrency сразу получают 429
+            if not config.enter():
+                self._send_json(429, {"error": {"message": "Too many concurrent requests (mock)"}}, {"Retry-After": "0.2"})
+                return
+            try:
+                self._respond(payload, prompt, stage)
+            finally:
+                config.leave()
+
+        def _respond(self, payload: dict, prompt: str, stage: str):
+            time.sleep(config.sample_latency())
+
+            roll = config.roll()
+            if roll < config.rate_limit_rate:
+                self._send_json(429, {"error": {"message": "Rate limit reached (mock)"}}, {"Retry-After": "1"})
+                return
+            if roll < config.rate_limit_rate + config.error_rate:
+                self._send_json(500, {"error": {"message": "Internal error (mock)"}})
+                return
+
+            reply = build_reply(stage, prompt, config)
+            completion_tokens = estimate_tokens(reply)
+            max_tokens = payload.get("max_tokens")
+            finish_reason = "stop"
+            if max_tokens and completion_tokens > max_tokens:
+                # Имитируем обрезку ответа по max_tokens
+                reply = reply[:max_tokens * 3]
+                completion_tokens = max_tokens
+                finish_reason = "length"
+            time.sleep(config.ms_per_token * completion_tokens / 1000)
+
+            self._send_json(200, {
+                "id": f"mock-{time.time_ns()}",
+                "object": "chat.completion",
+                "model": payload.get("model", "deepseek-chat"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": finish_reason
+                }],
+                "usage": {
+                    "prompt_tokens": estimate_tokens(prompt),
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": estimate_tokens(prompt) + completion_tokens
+                }
+            })
+
+    return MockDeepseekHandler
+
+def create_server(host: str, port: int, config: MockConfig) -> ThreadingHTTPServer:
+    """
+    Создает (но не запускает) HTTP-сервер заглушки. Порт 0 — выбрать свободный.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+def serve(host: str, port: int, config_kwargs: dict, ready_event=None, port_holder=None) -> None:
+    """
+    Запускает заглушку и обслуживает запросы до остановки процесса.
+    Параметры передаются словарем аргументов MockConfig, чтобы функцию можно было
+    запускать в отдельном процессе; ready_event/port_holder сообщают запустившему процессу порт.
+    """
+    server = create_server(host, port, MockConfig(**config_kwargs))
+    if port_holder is not None:
+        port_holder.value = server.server_address[1]
+    if ready_event is not None:
+        ready_event.set()
+    server.serve_forever()
+
+def add_mock_arguments(parser: argparse.ArgumentParser, prefix: str = "") -> None:
+    """
+    Добавляет параметры заглушки в argparse (используется и бенчмарком).
+    """
+    parser.add_argument(f"--{prefix}latency-ms", type=float, default=300.0, help="Медианная задержка ответа, мс.")
+    parser.add_argument(f"--{prefix}latency-sigma", type=float, default=0.3, help="Сигма логнормального распределения задержки.")
+    parser.add_argument(f"--{prefix}ms-per-token", type=float, default=0.0, help="Дополнительная задержка на каждый токен ответа, мс.")
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=0.0, help="Доля ответов 500.")
+    parser.add_argument(f"--{prefix}rate-limit-rate", type=float, default=0.0, help="Доля ответов 429.")
+    parser.add_argument(f"--{prefix}max-concurrency", type=int, default=0, help="Лимит одновременных запросов, сверх него — 429 (0 — без лимита).")
+    parser.add_argument(f"--{prefix}stage1-pass-rate", type=float, default=0.7, help="Доля сообщений, проходящих первый этап.")
+    parser.add_argument(f"--{prefix}canned", default=None, help="JSON-файл с заготовленными ответами по этапам.")
+
+def config_kwargs_from_args(args, prefix: str = "") -> dict:
+    values = vars(args)
+    attr = prefix.replace("-", "_")
+    canned = None
+    if values[f"{attr}canned"]:
+        with open(values[f"{attr}canned"], "r", encoding="utf-8") as f:
+            canned = json.load(f)
+    return {
+        "latency_ms": values[f"{attr}latency_ms"],
+        "latency_sigma": values[f"{attr}latency_sigma"],
+        "ms_per_token": values[f"{attr}ms_per_token"],
+        "error_rate": values[f"{attr}error_rate"],
+        "rate_limit_rate": values[f"{attr}rate_limit_rate"],
+        "max_concurrency": values[f"{attr}max_concurrency"],
+        "stage1_pass_rate": values[f"{attr}stage1_pass_rate"],
+        "canned": canned,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Deepseek chat completions.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    print(f"Заглушка Deepseek слушает http://{args.host}:{args.port}/chat/completions")
+    try:
+        serve(args.host, args.port, config_kwargs_from_args(args))
+    except KeyboardInterrupt:
+        print("Заглушка остановлена.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+# benchmarks/prompt_benchmark.py
+"""
+Сравнение вариантов промптов на размеченном эталонном корпусе.
+
+Прогоняет новости корпуса через выбранные этапы (первый, второй, характеристики третьего)
+для нескольких вариантов prompts.py и выводит рядом для каждого этапа: согласие с разметкой,
+среднее отклонение оценки, средние числа входных и выходных токенов (по полю usage ответов)
+и перцентили задержки. Промпты строятся теми же функциями, что и в боте
+(services/deepseek_processor.py), с сокращением текста по профилю этапа, а запросы идут
+через deepseek_request (профили этапов, JSON-режим, проверка схемы и попытка исправления).
+Первый этап всегда отправляется одиночными запросами, без пакетирования.
+
+Эталонный корпус — JSONL или CSV в формате tools/batch_replay.py (поле text и необязательное
+поле link) с разметкой: в JSONL — объект labels, в CSV — колонки с именами этапов:
+    stage1, stage2                          — ожидаемое решение: "Да"/"Нет" (или true/false);
+    emotion, image, heroes, actual, drama   — ожидаемая оценка 0-10.
+Этап прогоняется только для новостей, у которых есть его метка. Необязательное поле date
+задает текущую дату для промпта второго этапа (по умолчанию --date).
+
+Вариант — Python-файл с теми же именами, что в prompts.py (например, копия prompts.py из
+другой ревизии: git show HEAD~1:prompts.py > /tmp/prompts_old.py). Отсутствующие в файле
+промпты берутся из текущего prompts.py; текущий prompts.py всегда участвует как вариант current.
+
+Ответы можно записывать в хранилище (--responses, JSONL) и воспроизводить без обращения к API:
+    --mode live    — только API (по умолчанию без --responses);
+    --mode record  — записанные ответы берутся из хранилища, недостающие запрашиваются и дописываются;
+    --mode replay  — только хранилище, отсутствующий ответ считается ошибкой.
+Ключ записи — этап, модель, промпт и схема ответа, поэтому измененный промпт запрашивается заново.
+Для воспроизведенных ответов токены и задержка — записанные при первом запросе.
+
+Пример запуска:
+    python -m benchmarks.prompt_benchmark golden.jsonl --variant short=/tmp/prompts_short.py \\
+        --stages stage1,stage2 --responses data/prompt_responses.jsonl --output prompts_report.json
+    python -m benchmarks.prompt_benchmark golden.jsonl --mode replay --responses data/prompt_responses.jsonl \\
+        --baseline prompts_report.json
+Во втором случае код возврата 1, если согласие с разметкой упало больше чем на --max-agreement-drop
+или среднее число токенов выросло больше чем на --max-token-growth относительно базовой линии.
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+VERDICT_STAGES = ("stage1", "stage2")
+SCORE_STAGES = ("emotion", "image", "heroes", "actual", "drama")
+STAGES = VERDICT_STAGES + SCORE_STAGES
+# Псевдоним для всех характеристик третьего этапа в --stages
+STAGE_ALIASES = {"stage3": SCORE_STAGES}
+
+CURRENT_VARIANT = "current"
+
+def configure_environment(database_dir: str) -> None:
+    """
+    Настраивает окружение до импорта модулей бота: отдельные базы статистики и контрольных
+    точек, без бота логирования. Адрес и ключ Deepseek берутся из окружения как обычно.
+    """
+    os.environ["STATS_DATABASE_FILE"] = os.path.join(database_dir, "stats.db")
+    os.environ["CHECKPOINT_DATABASE_FILE"] = os.path.join(database_dir, "checkpoints.db")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    os.environ.setdefault("PRIVATE_GROUP_CHAT_ID", "-100")
+    os.environ["LOGGING_BOT_TOKEN"] = ""
+    os.environ["LOGGING_CHAT_ID"] = ""
+    os.environ.setdefault("LOG_DIR", "")
+
+def parse_stages(value: str) -> list[str]:
+    stages = []
+    for name in value.split(","):
+        name = name.strip()
+        for stage in STAGE_ALIASES.get(name, (name,)):
+            if stage not in STAGES:
+                raise argparse.ArgumentTypeError(f"неизвестный этап {stage}, доступны: {', '.join(STAGES)}, stage3")
+            if stage not in stages:
+                stages.append(stage)
+    return stages
+
+def normalize_label(stage: str, value):
+    """
+    Приводит метку к виду предсказания: "Да"/"Нет" для решений, целое число для оценок.
+    Пустая метка — None (этап для новости не прогоняется).
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if stage in SCORE_STAGES:
+        return int(float(value))
+    if isinstance(value, bool):
+        return "Да" if value else "Нет"
+    text = str(value).strip().lower()
+    if text in ("да", "yes", "true", "1"):
+        return "Да"
+    if text in ("нет", "no", "false", "0"):
+        return "Нет"
+    raise ValueError(f"Метка этапа {stage} должна быть \"Да\" или \"Нет\": {value!r}")
+
+def load_golden(path: str, default_date: str) -> list[dict]:
+    """
+    Загружает эталонный корпус: текст, ссылку, дату и метки по этапам.
+    """
+    from tools.batch_replay import detect_format, iter_input_items
+    from utils.telegram_utils import parse_news_message
+
+    items = []
+    for index, record in iter_input_items(path, detect_format(path)):
+        main_message, message_link = parse_news_message(record.get("text") or "")
+        if record.get("link"):
+            message_link = str(record["link"]).strip()
+        raw_labels = record.get("labels") if isinstance(record.get("labels"), dict) else record
+        labels = {}
+        for stage in STAGES:
+            try:
+                label = normalize_label(stage, raw_labels.get(stage))
+            except ValueError as e:
+                raise ValueError(f"Запись {index}: {e}") from None
+            if label is not None:
+                labels[stage] = label
+        items.append({
+            "index": index,
+            "text": main_message,
+            "link": message_link,
+            "date": record.get("date") or default_date,
+            "labels": labels,
+        })
+    return items
+
+def load_variant(path: str, current) -> tuple[types.SimpleNamespace, list[str]]:
+    """
+    Загружает вариант промптов из Python-файла поверх текущего prompts.py.
+    Возвращает набор промптов и список имен, отличающихся от текущих.
+    """
+    spec = importlib.util.spec_from_file_location(f"prompt_variant_{abs(hash(path))}", path)
+    if spec is None:
+        raise ValueError(f"Не удалось загрузить вариант промптов: {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    names = [name for name in dir(current) if name.isupper()]
+    overrides = {name: getattr(module, name) for name in dir(module) if name.isupper()}
+    unknown = sorted(set(overrides) - set(names))
+    if unknown:
+        print(f"Внимание: в варианте {path} есть имена, которых нет в prompts.py: {', '.join(unknown)}")
+    variant = types.SimpleNamespace(**{name: overrides.get(name, getattr(current, name)) for name in names})
+    changed = [name for name in names if getattr(variant, name) != getattr(current, name)]
+    return variant, changed
+
+class ResponseStore:
+    """
+    Хранилище записанных ответов (JSONL, по записи на строку). Пишется из нескольких потоков.
+    """
+    def __init__(self, path: str | None):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["key"]] = record
+
+    @staticmethod
+    def key(stage: str, model: str, prompt: str, schema_description: str | None) -> str:
+        payload = json.dumps([stage, model, prompt, schema_description], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            return self.records.get(key)
+
+    def put(self, record: dict) -> None:
+        with self._lock:
+            self.records[record["key"]] = record
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def build_request(stage: str, variant, item: dict) -> tuple[str, str, object]:
+    """
+    Строит запрос этапа для новости: (этап профиля, промпт, схема ответа).
+    """
+    from config.settings import STAGE3_LAZY_EXPLAIN
+    from services import deepseek_processor as processor
+
+    if stage == "stage1":
+        text = processor.fit_input("stage1", item["text"])
+        prompt = processor.initial_filtration_prompt(text, item["link"], variant.FILTER_INSTRUCTIONS)
+        return "stage1", prompt, processor.INITIAL_FILTRATION_SCHEMA
+    if stage == "stage2":
+        text = processor.fit_input("stage2", item["text"])
+        prompt = processor.context_filtration_prompt(text, item["date"], variant.CONTEXT_FILTRATION_INSTRUCTIONS)
+        return "stage2", prompt, processor.CONTEXT_FILTRATION_SCHEMA
+
+    # Рубрика характеристики: EMOTION_INSTRUCTIONS для emotion и т.д.
+    api_stage = next(name for key, name, *_ in processor.CHARACTERISTICS if key == stage)
+    instructions = getattr(variant, f"{stage.upper()}_INSTRUCTIONS")
+    if STAGE3_LAZY_EXPLAIN:
+        instructions += variant.SCORE_ONLY_INSTRUCTIONS
+    text = processor.fit_input(api_stage, item["text"])
+    schema = processor.SCORE_SCHEMA if STAGE3_LAZY_EXPLAIN else processor.EVALUATION_SCHEMA
+    return api_stage, processor.characteristic_prompt(text, instructions), schema
+
+def extract_prediction(stage: str, result: dict):
+    """
+    Решение или оценка этапа по ответу модели — так же, как их получает пайплайн.
+    """
+    from config.settings import CONTEXT_THRESHOLD
+    from services.deepseek_processor import CONTEXT_CRITERIA
+
+    if stage == "stage1":
+        return result.get("filter")
+    if stage == "stage2":
+        score = sum(result.get(key, 0) for key in CONTEXT_CRITERIA) / len(CONTEXT_CRITERIA)
+        return "Да" if score >= CONTEXT_THRESHOLD else "Нет"
+    return result.get("score", 0)
+
+def run_call(stage: str, variant, item: dict, store: ResponseStore, mode: str) -> dict:
+    """
+    Выполняет (или воспроизводит) один запрос и возвращает предсказание, токены и задержку.
+    """
+    from services.deepseek_service import deepseek_request, is_error_response, track_usage
+    from services.stage_profiles import get_stage_profile
+
+    api_stage, prompt, schema = build_request(stage, variant, item)
+    key = ResponseStore.key(api_stage, get_stage_profile(api_stage)["model"], prompt, schema.description)
+    record = store.get(key) if mode != "live" else None
+    replayed = record is not None
+    if record is None:
+        if mode == "replay":
+            return {"error": "нет записанного ответа"}
+        started_at = time.perf_counter()
+        with track_usage() as usage:
+            result = deepseek_request(prompt=prompt, response_schema=schema, stage=api_stage)
+        latency = time.perf_counter() - started_at
+        if is_error_response(result) or not isinstance(result, dict):
+            return {"error": str(result)[:200]}
+        record = {"key": key, "stage": api_stage, "result": result, "usage": usage, "latency": round(latency, 4)}
+        if mode == "record":
+            store.put(record)
+    return {
+        "prediction": extract_prediction(stage, record["result"]),
+        "prompt_tokens": record["usage"]["prompt_tokens"],
+        "completion_tokens": record["usage"]["completion_tokens"],
+        "latency": record["latency"],
+        "replayed": replayed,
+    }
+
+def summarize(stage: str, items: list[dict], outcomes: dict, score_tolerance: int) -> dict:
+    """
+    Сводка по этапу одного варианта: согласие с разметкой, токены и задержка.
+    """
+    from services.metrics import percentile
+
+    answered = [(item["labels"][stage], outcomes[item["index"]]) for item in items if "prediction" in outcomes[item["index"]]]
+    if stage in SCORE_STAGES:
+        agreed = sum(abs(outcome["prediction"] - label) <= score_tolerance for label, outcome in answered)
+        mae = sum(abs(outcome["prediction"] - label) for label, outcome in answered) / len(answered) if answered else None
+    else:
+        agreed = sum(outcome["prediction"] == label for label, outcome in answered)
+        mae = None
+    latencies = sorted(outcome["latency"] for _, outcome in answered)
+
+    def mean(field: str) -> float | None:
+        return round(sum(outcome[field] for _, outcome in answered) / len(answered), 1) if answered else None
+
+    return {
+        "labeled": len(items),
+        "answered": len(answered),
+        "errors": len(items) - len(answered),
+        "replayed": sum(outcome["replayed"] for _, outcome in answered),
+        "agreement": round(agreed / len(answered), 4) if answered else None,
+        "mae": round(mae, 3) if mae is not None else None,
+        "prompt_tokens_mean": mean("prompt_tokens"),
+        "completion_tokens_mean": mean("completion_tokens"),
+        "latency_seconds": {f"p{q}": round(percentile(latencies, q), 4) for q in (50, 95)},
+    }
+
+def run_benchmark(items: list[dict], variants: dict, stages: list[str], store: ResponseStore, mode: str,
+                  concurrency: int, score_tolerance: int) -> tuple[dict, dict]:
+    """
+    Прогоняет все варианты по всем этапам и возвращает (сводки, предсказания по новостям).
+    """
+    tasks = [
+        (name, stage, item)
+        for name in variants for stage in stages for item in items if stage in item["labels"]
+    ]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_call, stage, variants[name]["prompts"], item, store, mode)
+            for name, stage, item in tasks
+        ]
+        results = [future.result() for future in futures]
+
+    outcomes = {}
+    for (name, stage, item), result in zip(tasks, results):
+        outcomes.setdefault(name, {}).setdefault(stage, {})[item["index"]] = result
+
+    summaries, predictions = {}, {}
+    for name in variants:
+        summaries[name], predictions[name] = {}, {}
+        for stage in stages:
+            labeled = [item for item in items if stage in item["labels"]]
+            stage_outcomes = outcomes.get(name, {}).get(stage, {})
+            summaries[name][stage] = summarize(stage, labeled, stage_outcomes, score_tolerance)
+            predictions[name][stage] = {
+                str(index): outcome.get("prediction") for index, outcome in sorted(stage_outcomes.items())
+            }
+    return summaries, predictions
+
+def check_regression(report: dict, baseline: dict, max_agreement_drop: float, max_token_growth: float) -> list[str]:
+    """
+    Сравнивает отчет с базовой линией по вариантам и этапам, которые есть в обоих отчетах,
+    и возвращает список найденных регрессий. Задержка не проверяется: она зависит от нагрузки API.
+    """
+    failures = []
+    if report["items"] != baseline.get("items"):
+        print(f"Внимание: размер корпуса отличается от базовой линии ({report['items']} против {baseline.get('items')}).")
+    for name, variant in report["variants"].items():
+        for stage, summary in variant["stages"].items():
+            base = baseline.get("variants", {}).get(name, {}).get("stages", {}).get(stage)
+            if not base:
+                continue
+            if summary["errors"] > base["errors"]:
+                failures.append(f"{name}/{stage}: ошибок {summary['errors']} > базового {base['errors']}")
+            if summary["agreement"] is None or base["agreement"] is None:
+                continue
+            base_predictions = baseline.get("predictions", {}).get(name, {}).get(stage, {})
+            if summary["agreement"] < base["agreement"] - max_agreement_drop:
+                failures.append(f"{name}/{stage}: согласие {summary['agreement']:.1%} < базового {base['agreement']:.1%}")
+            for field in ("prompt_tokens_mean", "completion_tokens_mean"):
+                if base[field] and summary[field] > base[field] * (1 + max_token_growth):
+                    failures.append(f"{name}/{stage}: {field} {summary[field]} > базового {base[field]}")
+            changed = sum(
+                prediction != base_predictions[index]
+                for index, prediction in report["predictions"][name][stage].items()
+                if index in base_predictions
+            )
+            if changed:
+                print(f"{name}/{stage}: изменилось предсказаний относительно базовой линии: {changed}")
+    return failures
+
+def print_report(report: dict) -> None:
+    print(f"Корпус: {report['corpus']} ({report['items']} новостей), режим: {report['mode']}")
+    for name, variant in report["variants"].items():
+        if variant["changed"]:
+            print(f"  {name}: {variant['source']} (изменены: {', '.join(variant['changed'])})")
+    for stage in report["stages"]:
+        print()
+        print(f"{stage}:")
+        print(f"  {'вариант':<16} {'n':>4} {'ошибок':>6} {'согласие':>8} {'MAE':>5} {'ток.вх':>7} {'ток.вых':>7} {'p50, с':>7} {'p95, с':>7}")
+        for name, variant in report["variants"].items():
+            summary = variant["stages"][stage]
+            agreement = f"{summary['agreement']:.1%}" if summary["agreement"] is not None else "-"
+            mae = f"{summary['mae']:.2f}" if summary["mae"] is not None else "-"
+            latency = summary["latency_seconds"]
+            print(
+                f"  {name[:16]:<16} {summary['labeled']:>4} {summary['errors']:>6} {agreement:>8} {mae:>5} "
+                f"{summary['prompt_tokens_mean'] or 0:>7} {summary['completion_tokens_mean'] or 0:>7} "
+                f"{latency['p50']:>7} {latency['p95']:>7}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение вариантов промптов на размеченном корпусе.")
+    parser.add_argument("corpus", help="Эталонный корпус (JSONL или CSV) с полем text и метками этапов.")
+    parser.add_argument("--variant", action="append", default=[], metavar="ИМЯ=ФАЙЛ",
+                        help="Вариант промптов: Python-файл с именами из prompts.py (можно повторять).")
+    parser.add_argument("--stages", type=parse_stages, default=list(STAGES),
+                        help="Этапы через запятую: stage1, stage2, emotion, image, heroes, actual, drama, stage3 (все характеристики).")
+    parser.add_argument("--responses", default=None, help="JSONL-хранилище записанных ответов.")
+    parser.add_argument("--mode", choices=["live", "record", "replay"], default=None,
+                        help="live — только API, record — хранилище и API, replay — только хранилище.")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"), help="Текущая дата в промпте второго этапа.")
+    parser.add_argument("--score-tolerance", type=int, default=1, help="Допустимое отклонение оценки характеристики от метки.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Число одновременных запросов к API.")
+    parser.add_argument("--output", default=None, help="Сохранить отчет в JSON.")
+    parser.add_argument("--baseline", default=None, help="JSON-отчет базовой линии для проверки регрессий.")
+    parser.add_argument("--max-agreement-drop", type=float, default=0.02, help="Допустимое падение согласия с разметкой (доля).")
+    parser.add_argument("--max-token-growth", type=float, default=0.1, help="Допустимый относительный рост среднего числа токенов.")
+    args = parser.parse_args()
+
+    mode = args.mode or ("record" if args.responses else "live")
+    if mode != "live" and not args.responses:
+        parser.error(f"для --mode {mode} нужен --responses")
+    if args.concurrency < 1:
+        parser.error("--concurrency должен быть не меньше 1")
+
+    configure_environment(tempfile.mkdtemp(prefix="prompt_bench_"))
+    # Импорт модулей бота — только после настройки окружения
+    import prompts
+    from config.settings import CONTEXT_THRESHOLD, STAGE3_LAZY_EXPLAIN
+    from utils.logger_config import setup_logging
+    setup_logging("prompt_benchmark")
+
+    variants = {CURRENT_VARIANT: {"prompts": prompts, "source": "prompts.py", "changed": []}}
+    for spec in args.variant:
+        name, separator, path = spec.partition("=")
+        if not separator or not name or not path:
+            parser.error(f"--variant ожидается в виде ИМЯ=ФАЙЛ: {spec}")
+        if name in variants:
+            parser.error(f"вариант {name} указан дважды")
+        variant, changed = load_variant(path, prompts)
+        variants[name] = {"prompts": variant, "source": path, "changed": changed}
+
+    try:
+        items = load_golden(args.corpus, args.date)
+    except ValueError as e:
+        parser.error(str(e))
+    unlabeled = [stage for stage in args.stages if not any(stage in item["labels"] for item in items)]
+    if unlabeled:
+        print(f"Этапы без меток в корпусе пропущены: {', '.join(unlabeled)}")
+    stages = [stage for stage in args.stages if stage not in unlabeled]
+    store = ResponseStore(args.responses)
+
+    started_at = time.perf_counter()
+    summaries, predictions = run_benchmark(
+        items, variants, stages, store, mode, args.concurrency, args.score_tolerance
+    )
+    report = {
+        "corpus": args.corpus,
+        "items": len(items),
+        "mode": mode,
+        "stages": stages,
+        "settings": {
+            "context_threshold": CONTEXT_THRESHOLD,
+            "stage3_lazy_explain": STAGE3_LAZY_EXPLAIN,
+            "score_tolerance": args.score_tolerance,
+        },
+        "duration_seconds": round(time.perf_counter() - started_at, 3),
+        "variants": {
+            name: {"source": variant["source"], "changed": variant["changed"], "stages": summaries[name]}
+            for name, variant in variants.items()
+        },
+        "predictions": predictions,
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = check_regression(report, baseline, args.max_agreement_drop, args.max_token_growth)
+        if failures:
+            print("РЕГРЕССИЯ:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("Регрессий относительно базовой линии не обнаружено.")
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,24 @@
 # config/settings.py
 import os
+import json
+import logging
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Загружаем переменные окружения из файла .env
 load_dotenv()
 
+def _env_flag(name: str, default: bool) -> bool:
+    """
+    Читает флаг из переменной окружения: "true", "1", "yes" или "on" (без учета регистра) — включен,
+    любое другое непустое значение — выключен, пустое или отсутствующее — default.
+    """
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return default
+    return value in ("true", "1", "yes", "on")
+
 # Получаем токен основного Telegram-бота из переменных окружения
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
@@ -15,6 +29,73 @@ PRIVATE_GROUP_CHAT_ID = os.getenv("PRIVATE_GROUP_CHAT_ID")
 # Получаем API ключ Deepseek
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 
+# URL эндпоинта chat completions (можно указать локальную заглушку для тестов и бенчмарков)
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/chat/completions")
+
+# Пул конечных точек (services/endpoint_pool.py): JSON-список участников, например
+# DEEPSEEK_ENDPOINTS='[{"name": "main", "key": "sk-1", "weight": 2}, {"key": "sk-2"}, {"url": "http://127.0.0.1:8000/v1", "model": "local"}]'.
+# Подходит любой OpenAI-совместимый API; url — полный адрес chat/completions или базовый адрес.
+# Необязательные поля: url (по умолчанию DEEPSEEK_API_URL), key (DEEPSEEK_API_KEY), weight (1),
+# model (модель из профиля этапа), name (хост). Пустое значение — один участник DEEPSEEK_API_URL.
+DEEPSEEK_ENDPOINTS = json.loads(os.getenv("DEEPSEEK_ENDPOINTS") or "[]")
+# Участник пула исключается из маршрутизации после DEEPSEEK_EJECT_AFTER_FAILURES ошибок подряд
+# (таймаут, ошибка соединения, 429, 5xx) на DEEPSEEK_EJECT_SECONDS, умноженные на число исключений
+# подряд, но не больше DEEPSEEK_EJECT_MAX_SECONDS
+DEEPSEEK_EJECT_AFTER_FAILURES = int(os.getenv("DEEPSEEK_EJECT_AFTER_FAILURES", 3))
+DEEPSEEK_EJECT_SECONDS = float(os.getenv("DEEPSEEK_EJECT_SECONDS", 30))
+DEEPSEEK_EJECT_MAX_SECONDS = float(os.getenv("DEEPSEEK_EJECT_MAX_SECONDS", 300))
+
+# Одновременные запросы к Deepseek: лимит подбирается автоматически (AIMD) по ответам 429,
+# таймаутам и росту задержки в пределах от MIN до MAX. При DEEPSEEK_ADAPTIVE_CONCURRENCY=false
+# лимит фиксирован и равен DEEPSEEK_CONCURRENCY_INITIAL.
+DEEPSEEK_ADAPTIVE_CONCURRENCY = _env_flag("DEEPSEEK_ADAPTIVE_CONCURRENCY", True)
+DEEPSEEK_CONCURRENCY_INITIAL = int(os.getenv("DEEPSEEK_CONCURRENCY_INITIAL", 8))
+DEEPSEEK_CONCURRENCY_MIN = int(os.getenv("DEEPSEEK_CONCURRENCY_MIN", 1))
+DEEPSEEK_CONCURRENCY_MAX = int(os.getenv("DEEPSEEK_CONCURRENCY_MAX", 64))
+DEEPSEEK_LATENCY_TOLERANCE = float(os.getenv("DEEPSEEK_LATENCY_TOLERANCE", 3.0)) # Во сколько раз задержка может превысить минимальную (0 — не учитывать)
+DEEPSEEK_RATE_LIMIT_RETRIES = int(os.getenv("DEEPSEEK_RATE_LIMIT_RETRIES", 2)) # Повторы запроса после ответа 429 (и после сбоя участника пула, если есть другой)
+
+# Профили запросов по этапам: модель, максимальная длина ответа, температура (None — по умолчанию API)
+# и бюджет на текст новости в промпте input_tokens (оценка utils.text_trimming.estimate_tokens;
+# более длинный текст сокращается, None — без сокращения).
+# Любое поле можно переопределить JSON-строкой в DEEPSEEK_STAGE_PROFILES, например:
+# DEEPSEEK_STAGE_PROFILES='{"stage1": {"max_tokens": 150}, "recommendations": {"temperature": 0.7}}'
+STAGE_PROFILES = {
+    "stage1": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 800},
+    "stage2": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 1200},
+    "stage3_emotion": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 800},
+    "stage3_image": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 800},
+    "stage3_heroes": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 800},
+    "stage3_actual": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 800},
+    "stage3_drama": {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": 800},
+    # Примерно 50 токенов на предложение рекомендации
+    "recommendations": {"model": "deepseek-chat", "max_tokens": 200, "temperature": None, "input_tokens": 800},
+    # Пакетный запрос первого этапа: max_tokens = min(этого значения, max_tokens stage1 * размер пакета)
+    "stage1_batch": {"model": "deepseek-chat", "max_tokens": 4000, "temperature": None, "input_tokens": None},
+}
+# Объяснения к оценкам третьего этапа в режиме STAGE3_LAZY_EXPLAIN (1-2 предложения)
+for _characteristic in ("emotion", "image", "heroes", "actual", "drama"):
+    STAGE_PROFILES[f"stage3_{_characteristic}_explain"] = {"model": "deepseek-chat", "max_tokens": 150, "temperature": None, "input_tokens": 800}
+for _stage, _overrides in json.loads(os.getenv("DEEPSEEK_STAGE_PROFILES") or "{}").items():
+    STAGE_PROFILES.setdefault(_stage, {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": None}).update(_overrides)
+
+# Пакетная обработка первого этапа: если к моменту запроса уже выполняется другой запрос
+# первого этапа, сообщения копятся до STAGE1_BATCH_SIZE штук или STAGE1_BATCH_MAX_WAIT_MS мс
+# и отправляются одним запросом. STAGE1_BATCH_SIZE=1 отключает пакетную обработку.
+STAGE1_BATCH_SIZE = int(os.getenv("STAGE1_BATCH_SIZE", 1))
+STAGE1_BATCH_MAX_WAIT_MS = int(os.getenv("STAGE1_BATCH_MAX_WAIT_MS", 200))
+
+# Автоподбор max_tokens: после DEEPSEEK_AUTO_MAX_TOKENS_MIN_SAMPLES ответов этапа max_tokens
+# устанавливается по p99 длины ответа с запасом (но не больше значения из профиля).
+# Обрезанный ответ (finish_reason=length) логируется и повторяется с max_tokens из профиля.
+DEEPSEEK_AUTO_MAX_TOKENS = _env_flag("DEEPSEEK_AUTO_MAX_TOKENS", False)
+DEEPSEEK_AUTO_MAX_TOKENS_MIN_SAMPLES = int(os.getenv("DEEPSEEK_AUTO_MAX_TOKENS_MIN_SAMPLES", 100))
+DEEPSEEK_AUTO_MAX_TOKENS_MARGIN = float(os.getenv("DEEPSEEK_AUTO_MAX_TOKENS_MARGIN", 1.3)) # Множитель к p99
+
+# Теневое сравнение: для этой доли сокращенных текстов в фоне выполняется запрос с полным
+# текстом, и вердикты сравниваются (метрики trim_shadow_*). 0 — сравнение отключено.
+INPUT_TRIM_SHADOW_RATE = float(os.getenv("INPUT_TRIM_SHADOW_RATE", 0.0))
+
 # Получаем токен бота для логирования
 LOGGING_BOT_TOKEN = os.getenv("LOGGING_BOT_TOKEN")
 
@@ -28,6 +109,126 @@ CONTEXT_THRESHOLD = int(os.getenv("CONTEXT_THRESHOLD", 6))
 MAX_POTENTIAL = int(os.getenv("MAX_POTENTIAL", 8)) # Порог для одной из оценок (эмоции, образность и т.д.)
 SUM_POTENTIAL = float(os.getenv("SUM_POTENTIAL", 6.5)) # Порог для суммы всех 5 оценок
 
+# Досрочное завершение третьего этапа: характеристики оцениваются по очереди, и как только даже
+# максимальные оценки оставшихся не позволят набрать SUM_POTENTIAL, остальные запросы не выполняются
+# (их оценки сохраняются как NULL). Отключается на время сбора полных оценок для подбора порогов.
+STAGE3_EARLY_EXIT = _env_flag("STAGE3_EARLY_EXIT", True)
+# Как часто (в секундах) пересчитывать порядок характеристик по истории pipeline_results
+STAGE3_ORDER_REFRESH_SECONDS = int(os.getenv("STAGE3_ORDER_REFRESH_SECONDS", 3600))
+# Ленивые объяснения: запросы третьего этапа возвращают только оценку, а объяснения запрашиваются
+# отдельно и только для характеристик с оценкой не ниже MAX_POTENTIAL у прошедших сообщений
+# (они нужны для рекомендаций). Ответы короче, большинство отклоненных сообщений объяснений не получают.
+STAGE3_LAZY_EXPLAIN = _env_flag("STAGE3_LAZY_EXPLAIN", False)
+
+# Режим обработки сообщений основным ботом:
+# "inline"    — фильтрация прямо в обработчике сообщения (по умолчанию);
+# "scheduled" — обработчик ставит сообщение во внутренний планировщик (services/scheduler.py),
+#               который выбирает сначала начатые, затем самые свежие сообщения
+#               с разделением обработки между чатами;
+# "queue"     — обработчик только ставит сообщение в очередь, фильтрацию выполняют воркеры (worker_app.py)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "inline")
+
+# Параметры планировщика (используются в режиме "scheduled")
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", 4)) # Сообщений в обработке одновременно
+SCHEDULER_STALE_AFTER_SECONDS = int(os.getenv("SCHEDULER_STALE_AFTER_SECONDS", 900)) # Возраст, после которого новость считается устаревшей
+SCHEDULER_STALE_POLICY = os.getenv("SCHEDULER_STALE_POLICY", "drop") # "drop" — отбрасывать, "fast_track" — обрабатывать вне очереди
+SCHEDULER_DROP_REPORT_SECONDS = int(os.getenv("SCHEDULER_DROP_REPORT_SECONDS", 60)) # Период сводки об отброшенных сообщениях в чат логирования
+# Справедливая очередь по чатам: вес чата задает его долю обработки при конкуренции,
+# max_inflight — сколько его сообщений может обрабатываться одновременно (0 — без лимита).
+# Отдельные чаты настраиваются JSON-строкой, например:
+# SCHEDULER_CHAT_POLICIES='{"-1001234567890": {"weight": 3}, "-1009876543210": {"max_inflight": 1}}'
+SCHEDULER_CHAT_WEIGHT = float(os.getenv("SCHEDULER_CHAT_WEIGHT", 1.0))
+SCHEDULER_CHAT_MAX_INFLIGHT = int(os.getenv("SCHEDULER_CHAT_MAX_INFLIGHT", 0))
+SCHEDULER_CHAT_POLICIES = json.loads(os.getenv("SCHEDULER_CHAT_POLICIES") or "{}")
+
+# Побочные действия после решения по сообщению (services/side_effects.py): сохранение результата,
+# пересылка и лог выполняются фоновыми задачами, не больше SIDE_EFFECT_CONCURRENCY одновременно.
+# При остановке бот ждет их завершения не дольше SIDE_EFFECT_DRAIN_SECONDS секунд.
+SIDE_EFFECT_CONCURRENCY = int(os.getenv("SIDE_EFFECT_CONCURRENCY", 16))
+SIDE_EFFECT_DRAIN_SECONDS = float(os.getenv("SIDE_EFFECT_DRAIN_SECONDS", 30))
+
+# Пакетный ввод (utils/bulk_input.py): в одном сообщении новости разделяются строкой
+# BULK_ITEM_SEPARATOR, также принимаются документы JSONL/CSV/TXT. В режиме inline новости
+# всех пакетов обрабатываются не больше BULK_CONCURRENCY одновременно (в режиме scheduled —
+# через планировщик); больше BULK_MAX_ITEMS новостей или документ больше
+# BULK_MAX_DOCUMENT_BYTES не принимаются.
+BULK_ITEM_SEPARATOR = os.getenv("BULK_ITEM_SEPARATOR", "2222")
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 8))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 500))
+BULK_MAX_DOCUMENT_BYTES = int(os.getenv("BULK_MAX_DOCUMENT_BYTES", 5 * 1024 * 1024))
+
+# Режимы деградации при перегрузке (services/degradation.py). Уровни задаются JSON-списком:
+# уровень N включается, когда число сообщений в очереди и в обработке достигает queue_depth
+# или p95 времени обработки за DEGRADATION_WINDOW_SECONDS — latency_p95 (секунды), и действуют
+# действия уровней 1..N:
+#   skip_recommendations — рекомендации к комментарию не запрашиваются;
+#   cheap_stage3         — третий этап только с оценками (без объяснений) и с досрочным завершением;
+#   raise_stage2_bar     — порог второго этапа выше на DEGRADATION_STAGE2_THRESHOLD_BOOST;
+#   sample_logs          — лог отклоненных сообщений отправляется для доли DEGRADATION_LOG_SAMPLE_RATE.
+# Например: DEGRADATION_LEVELS='[{"queue_depth": 50, "latency_p95": 60, "actions": ["skip_recommendations"]},
+#   {"queue_depth": 150, "actions": ["cheap_stage3", "sample_logs"]}, {"queue_depth": 400, "actions": ["raise_stage2_bar"]}]'
+# Пустой список (по умолчанию) — деградация выключена. Нагрузка проверяется раз в DEGRADATION_CHECK_SECONDS;
+# уровень снижается на один, когда сигналы держатся ниже DEGRADATION_RECOVERY_RATIO от порогов
+# текущего уровня не меньше DEGRADATION_RECOVERY_SECONDS.
+DEGRADATION_LEVELS = json.loads(os.getenv("DEGRADATION_LEVELS") or "[]")
+DEGRADATION_CHECK_SECONDS = float(os.getenv("DEGRADATION_CHECK_SECONDS", 5))
+DEGRADATION_WINDOW_SECONDS = float(os.getenv("DEGRADATION_WINDOW_SECONDS", 60))
+DEGRADATION_RECOVERY_RATIO = float(os.getenv("DEGRADATION_RECOVERY_RATIO", 0.7))
+DEGRADATION_RECOVERY_SECONDS = float(os.getenv("DEGRADATION_RECOVERY_SECONDS", 120))
+DEGRADATION_STAGE2_THRESHOLD_BOOST = float(os.getenv("DEGRADATION_STAGE2_THRESHOLD_BOOST", 1))
+DEGRADATION_LOG_SAMPLE_RATE = float(os.getenv("DEGRADATION_LOG_SAMPLE_RATE", 0.1))
+
+# Параметры очереди задач (используются в режиме "queue")
+QUEUE_DATABASE_FILE = os.getenv("QUEUE_DATABASE_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/queue.db')
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", 2)) # Количество процессов-воркеров
+QUEUE_WORKER_CONCURRENCY = int(os.getenv("QUEUE_WORKER_CONCURRENCY", 2)) # Задач одновременно в одном воркере
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", 300)) # Через сколько секунд "зависшая" задача вернется в очередь
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", 5)) # После стольких неудачных попыток задача помечается как failed
+
+# Контрольные точки этапов: ответы Deepseek сохраняются по ключу сообщения сразу после
+# получения, и после перезапуска обработка продолжается без повторных запросов
+CHECKPOINTS_ENABLED = _env_flag("CHECKPOINTS_ENABLED", True)
+CHECKPOINT_DATABASE_FILE = os.getenv("CHECKPOINT_DATABASE_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/checkpoints.db')
+CHECKPOINT_RETENTION_HOURS = int(os.getenv("CHECKPOINT_RETENTION_HOURS", 72)) # Сколько хранить контрольные точки
+CHECKPOINT_PRUNE_EVERY = int(os.getenv("CHECKPOINT_PRUNE_EVERY", 500)) # Через сколько сохранений удалять устаревшие контрольные точки
+RESUME_MAX_ATTEMPTS = int(os.getenv("RESUME_MAX_ATTEMPTS", 3)) # После стольких попыток дообработки незавершенное сообщение отбрасывается
+RESUME_CONCURRENCY = int(os.getenv("RESUME_CONCURRENCY", 4)) # Незавершенных сообщений, дообрабатываемых одновременно
+
+# Журналирование (utils/logger_config.py): записи передаются через очередь в отдельный поток,
+# который пишет их в консоль и в файл LOG_DIR/<компонент>.log с ротацией по размеру
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower() # Формат вывода в консоль: "json" (JSON Lines) или "text"
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '../logs')) # Пустая строка — без файла
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)) # Размер файла, после которого он ротируется
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5)) # Сколько старых файлов хранить
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000)) # При переполнении очереди записи отбрасываются
+# Доля сообщений, для которых пишутся DEBUG-записи (тексты новостей, ответы по этапам).
+# Выборка делается по ключу сообщения, поэтому для выбранного сообщения пишутся все его записи.
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.1))
+
+# Трассировка обработки сообщений (services/tracing.py): трассы в формате OTLP/JSON пишутся
+# в TRACE_FILE по строке на трассу. Сохраняется доля TRACE_SAMPLE_RATE трасс (выборка по ключу
+# сообщения) и всегда — трассы дольше TRACE_SLOW_SECONDS или с ошибками. Пустая строка — без трассировки.
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(LOG_DIR, "traces.jsonl") if LOG_DIR else "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", 30))
+
+# Команда /profile бота логирования (services/profiler.py): интервал между снимками стеков
+# потоков, максимальная длительность профилирования и число строк в таблице ответа
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 120))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", 20))
+
+# Наблюдение за памятью (services/memory_watchdog.py): раз в MEMORY_WATCHDOG_INTERVAL_SECONDS
+# проверяется RSS процесса, и при росте на MEMORY_ALERT_GROWTH_MB с начала наблюдения или с прошлого
+# предупреждения в чат логирования отправляется отчет о местах выделения памяти (0 — без наблюдения).
+# MEMORY_TRACEMALLOC_FRAMES — глубина стека, которую запоминает tracemalloc (0 — tracemalloc
+# не включается), MEMORY_TOP_N — число строк в отчетах и в ответе на /memory
+MEMORY_WATCHDOG_INTERVAL_SECONDS = float(os.getenv("MEMORY_WATCHDOG_INTERVAL_SECONDS", 300))
+MEMORY_ALERT_GROWTH_MB = float(os.getenv("MEMORY_ALERT_GROWTH_MB", 100))
+MEMORY_TRACEMALLOC_FRAMES = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", 1))
+MEMORY_TOP_N = int(os.getenv("MEMORY_TOP_N", 10))
+
 
 # Проверяем, что все необходимые переменные загружены
 if not TELEGRAM_BOT_TOKEN:
@@ -35,10 +236,10 @@ if not TELEGRAM_BOT_TOKEN:
 if not PRIVATE_GROUP_CHAT_ID:
     raise ValueError("Переменная окружения PRIVATE_GROUP_CHAT_ID не установлена.")
 if not LOGGING_BOT_TOKEN:
-    print("Внимание: Переменная окружения LOGGING_BOT_TOKEN не установлена. Функционал команд /stats и /zero будет недоступен.")
+    logger.warning("Переменная окружения LOGGING_BOT_TOKEN не установлена. Функционал команд /stats и /zero будет недоступен.")
 if not LOGGING_CHAT_ID:
-    print("Внимание: Переменная окружения LOGGING_CHAT_ID не установлена. Логирование в отдельный чат может быть недоступно.")
+    logger.warning("Переменная окружения LOGGING_CHAT_ID не установлена. Логирование в отдельный чат может быть недоступно.")
 
-if not DEEPSEEK_API_KEY:
-    print("Внимание: Переменная окружения DEEPSEEK_API_KEY не установлена. Функционал Deepseek может быть ограничен.")
+if not DEEPSEEK_API_KEY and not DEEPSEEK_ENDPOINTS:
+    logger.warning("Переменная окружения DEEPSEEK_API_KEY не установлена. Функционал Deepseek может быть ограничен.")
 
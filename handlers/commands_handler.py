@@ -1,15 +1,45 @@
 # handlers/commands_handler.py
+import asyncio
+import html
+import io
+import logging
+import os
+import tempfile
+from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 from services.database_service import get_stats, reset_stats
-from config.settings import LOGGING_CHAT_ID
-from telegram.constants import ParseMode # Import ParseMode
+from services.deepseek_service import endpoint_stats
+from services.export_service import EXPORT_FORMATS, EXPORT_TABLES, export_table
+from services import memory_watchdog, metrics, profiler
+from config.settings import LOGGING_CHAT_ID, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_MAX_SECONDS, PROFILE_TOP_N, MEMORY_TOP_N
+from telegram.constants import MessageLimit, ParseMode # Import ParseMode
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Bot API на размер отправляемого ботом файла
+TELEGRAM_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+async def _reject_outside_logging_chat(update: Update) -> bool:
+    """
+    Отвечает отказом и возвращает True, если команда пришла не из чата логирования.
+    Если LOGGING_CHAT_ID не задан, команда недоступна нигде: она выгружает данные
+    или сведения о процессе, которые нельзя отдавать произвольному чату.
+    """
+    if LOGGING_CHAT_ID and str(update.effective_chat.id) == LOGGING_CHAT_ID:
+        return False
+    if LOGGING_CHAT_ID:
+        await update.message.reply_text("Эта команда доступна только в чате логирования.")
+    else:
+        await update.message.reply_text("Команда недоступна: не задан LOGGING_CHAT_ID.")
+    logger.warning("Команда %s отклонена для чата %s.", update.message.text, update.effective_chat.id)
+    return True
 
 async def handle_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Обрабатывает команду /stats.
-    Отправляет пользователю статистику по входящим/исходящим сообщениям
-    (общее количество и за последние 24 часа).
+    Отправляет пользователю статистику по входящим/исходящим сообщениям и запросам,
+    сэкономленным досрочным завершением третьего этапа (общее количество и за последние 24 часа).
     """
     # Проверяем, что команда пришла от пользователя, который имеет право ее использовать,
     # например, из LOGGING_CHAT_ID, если это чат для администрирования.
@@ -31,15 +61,17 @@ async def handle_stats_command(update: Update, context: ContextTypes.DEFAULT_TYP
         "*Общая статистика:*\n"
         f"  Входящих сообщений: `{stats['total_incoming']}`\n"
         f"  Исходящих сообщений \\(переслано\\): `{stats['total_outgoing']}`\n" # Escaped parentheses
-        f"  Процент пересылки: `{stats['total_percentage']:.2f}\\%`\n\n"      # Escaped percentage sign
+        f"  Процент пересылки: `{stats['total_percentage']:.2f}\\%`\n"      # Escaped percentage sign
+        f"  Сэкономлено запросов этапа 3: `{stats['total_skipped_calls']}`\n\n"
         "*За последние 24 часа:*\n"
         f"  Входящих сообщений: `{stats['last_24h_incoming']}`\n"
         f"  Исходящих сообщений \\(переслано\\): `{stats['last_24h_outgoing']}`\n" # Escaped parentheses
-        f"  Процент пересылки: `{stats['last_24h_percentage']:.2f}\\%`"      # Escaped percentage sign
+        f"  Процент пересылки: `{stats['last_24h_percentage']:.2f}\\%`\n"      # Escaped percentage sign
+        f"  Сэкономлено запросов этапа 3: `{stats['last_24h_skipped_calls']}`"
     )
     
     await update.message.reply_text(response_text, parse_mode=ParseMode.MARKDOWN_V2)
-    print(f"Статистика отправлена пользователю {update.effective_user.id}.")
+    logger.info("Статистика отправлена пользователю %s.", update.effective_user.id)
 
 async def handle_zero_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -54,5 +86,157 @@ async def handle_zero_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     reset_stats()
     # The existing `\.` is correct for MarkdownV2
     await update.message.reply_text("Все счетчики сообщений сброшены до нуля\\.", parse_mode=ParseMode.MARKDOWN_V2)
-    print(f"Счетчики сброшены пользователем {update.effective_user.id}.")
+    logger.info("Счетчики сброшены пользователем %s.", update.effective_user.id)
+
+async def handle_export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /export [таблица] [формат] [с] [по].
+    Выгружает message_logs или pipeline_results (по умолчанию) за период [с, по) в CSV
+    (по умолчанию) или Parquet и отправляет файл в чат.
+    """
+    if await _reject_outside_logging_chat(update):
+        return
+
+    args = list(context.args or [])
+    table = args.pop(0) if args and args[0] in EXPORT_TABLES else "pipeline_results"
+    export_format = args.pop(0) if args and args[0] in EXPORT_FORMATS else "csv"
+    since = args.pop(0) if args else None
+    until = args.pop(0) if args else None
+
+    fd, path = tempfile.mkstemp(suffix=f".{export_format}")
+    os.close(fd)
+    try:
+        # Выгрузка читает базу пачками в отдельном потоке, не блокируя цикл событий
+        exported = await asyncio.to_thread(export_table, table, path, export_format, since, until)
+        if os.path.getsize(path) > TELEGRAM_MAX_UPLOAD_BYTES:
+            await update.message.reply_text(
+                f"Файл выгрузки больше 50 МБ ({exported} строк). Сузьте период или используйте python -m tools.export_history."
+            )
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"{table}.{export_format}",
+                caption=f"{table}: {exported} строк"
+            )
+        logger.info("Выгрузка %s (%d строк) отправлена пользователю %s.", table, exported, update.effective_user.id)
+    except (ValueError, RuntimeError) as e:
+        await update.message.reply_text(f"Выгрузка не выполнена: {e}")
+    finally:
+        os.remove(path)
+
+async def handle_profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /profile [секунды].
+    Профилирует процесс бота заданное время (по умолчанию 10 с, не больше PROFILE_MAX_SECONDS)
+    и отправляет таблицу функций с наибольшим собственным временем и файл свернутых стеков
+    для построения flame graph.
+    """
+    if await _reject_outside_logging_chat(update):
+        return
+
+    try:
+        seconds = float(context.args[0]) if context.args else 10.0
+    except ValueError:
+        await update.message.reply_text("Использование: /profile [секунды]")
+        return
+    seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+    if profiler.is_running():
+        await update.message.reply_text("Профилирование уже выполняется, дождитесь результата.")
+        return
+
+    await update.message.reply_text(f"Профилирование процесса: {seconds:g} с...")
+    logger.info("Профилирование на %s с запущено пользователем %s.", seconds, update.effective_user.id)
+    result = await profiler.profile_for(seconds, PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+    # Доли — от числа стеков активных потоков (простаивающие потоки не учитываются)
+    active = max(result.active, 1)
+    lines = [
+        f"Снимков: {result.samples} за {result.duration:.1f} с, стеков активных потоков: {result.active}, простаивающих: {result.idle}",
+        "",
+        f"{'собств.':>7} {'всего':>6}  функция",
+    ]
+    for frame, own, total in result.top_functions(PROFILE_TOP_N):
+        lines.append(f"{own / active:>7.1%} {total / active:>6.1%}  {frame[:70]}")
+    await update.message.reply_text(f"<pre>{html.escape(chr(10).join(lines))}</pre>", parse_mode=ParseMode.HTML)
+
+    collapsed = io.BytesIO(result.collapsed().encode("utf-8"))
+    await update.message.reply_document(
+        document=collapsed,
+        filename=f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded",
+        caption="Свернутые стеки (flamegraph.pl, speedscope)"
+    )
+
+async def handle_memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /memory.
+    Отправляет RSS процесса, крупнейшие места выделения памяти по tracemalloc
+    и их изменение с предыдущего снимка.
+    """
+    if await _reject_outside_logging_chat(update):
+        return
+
+    logger.info("Отчет о памяти запрошен пользователем %s.", update.effective_user.id)
+    report = await asyncio.to_thread(memory_watchdog.memory_report, MEMORY_TOP_N)
+    await update.message.reply_text(f"<pre>{html.escape(report)}</pre>", parse_mode=ParseMode.HTML)
+
+async def handle_endpoints_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /endpoints.
+    Отправляет сводку по участникам пула конечных точек Deepseek: запросы, доля ошибок,
+    задержка p50/p95, запросы в работе и оставшееся время исключения.
+    """
+    if await _reject_outside_logging_chat(update):
+        return
+
+    lines = [f"{'участник':<24} {'вес':>4} {'запросов':>8} {'ошибок':>7} {'p50, с':>7} {'p95, с':>7} {'в работе':>8}  состояние"]
+    for row in endpoint_stats():
+        state = f"исключен еще на {row['ejected_seconds']:.0f} с" if row["ejected_seconds"] else "в работе"
+        lines.append(
+            f"{row['name'][:24]:<24} {row['weight']:>4g} {row['requests']:>8} {row['error_rate']:>7.1%} "
+            f"{row['p50']:>7.2f} {row['p95']:>7.2f} {row['inflight']:>8}  {state}"
+        )
+    await update.message.reply_text(f"<pre>{html.escape(chr(10).join(lines))}</pre>", parse_mode=ParseMode.HTML)
+    logger.info("Сводка по пулу конечных точек отправлена пользователю %s.", update.effective_user.id)
+
+def _format_metrics(snapshot: dict, prefix: str = "") -> str:
+    """
+    Форматирует снимок метрик (metrics.snapshot()) как текст: счетчики, показатели
+    и гистограммы с числом наблюдений и перцентилями. prefix отбирает метрики по началу имени.
+    """
+    lines = []
+    for title, values in (("Счетчики", snapshot["counters"]), ("Показатели", snapshot["gauges"])):
+        rows = sorted((key, value) for key, value in values.items() if key.startswith(prefix))
+        if rows:
+            lines.append(f"{title}:")
+            lines.extend(f"  {key} = {value:g}" for key, value in rows)
+    rows = sorted((key, entry) for key, entry in snapshot["histograms"].items() if key.startswith(prefix))
+    if rows:
+        lines.append("Гистограммы (наблюдений, p50 / p95 / p99):")
+        lines.extend(
+            f"  {key}: {entry['count']}, {entry['p50']:.3f} / {entry['p95']:.3f} / {entry['p99']:.3f}"
+            for key, entry in rows
+        )
+    return "\n".join(lines) or "Метрик пока нет."
+
+async def handle_metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /metrics [префикс].
+    Отправляет внутренние метрики процесса (services/metrics.py), при необходимости только
+    те, имя которых начинается с префикса. Длинный отчет отправляется файлом.
+    """
+    if await _reject_outside_logging_chat(update):
+        return
 
+    prefix = context.args[0] if context.args else ""
+    report = _format_metrics(metrics.snapshot(), prefix)
+    text = f"<pre>{html.escape(report)}</pre>"
+    if len(text) <= MessageLimit.MAX_TEXT_LENGTH:
+        await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    else:
+        await update.message.reply_document(
+            document=io.BytesIO(report.encode("utf-8")),
+            filename=f"metrics-{datetime.now():%Y%m%d-%H%M%S}.txt",
+            caption="Отчет не помещается в сообщение"
+        )
+    logger.info("Метрики отправлены пользователю %s.", update.effective_user.id)
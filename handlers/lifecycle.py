@@ -0,0 +1,42 @@
+# handlers/lifecycle.py
+import asyncio
+import logging
+from telegram.ext import Application
+from handlers.message_handler import resume_pending_messages, stop_scheduler
+from services.degradation import add_backlog_source, start_degradation_monitor, stop_degradation_monitor
+from services.memory_watchdog import start_memory_watchdog, stop_memory_watchdog
+from services.side_effects import drain as drain_side_effects
+
+logger = logging.getLogger(__name__)
+
+# Общие хуки жизненного цикла для приложений, обрабатывающих новости (app.py и main_bot_app.py)
+
+# Фоновая задача дообработки (ссылка хранится, чтобы задачу не удалил сборщик мусора)
+_resume_task = None
+
+async def post_init(application: Application) -> None:
+    """
+    После инициализации в фоне дообрабатывает сообщения, прерванные предыдущей остановкой бота,
+    и запускает наблюдение за памятью процесса и проверку нагрузки для режимов деградации.
+    """
+    global _resume_task
+    _resume_task = asyncio.create_task(resume_pending_messages(application.bot))
+    start_memory_watchdog()
+    # Обновления Telegram, еще не переданные обработчику, — тоже очередь сообщений
+    add_backlog_source(application.update_queue.qsize)
+    start_degradation_monitor()
+
+async def post_stop(application: Application) -> None:
+    """
+    Останавливает планировщик сообщений (режим PIPELINE_MODE=scheduled) и дожидается фоновых
+    действий (пересылка, лог), пока Bot приложения еще не закрыт.
+    """
+    await stop_scheduler()
+    await drain_side_effects()
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Останавливает наблюдение за памятью процесса и проверку нагрузки.
+    """
+    await stop_memory_watchdog()
+    await stop_degradation_monitor()
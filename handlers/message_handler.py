@@ -1,16 +1,53 @@
 # handlers/message_handler.py
+import asyncio
+import html
+import logging
+import re
+import time
+from collections import Counter
+from functools import reduce
+from operator import or_
 from telegram import Update, Bot
-from telegram.ext import ContextTypes
-from config.settings import PRIVATE_GROUP_CHAT_ID, CONTEXT_THRESHOLD, MAX_POTENTIAL, SUM_POTENTIAL
-from services.database_service import increment_incoming_messages, increment_outgoing_messages
-from services.telegram_logger import send_log_message
-from services.deepseek_processor import (
-    perform_initial_filtration,
-    perform_context_filtration,
-    evaluate_characteristics,
-    generate_commentary_recommendations
+from telegram.constants import MessageLimit
+from telegram.ext import ContextTypes, filters
+from config.settings import (
+    PRIVATE_GROUP_CHAT_ID, PIPELINE_MODE, BULK_CONCURRENCY, BULK_MAX_ITEMS, BULK_MAX_DOCUMENT_BYTES, SCHEDULER_CONCURRENCY, SCHEDULER_STALE_AFTER_SECONDS, SCHEDULER_STALE_POLICY,
+    SCHEDULER_DROP_REPORT_SECONDS,     SCHEDULER_CHAT_WEIGHT, SCHEDULER_CHAT_MAX_INFLIGHT, SCHEDULER_CHAT_POLICIES, RESUME_CONCURRENCY
 )
-import html
+from services.checkpoint_store import (
+    load_checkpoint, save_checkpoint, register_pending_message, complete_pending_message, get_pending_messages
+)
+from services.database_service import STALE_FILTER_VALUE, increment_incoming_messages, save_pipeline_result
+from services.delivery import forward_to_private_group
+from services.job_queue import enqueue_job
+from services.telegram_logger import send_log_message, send_service_message
+from services.pipeline import new_pipeline_result, run_pipeline, run_initial_stage, run_remaining_stages, passed_initial_stage, get_log_fields
+from services.scheduler import FreshnessScheduler, ScheduledItem
+from services import degradation, metrics, side_effects
+from services.tracing import SPAN_KIND_CLIENT, detach_trace, span, trace_message
+from utils.bulk_input import BULK_DOCUMENT_EXTENSIONS, is_bulk_text, split_bulk_text, parse_bulk_document
+from utils.telegram_utils import parse_news_message
+
+logger = logging.getLogger(__name__)
+
+# Планировщик режима PIPELINE_MODE=scheduled (см. get_scheduler)
+_scheduler = None
+
+# Отброшенные устаревшие сообщения по чатам с последней сводки в чат логирования
+_dropped_by_chat = Counter()
+
+# Задача, отправляющая сводку об отброшенных сообщениях (см. _report_dropped)
+_drop_report_task = None
+
+# Сколько прошедших фильтрацию новостей перечисляется в сводке по пакету
+BULK_SUMMARY_ITEMS = 20
+
+# Новостей всех пакетов в обработке одновременно (режим inline): несколько одновременно
+# присланных пакетов делят этот лимит и не вытесняют отдельные сообщения других чатов
+_bulk_semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+# Фильтр документов с пакетом новостей для регистрации handle_document
+BULK_DOCUMENT_FILTER = reduce(or_, (filters.Document.FileExtension(extension) for extension in BULK_DOCUMENT_EXTENSIONS))
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -18,185 +55,449 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     Обрабатывает входящие текстовые сообщения от пользователя.
     Инкрементирует счетчик входящих сообщений в SQLite.
     Разбивает сообщение на части (текст и ссылка).
-    Проводит три этапа фильтрации с помощью Deepseek.
+    Проводит три этапа фильтрации с помощью Deepseek (в режиме PIPELINE_MODE=queue
+    вместо этого только ставит сообщение в очередь для воркеров worker_app.py).
     Условно пересылает сообщение в приватную группу и инкрементирует счетчик исходящих,
     а также всегда отправляет лог в отдельный бот, сохраняя его message_id.
+    Пересылка, лог и сохранение результата выполняются в фоне, после решения обработчик свободен.
     """
     user_full_message = update.message.text
     chat_id = update.message.chat_id
+    message_key = f"{chat_id}:{update.message.message_id}"
+
+    with trace_message(message_key, "handle_message", chat_id=chat_id, pipeline_mode=PIPELINE_MODE):
+        logger.info("Получено сообщение от %s.", chat_id, extra={"message_key": message_key})
+        logger.debug("Текст сообщения: %s", user_full_message, extra={"message_key": message_key})
+
+        with span("db.increment_incoming"):
+            increment_incoming_messages()
+
+        if not user_full_message:
+            logger.info("Получено пустое сообщение.", extra={"message_key": message_key})
+            return
+
+        if is_bulk_text(user_full_message):
+            with span("parse", message_length=len(user_full_message), bulk=True):
+                items = split_bulk_text(user_full_message)
+            await start_bulk(context.bot, update, items, message_key)
+            return
+
+        with span("parse", message_length=len(user_full_message)):
+            main_message, message_link = parse_news_message(user_full_message)
+
+        if PIPELINE_MODE == "scheduled":
+            register_pending_message(message_key, main_message, message_link)
+            item = ScheduledItem(message_key, update.message.date.timestamp(), chat_id=chat_id, payload={
+                "bot": context.bot, "update": update, "main_message": main_message, "message_link": message_link
+            })
+            await get_scheduler().submit(item)
+            logger.info("Сообщение %s передано планировщику.", message_key, extra={"message_key": message_key})
+            return
+
+        if PIPELINE_MODE == "queue":
+            if enqueue_job(message_key, {"main_message": main_message, "message_link": message_link}):
+                logger.info("Сообщение %s поставлено в очередь.", message_key, extra={"message_key": message_key})
+            else:
+                logger.info("Сообщение %s уже есть в очереди, повторно не ставится.", message_key, extra={"message_key": message_key})
+            return
+
+        await process_message(context.bot, main_message, message_link, message_key, update)
+
+async def process_message(bot: Bot, main_message: str, message_link: str, message_key: str, update: Update | None = None) -> None:
+    """
+    Проводит сообщение через все этапы фильтрации (с контрольными точками по message_key)
+    и передает в фон сохранение результата, пересылку в приватную группу при положительном
+    решении и отправку лога. Об ошибке пересылки сообщается ответом на update, если он передан.
+    """
+    with trace_message(message_key, "process_message"):
+        register_pending_message(message_key, main_message, message_link)
+
+        # --- Все этапы фильтрации Deepseek и финальное решение ---
+        result = await run_pipeline(main_message, message_link, message_key=message_key)
+        finish_message(bot, result, message_key, update)
+
+def finish_message(bot: Bot, result: dict, message_key: str, update: Update | None = None, send_log: bool = True) -> None:
+    """
+    Передает побочные действия по результату фильтрации в фоновую задачу и сразу
+    возвращает управление: задержка обработчика заканчивается на решении.
+    send_log=False — без лога в бот логирования (новости пакета, по нему приходит сводка).
+    """
+    if result["final_filter_value"] != "Да":
+        logger.info("Сообщение НЕ отправлено в приватную группу (финальный фильтр: Нет).", extra={"message_key": message_key})
+        logger.debug("Объяснение: %s", result["explain_value_2"], extra={"message_key": message_key})
+    side_effects.submit("side_effects", _run_side_effects(bot, result, message_key, update, send_log), message_key)
 
-    print(f"Получено сообщение от {chat_id}: {user_full_message}")
+async def _run_side_effects(bot: Bot, result: dict, message_key: str, update: Update | None, send_log: bool) -> None:
+    """
+    Одновременно сохраняет результат, пересылает сообщение в приватную группу при
+    положительном решении (не более одного раза) и отправляет лог. Сообщение считается
+    обработанным, только если результат сохранен; иначе оно дообрабатывается после перезапуска.
+    """
+    effects = {"save_result": _save_result(result)}
+    if send_log and degradation.should_send_log(result["final_filter_value"] == "Да"):
+        effects["send_log"] = _send_log(result)
+    if result["final_filter_value"] == "Да":
+        effects["forward"] = _forward(bot, result, message_key)
+    errors = dict(zip(effects, await asyncio.gather(*(
+        side_effects.run_effect(effect, coro, message_key) for effect, coro in effects.items()
+    ))))
+
+    forward_error = errors.get("forward")
+    if forward_error:
+        logger.error("Ошибка при отправке сообщения в приватную группу %s: %s", PRIVATE_GROUP_CHAT_ID, forward_error, extra={"message_key": message_key})
+        if update is not None:
+            await side_effects.run_effect(
+                "reply_error",
+                update.message.reply_text(f"Произошла ошибка при пересылке сообщения: {forward_error}"),
+                message_key
+            )
+    if errors["save_result"] is None:
+        complete_pending_message(message_key)
 
-    increment_incoming_messages()
+async def _save_result(result: dict) -> None:
+    with span("db.save_pipeline_result"):
+        await asyncio.to_thread(save_pipeline_result, result)
 
-    if not user_full_message:
-        print("Получено пустое сообщение.")
+async def _forward(bot: Bot, result: dict, message_key: str) -> None:
+    # --- Условная пересылка сообщения в приватную группу (на основе final_filter_value) ---
+    if load_checkpoint(message_key, "forward"):
+        # Сообщение уже переслано до перезапуска бота
+        logger.info("Сообщение %s уже пересылалось, повторная пересылка пропущена.", message_key, extra={"message_key": message_key})
         return
+    with span("telegram.forward", kind=SPAN_KIND_CLIENT):
+        await forward_to_private_group(bot, result)
+    save_checkpoint(message_key, "forward", True)
 
-    parts = user_full_message.split('1111\n\n')
-
-    main_message = ""
-    message_link = "Нет ссылки"
-    
-    if len(parts) >= 1:
-        main_message = parts[0].strip()
-    if len(parts) >= 2:
-        message_link = parts[1].strip()
-
-    # --- Первый этап фильтрации ---
-    filter_value_1, explain_value_1 = await perform_initial_filtration(main_message, message_link)
-    # --- Конец первого этапа фильтрации ---
-
-    # Если первый фильтр вернул "Нет", прекращаем дальнейшую обработку
-    if filter_value_1 == "Нет":
-        print(f"Сообщение НЕ прошло первичную фильтрацию. Причина: {explain_value_1}")
-        # Логируем результат первого этапа и завершаем функцию
-        await send_log_message(
-            main_message=main_message,
-            message_link=message_link,
-            filter_value_1=filter_value_1,
-            explain_value_1=explain_value_1,
-            filter_value_2="Не проводился", # Указываем, что второй этап не проводился
-            total_score_context=0,
-            explain_value_2="Не проводился", # Указываем, что второй этап не проводился
-            final_filter_value="Нет", # Финальный фильтр тоже "Нет"
-            total_potential_score=0,
-            emotion_score=0,
-            emotion_explain="Не проводился",
-            image_score=0,
-            image_explain="Не проводился",
-            heroes_score=0,
-            heroes_explain="Не проводился",
-            actual_score=0,
-            actual_explain="Не проводился",
-            drama_score=0,
-            drama_explain="Не проводился",
-            is_filtered_by_stage_2=False # Флаг, что 3-й этап не проводился
-        )
-        return # Завершаем выполнение функции
-
-    # --- Второй этап фильтрации (Context Filtration) ---
-    filter_value_2, total_score_context, explain_value_2, is_filtered_by_stage_2 = await perform_context_filtration(main_message)
-    # --- Конец второго этапа фильтрации ---
-
-    # Если второй фильтр вернул "Нет", прекращаем дальнейшую обработку
-    if filter_value_2 == "Нет":
-        print(f"Сообщение НЕ прошло контекстную фильтрацию. Причина: {explain_value_2}")
-        # Логируем результат второго этапа и завершаем функцию
-        await send_log_message(
-            main_message=main_message,
-            message_link=message_link,
-            filter_value_1=filter_value_1, # Первый фильтр был "Да"
-            explain_value_1=explain_value_1, # Объяснение первого фильтра
-            filter_value_2=filter_value_2, # Второй фильтр был "Нет"
-            total_score_context=total_score_context, # Фактический балл второго этапа
-            explain_value_2=explain_value_2, # Объяснение второго фильтра
-            final_filter_value="Нет", # Финальный фильтр тоже "Нет"
-            total_potential_score=0,
-            emotion_score=0,
-            emotion_explain="Не проводился",
-            image_score=0,
-            image_explain="Не проводился",
-            heroes_score=0,
-            heroes_explain="Не проводился",
-            actual_score=0,
-            actual_explain="Не проводился",
-            drama_score=0,
-            drama_explain="Не проводился",
-            is_filtered_by_stage_2=False # Флаг, что 3-й этап не проводился
-        )
-        return # Завершаем выполнение функции
-
-    # --- Третий этап: Оценка эмоциональных и стилистических характеристик ---
-    emotion_score, emotion_explain = 0, "N/A"
-    image_score, image_explain = 0, "N/A"
-    heroes_score, heroes_explain = 0, "N/A"
-    actual_score, actual_explain = 0, "N/A"
-    drama_score, drama_explain = 0, "N/A"
-
-    final_filter_value = "Нет"
-    total_potential_score = 0
-    potential_scores_list = []
-    commentary_recommendations = "Рекомендации пока отсутствуют."
-
-    if filter_value_2 == "Да": # Этот блок выполняется, только если второй фильтр был "Да"
-        print("Начало третьего этапа фильтрации (оценка характеристик)...")
-        (
-            emotion_score, emotion_explain,
-            image_score, image_explain,
-            heroes_score, heroes_explain,
-            actual_score, actual_explain,
-            drama_score, drama_explain,
-            total_potential_score, potential_scores_list
-        ) = await evaluate_characteristics(main_message)
-
-        has_max_potential = any(score >= MAX_POTENTIAL for score in potential_scores_list if isinstance(score, int))
-        if total_potential_score >= SUM_POTENTIAL and has_max_potential:
-            final_filter_value = "Да"
-            commentary_recommendations = await generate_commentary_recommendations(
-                main_message,
-                emotion_score, emotion_explain, # Передаем все оценки и объяснения
-                image_score, image_explain,
-                heroes_score, heroes_explain,
-                actual_score, actual_explain,
-                drama_score, drama_explain
+async def _send_log(result: dict) -> None:
+    # --- Логирование в отдельный бот (всегда) ---
+    with span("telegram.send_log", kind=SPAN_KIND_CLIENT):
+        await send_log_message(**get_log_fields(result))
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает документ с пакетом новостей (JSONL, CSV или TXT, см. utils/bulk_input.py):
+    разбирает его и запускает обработку новостей пакета.
+    """
+    document = update.message.document
+    chat_id = update.message.chat_id
+    message_key = f"{chat_id}:{update.message.message_id}"
+
+    with trace_message(message_key, "handle_document", chat_id=chat_id, file_size=document.file_size):
+        logger.info("Получен документ %s от %s.", document.file_name, chat_id, extra={"message_key": message_key})
+        with span("db.increment_incoming"):
+            increment_incoming_messages()
+
+        if document.file_size and document.file_size > BULK_MAX_DOCUMENT_BYTES:
+            await update.message.reply_text(
+                f"Документ слишком большой ({document.file_size / 1024 / 1024:.1f} МБ), "
+                f"допустимо не больше {BULK_MAX_DOCUMENT_BYTES / 1024 / 1024:.0f} МБ."
             )
-        else:
-            final_filter_value = "Нет"
-        
-        print(f"Финальная фильтрация: Сумма потенциальных баллов={total_potential_score}, Есть MAX_POTENTIAL={has_max_potential}, Результат='{final_filter_value}'")
+            return
+        with span("telegram.download_document", kind=SPAN_KIND_CLIENT):
+            telegram_file = await document.get_file()
+            data = await telegram_file.download_as_bytearray()
+        try:
+            with span("parse", message_length=len(data), bulk=True):
+                items = parse_bulk_document(bytes(data), document.file_name or "")
+        except ValueError as e:
+            await update.message.reply_text(f"Не удалось разобрать документ: {e}")
+            return
+        await start_bulk(context.bot, update, items, message_key)
+
+async def start_bulk(bot: Bot, update: Update, items: list[tuple[str, str]], bulk_key: str) -> None:
+    """
+    Принимает пакет новостей из одного сообщения: в режиме PIPELINE_MODE=queue ставит
+    новости в очередь воркеров, в режиме scheduled — в планировщик от имени чата отправителя,
+    иначе запускает их обработку в фоне (не больше BULK_CONCURRENCY новостей всех пакетов
+    одновременно). В режимах scheduled и inline по пакету в конце приходит одна сводка.
+    Ключ новости — ключ сообщения и ее номер в пакете.
+    """
+    if not items:
+        await update.message.reply_text("В пакете не найдено ни одной новости.")
+        return
+    if len(items) > BULK_MAX_ITEMS:
+        await update.message.reply_text(f"В пакете {len(items)} новостей, допустимо не больше {BULK_MAX_ITEMS}.")
+        return
+    # Одна запись о входящем сообщении уже добавлена обработчиком, остальные — по числу новостей
+    if len(items) > 1:
+        increment_incoming_messages(len(items) - 1)
+    metrics.inc("bulk_items_total", len(items))
 
-    else:
-        print("Третий этап фильтрации не проводился (второй этап вернул 'Нет').")
+    if PIPELINE_MODE == "queue":
+        queued = sum(
+            enqueue_job(f"{bulk_key}:{index}", {"main_message": main_message, "message_link": message_link})
+            for index, (main_message, message_link) in enumerate(items)
+        )
+        logger.info("Пакет %s: поставлено в очередь %d из %d новостей.", bulk_key, queued, len(items), extra={"message_key": bulk_key})
+        await update.message.reply_text(f"Новостей в пакете: {len(items)}, поставлено в очередь: {queued}.")
+        return
 
+    # Новости регистрируются сразу: если бот остановится посреди пакета, необработанные
+    # новости будут дообработаны после перезапуска
+    for index, (main_message, message_link) in enumerate(items):
+        register_pending_message(f"{bulk_key}:{index}", main_message, message_link)
+    logger.info("Пакет %s: принято новостей: %d.", bulk_key, len(items), extra={"message_key": bulk_key})
+    await update.message.reply_text(f"Принят пакет из {len(items)} новостей, сводка придет по завершении обработки.")
 
-    # --- Условная пересылка сообщения в приватную группу (на основе final_filter_value) ---
-    if final_filter_value == "Да":
-        response_text = (
-            f"{main_message}\n\n"
-            f"1111\n\n"
-            f"{message_link}\n\n"
-            f"1111\n\n"
-            f"Общий потенциал: {total_potential_score}\n"
-            f"1. Эмоции: {emotion_score}\n"
-            f"2. Образность: {image_score}\n"
-            f"3. Герои: {heroes_score}\n"
-            f"4. Актуальность: {actual_score}\n"
-            f"5. Драма: {drama_score}\n\n"
-            f"1111\n\n"
-            f"Рекомендации: {commentary_recommendations}"
+    if PIPELINE_MODE == "scheduled":
+        # Новости пакета проходят через планировщик, как отдельные сообщения чата: справедливая
+        # очередь не дает пакету занять всю обработку, а устаревшие новости отбрасываются
+        progress = _BulkProgress(update, items, bulk_key)
+        scheduler = get_scheduler()
+        for index, (main_message, message_link) in enumerate(items):
+            await scheduler.submit(ScheduledItem(
+                f"{bulk_key}:{index}", update.message.date.timestamp(), chat_id=update.message.chat_id, payload={
+                    "bot": bot, "update": None, "main_message": main_message, "message_link": message_link,
+                    "bulk": progress, "index": index
+                }
+            ))
+        return
+    side_effects.submit("bulk", _process_bulk(bot, update, items, bulk_key), bulk_key)
+
+class _BulkProgress:
+    """
+    Исходы новостей пакета в режиме PIPELINE_MODE=scheduled. Новости обрабатываются
+    планировщиком по отдельности; после исхода последней отправляется сводка.
+    """
+    def __init__(self, update: Update, items: list[tuple[str, str]], bulk_key: str):
+        self.update = update
+        self.items = items
+        self.bulk_key = bulk_key
+        self.outcomes = [None] * len(items)
+        self.remaining = len(items)
+        self.started_at = time.monotonic()
+
+    def record(self, index: int, outcome: dict | Exception) -> None:
+        """
+        Запоминает результат (или ошибку) новости index.
+        """
+        self.outcomes[index] = outcome
+        self.remaining -= 1
+        if self.remaining == 0:
+            side_effects.submit("bulk_summary", _send_bulk_summary(
+                self.update, self.items, self.outcomes, time.monotonic() - self.started_at, self.bulk_key
+            ), self.bulk_key)
+
+async def _process_bulk(bot: Bot, update: Update, items: list[tuple[str, str]], bulk_key: str) -> None:
+    """
+    Прогоняет новости пакета через этапы фильтрации (не больше BULK_CONCURRENCY новостей
+    всех пакетов одновременно) и отправляет одну сводку отправителю и в чат логирования.
+    """
+    started_at = time.monotonic()
+
+    async def process_item(index: int, main_message: str, message_link: str) -> dict | Exception:
+        message_key = f"{bulk_key}:{index}"
+        async with _bulk_semaphore:
+            # У каждой новости своя трасса, как у отдельного сообщения
+            detach_trace()
+            try:
+                with trace_message(message_key, "bulk_item", bulk_size=len(items)):
+                    result = await run_pipeline(main_message, message_link, message_key=message_key)
+            except Exception as e:
+                logger.exception("Ошибка при обработке новости пакета %s: %s", message_key, e, extra={"message_key": message_key})
+                return e
+        # Логи по отдельным новостям не отправляются: по пакету приходит одна сводка
+        finish_message(bot, result, message_key, send_log=False)
+        return result
+
+    outcomes = await asyncio.gather(*(
+        process_item(index, main_message, message_link) for index, (main_message, message_link) in enumerate(items)
+    ))
+    await _send_bulk_summary(update, items, outcomes, time.monotonic() - started_at, bulk_key)
+
+async def _send_bulk_summary(update: Update, items: list[tuple[str, str]], outcomes: list, duration: float, bulk_key: str) -> None:
+    """
+    Отправляет сводку по пакету отправителю и в чат логирования (с учетом ограничения
+    Telegram на длину сообщения).
+    """
+    summary = _format_bulk_summary(items, outcomes, duration)
+    await side_effects.run_effect(
+        "reply_bulk_summary", update.message.reply_text(_truncate(summary, MessageLimit.MAX_TEXT_LENGTH)), bulk_key
+    )
+    # Обрезается уже экранированный текст: экранирование удлиняет строку
+    await send_service_message(_truncate_html(html.escape(summary), MessageLimit.MAX_TEXT_LENGTH))
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def _truncate_html(text: str, limit: int) -> str:
+    """
+    Обрезает экранированный HTML-текст до limit символов, не разрывая HTML-сущность (&amp; и т.п.).
+    """
+    if len(text) <= limit:
+        return text
+    return re.sub(r"&#?\w*$", "", text[:limit - 1]) + "…"
+
+def _format_bulk_summary(items: list[tuple[str, str]], outcomes: list, duration: float) -> str:
+    """
+    Сводка по пакету: число новостей по исходам и прошедшие фильтрацию новости по сумме баллов.
+    """
+    counts = Counter()
+    accepted = []
+    for (main_message, _), outcome in zip(items, outcomes):
+        if isinstance(outcome, Exception):
+            counts["error"] += 1
+        elif outcome["filter_value_1"] == STALE_FILTER_VALUE:
+            counts["stale"] += 1
+        elif outcome["final_filter_value"] == "Да":
+            counts["accepted"] += 1
+            accepted.append((outcome["total_potential_score"], main_message))
+        elif not passed_initial_stage(outcome):
+            counts["stage1"] += 1
+        elif outcome["filter_value_2"] == "Нет":
+            counts["stage2"] += 1
+        else:
+            counts["stage3"] += 1
+
+    lines = [
+        f"Пакет из {len(items)} новостей обработан за {duration:.0f} с.",
+        f"Прошли фильтрацию: {counts['accepted']}",
+        f"Отклонены на первом этапе: {counts['stage1']}",
+        f"Отклонены на втором этапе: {counts['stage2']}",
+        f"Отклонены на третьем этапе: {counts['stage3']}",
+    ]
+    if counts["stale"]:
+        lines.append(f"Отброшены как устаревшие: {counts['stale']}")
+    if counts["error"]:
+        lines.append(f"Ошибки обработки: {counts['error']}")
+    if accepted:
+        lines += ["", "Прошедшие фильтрацию (сумма баллов):"]
+        accepted.sort(key=lambda entry: entry[0], reverse=True)
+        for score, main_message in accepted[:BULK_SUMMARY_ITEMS]:
+            preview = main_message.splitlines()[0][:80]
+            lines.append(f"{score} — {preview}")
+        if len(accepted) > BULK_SUMMARY_ITEMS:
+            lines.append(f"...и еще {len(accepted) - BULK_SUMMARY_ITEMS}")
+    return "\n".join(lines)
+
+async def resume_pending_messages(bot: Bot) -> None:
+    """
+    Дообрабатывает сообщения, обработка которых прервалась при остановке бота, не больше
+    RESUME_CONCURRENCY одновременно. Уже полученные ответы Deepseek берутся из контрольных точек.
+    Сообщения, не обработанные за RESUME_MAX_ATTEMPTS перезапусков, отбрасываются с ошибкой в журнале.
+    """
+    pending, abandoned = get_pending_messages()
+    for message_key, attempts in abandoned:
+        logger.error("Сообщение %s не удалось дообработать за %d попыток, оно отброшено.", message_key, attempts, extra={"message_key": message_key})
+    if abandoned:
+        metrics.inc("resume_abandoned_total", len(abandoned))
+        await send_service_message(
+            f"Отброшено незавершенных сообщений после исчерпания попыток дообработки: {len(abandoned)}\n"
+            + html.escape(", ".join(message_key for message_key, _ in abandoned[:BULK_SUMMARY_ITEMS]))
         )
+    if not pending:
+        return
+    logger.info("Найдено незавершенных сообщений: %d. Продолжаем обработку...", len(pending))
+    semaphore = asyncio.Semaphore(RESUME_CONCURRENCY)
+
+    async def resume(message_key: str, main_message: str, message_link: str) -> None:
+        async with semaphore:
+            try:
+                await process_message(bot, main_message, message_link, message_key)
+            except Exception as e:
+                logger.exception("Ошибка при дообработке сообщения %s: %s", message_key, e, extra={"message_key": message_key})
+
+    await asyncio.gather(*(resume(*message) for message in pending))
+
+async def _process_scheduled(item: ScheduledItem) -> bool:
+    """
+    Выполняет очередную фазу обработки сообщения из планировщика.
+    Возвращает True, если первый этап пройден и сообщение нужно вернуть в планировщик
+    для остальных этапов (с приоритетом перед новыми сообщениями).
+    """
+    payload = item.payload
+    bulk = payload.get("bulk")
+    phase = "scheduler.initial_stage" if item.result is None else "scheduler.remaining_stages"
+    queue_wait = round(time.monotonic() - item.enqueued_at, 3)
+    with trace_message(item.message_key, phase, chat_id=item.chat_id, queue_wait_seconds=queue_wait):
         try:
-            await context.bot.send_message(chat_id=PRIVATE_GROUP_CHAT_ID, text=response_text)
-            print(f"Сообщение успешно отправлено в приватную группу {PRIVATE_GROUP_CHAT_ID} (финальный фильтр: Да).")
-            increment_outgoing_messages()
+            if item.result is None:
+                item.result = await run_initial_stage(payload["main_message"], payload["message_link"], item.message_key)
+                if passed_initial_stage(item.result):
+                    return True
+            else:
+                await run_remaining_stages(item.result, item.message_key)
         except Exception as e:
-            print(f"Ошибка при отправке сообщения в приватную группу {PRIVATE_GROUP_CHAT_ID}: {e}")
-            await update.message.reply_text(f"Произошла ошибка при пересылке сообщения: {e}")
-    else:
-        print(f"Сообщение НЕ отправлено в приватную группу (финальный фильтр: Нет). Объяснение: {explain_value_2}")
-    
-    # --- Логирование в отдельный бот (всегда) ---
-    await send_log_message(
-        main_message=main_message,
-        message_link=message_link,
-        filter_value_1=filter_value_1,
-        explain_value_1=explain_value_1,
-        filter_value_2=filter_value_2,
-        total_score_context=total_score_context,
-        explain_value_2=explain_value_2,
-        final_filter_value=final_filter_value,
-        total_potential_score=total_potential_score,
-        emotion_score=emotion_score,
-        emotion_explain=emotion_explain,
-        image_score=image_score,
-        image_explain=image_explain,
-        heroes_score=heroes_score,
-        heroes_explain=heroes_explain,
-        actual_score=actual_score,
-        actual_explain=actual_explain,
-        drama_score=drama_score,
-        drama_explain=drama_explain,
-        is_filtered_by_stage_2=is_filtered_by_stage_2
-    )
+            if bulk is not None:
+                bulk.record(payload["index"], e)
+            raise
+
+        # Время от постановки в планировщик до решения — сигнал latency_p95 режимов деградации
+        degradation.observe_latency(time.monotonic() - item.submitted_at)
+        # Логи по отдельным новостям пакета не отправляются: по пакету приходит одна сводка
+        finish_message(payload["bot"], item.result, item.message_key, payload["update"], send_log=bulk is None)
+        if bulk is not None:
+            bulk.record(payload["index"], item.result)
+        return False
+
+async def _drop_scheduled(item: ScheduledItem) -> None:
+    """
+    Отбрасывает устаревшее сообщение, не расходуя на него запросы к Deepseek. Результат
+    с отметкой STALE_FILTER_VALUE сохраняется в pipeline_results, а число отброшенных
+    сообщений по чатам раз в SCHEDULER_DROP_REPORT_SECONDS сообщается в чат логирования.
+    """
+    global _drop_report_task
+    logger.info("Сообщение %s устарело (%d с) и отброшено без обработки.", item.message_key, item.age(), extra={"message_key": item.message_key})
+    result = new_pipeline_result(item.payload["main_message"], item.payload["message_link"])
+    result["filter_value_1"] = STALE_FILTER_VALUE
+    result["explain_value_1"] = f"Новость старше {SCHEDULER_STALE_AFTER_SECONDS} с ({item.age():.0f} с), отброшена планировщиком без обработки."
+    if await side_effects.run_effect("save_result", _save_result(result), item.message_key) is None:
+        complete_pending_message(item.message_key)
+    if item.payload.get("bulk") is not None:
+        item.payload["bulk"].record(item.payload["index"], result)
 
+    _dropped_by_chat[item.chat_id] += 1
+    if _drop_report_task is None:
+        _drop_report_task = asyncio.create_task(_report_dropped())
+
+async def _report_dropped() -> None:
+    global _drop_report_task
+    await asyncio.sleep(SCHEDULER_DROP_REPORT_SECONDS)
+    _drop_report_task = None
+    await _send_dropped_summary()
+
+async def _send_dropped_summary() -> None:
+    """
+    Отправляет в чат логирования число отброшенных с прошлой сводки устаревших сообщений по чатам.
+    """
+    if not _dropped_by_chat:
+        return
+    counts = dict(_dropped_by_chat)
+    _dropped_by_chat.clear()
+    lines = [f"Отброшено устаревших сообщений (старше {SCHEDULER_STALE_AFTER_SECONDS} с): {sum(counts.values())}"]
+    lines += [f"чат {chat_id}: {count}" for chat_id, count in sorted(counts.items(), key=lambda entry: entry[1], reverse=True)]
+    await send_service_message(html.escape("\n".join(lines)))
+
+def get_scheduler() -> FreshnessScheduler:
+    """
+    Возвращает планировщик режима PIPELINE_MODE=scheduled (создается и запускается при первом вызове).
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FreshnessScheduler(
+            _process_scheduled, _drop_scheduled,
+            concurrency=SCHEDULER_CONCURRENCY,
+            stale_after=SCHEDULER_STALE_AFTER_SECONDS,
+            stale_policy=SCHEDULER_STALE_POLICY,
+            chat_policies=SCHEDULER_CHAT_POLICIES,
+            default_weight=SCHEDULER_CHAT_WEIGHT,
+            default_max_inflight=SCHEDULER_CHAT_MAX_INFLIGHT
+        )
+        _scheduler.start()
+        # Глубина планировщика включает сообщения в обработке: в этом режиме они не проходят
+        # через degradation.track_message
+        degradation.add_backlog_source(_scheduler.depth)
+    return _scheduler
+
+async def stop_scheduler() -> None:
+    """
+    Останавливает планировщик, если он запускался (вызывается при остановке бота).
+    """
+    global _scheduler, _drop_report_task
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
+    if _drop_report_task is not None:
+        _drop_report_task.cancel()
+        _drop_report_task = None
+        await _send_dropped_summary()
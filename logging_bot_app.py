@@ -1,33 +1,69 @@
 # logging_bot_app.py
+import logging
 from telegram.ext import Application, CommandHandler
 from telegram import Update
 from config.settings import LOGGING_BOT_TOKEN
-from handlers.commands_handler import handle_stats_command, handle_zero_command # Изменено: импорт из нового модуля
+from services.memory_watchdog import start_memory_watchdog, stop_memory_watchdog
+from handlers.commands_handler import handle_stats_command, handle_zero_command, handle_export_command, handle_profile_command, handle_memory_command, handle_endpoints_command, handle_metrics_command # Изменено: импорт из нового модуля
+from utils.logger_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+async def _post_init(application: Application) -> None:
+    """
+    Запускает наблюдение за памятью процесса.
+    """
+    start_memory_watchdog()
+
+async def _post_shutdown(application: Application) -> None:
+    """
+    Останавливает наблюдение за памятью процесса.
+    """
+    await stop_memory_watchdog()
+
+def build_application() -> Application:
+    """
+    Создает Application бота логирования и регистрирует его команды.
+    Используется как здесь, так и в supervisor_app.py.
+    """
+    logger.info("Инициализация бота для логирования...")
+    application = Application.builder().token(LOGGING_BOT_TOKEN).post_init(_post_init).post_shutdown(_post_shutdown).build()
+    logger.info("Бот для логирования инициализирован.")
+
+    # Регистрируем обработчики команд /stats, /zero, /export, /profile, /memory, /endpoints и /metrics
+    application.add_handler(CommandHandler("stats", handle_stats_command))
+    logger.debug("Обработчик команды /stats для бота логирования зарегистрирован.")
+    application.add_handler(CommandHandler("zero", handle_zero_command))
+    logger.debug("Обработчик команды /zero для бота логирования зарегистрирован.")
+    application.add_handler(CommandHandler("export", handle_export_command))
+    logger.debug("Обработчик команды /export для бота логирования зарегистрирован.")
+    # block=False: профилирование длится секунды и не должно задерживать обработку других апдейтов
+    application.add_handler(CommandHandler("profile", handle_profile_command, block=False))
+    logger.debug("Обработчик команды /profile для бота логирования зарегистрирован.")
+    application.add_handler(CommandHandler("memory", handle_memory_command))
+    logger.debug("Обработчик команды /memory для бота логирования зарегистрирован.")
+    application.add_handler(CommandHandler("endpoints", handle_endpoints_command))
+    logger.debug("Обработчик команды /endpoints для бота логирования зарегистрирован.")
+    application.add_handler(CommandHandler("metrics", handle_metrics_command))
+    logger.debug("Обработчик команды /metrics для бота логирования зарегистрирован.")
+    return application
 
 def main():
     """Запускает Telegram-бот для логирования и статистики."""
+    setup_logging("logging_bot")
     if not LOGGING_BOT_TOKEN:
-        print("Ошибка: Токен бота для логирования не найден. Убедитесь, что он указан в файле .env")
+        logger.error("Токен бота для логирования не найден. Убедитесь, что он указан в файле .env")
         return
 
-    print("Инициализация бота для логирования...")
-    application = Application.builder().token(LOGGING_BOT_TOKEN).build()
-    print("Бот для логирования инициализирован.")
+    application = build_application()
 
-    # Регистрируем обработчики команд /stats и /zero
-    application.add_handler(CommandHandler("stats", handle_stats_command))
-    print("Обработчик команды /stats для бота логирования зарегистрирован.")
-    application.add_handler(CommandHandler("zero", handle_zero_command))
-    print("Обработчик команды /zero для бота логирования зарегистрирован.")
-
-    print("Запуск прослушивания новых сообщений для бота логирования (polling)...")
+    logger.info("Запуск прослушивания новых сообщений для бота логирования (polling)...")
     try:
         application.run_polling(allowed_updates=Update.ALL_TYPES)
     except Exception as e:
-        print(f"Ошибка при запуске бота для логирования: {e}")
+        logger.exception("Ошибка при запуске бота для логирования: %s", e)
     finally:
-        print("Бот для логирования остановлен.")
+        logger.info("Бот для логирования остановлен.")
 
 if __name__ == '__main__':
     main()
-
@@ -1,34 +1,50 @@
 # main_bot_app.py
+import logging
 from telegram.ext import Application, MessageHandler, filters
 from telegram import Update
 from config.settings import TELEGRAM_BOT_TOKEN, PRIVATE_GROUP_CHAT_ID
-from handlers.message_handler import handle_message # Только обработчик сообщений
+from handlers.message_handler import BULK_DOCUMENT_FILTER, handle_message, handle_document # Только обработчик сообщений
+from handlers.lifecycle import post_init, post_stop, post_shutdown
+from utils.logger_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+def build_application() -> Application:
+    """
+    Создает Application основного бота и регистрирует его обработчики.
+    Используется как здесь, так и в supervisor_app.py.
+    """
+    logger.info("Инициализация основного Telegram-бота...")
+    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown).build()
+    logger.info("Основной бот инициализирован.")
+
+    # Регистрируем только обработчик текстовых сообщений (кроме команд)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    logger.debug("Обработчик текстовых сообщений для основного бота зарегистрирован.")
+    # Документы с пакетом новостей (JSONL, CSV, TXT)
+    application.add_handler(MessageHandler(BULK_DOCUMENT_FILTER, handle_document))
+    logger.debug("Обработчик документов с пакетом новостей для основного бота зарегистрирован.")
+    return application
 
 def main():
     """Запускает основной Telegram-бот."""
+    setup_logging("main_bot")
     if not TELEGRAM_BOT_TOKEN:
-        print("Ошибка: Токен основного Telegram-бота не найден. Убедитесь, что он указан в файле .env")
+        logger.error("Токен основного Telegram-бота не найден. Убедитесь, что он указан в файле .env")
         return
     if not PRIVATE_GROUP_CHAT_ID:
-        print("Ошибка: Chat ID приватной группы не найден. Убедитесь, что он указан в файле .env")
+        logger.error("Chat ID приватной группы не найден. Убедитесь, что он указан в файле .env")
         return
 
-    print("Инициализация основного Telegram-бота...")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    print("Основной бот инициализирован.")
+    application = build_application()
 
-    # Регистрируем только обработчик текстовых сообщений (кроме команд)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    print("Обработчик текстовых сообщений для основного бота зарегистрирован.")
-
-    print("Запуск прослушивания новых сообщений для основного бота (polling)...")
+    logger.info("Запуск прослушивания новых сообщений для основного бота (polling)...")
     try:
         application.run_polling(allowed_updates=Update.ALL_TYPES)
     except Exception as e:
-        print(f"Ошибка при запуске основного бота: {e}")
+        logger.exception("Ошибка при запуске основного бота: %s", e)
     finally:
-        print("Основной бот остановлен.")
+        logger.info("Основной бот остановлен.")
 
 if __name__ == '__main__':
     main()
-
@@ -278,6 +278,18 @@ DRAMA_INSTRUCTIONS = """
 """
 
 
+# Дополнение к инструкциям третьего этапа в режиме STAGE3_LAZY_EXPLAIN: только оценка
+SCORE_ONLY_INSTRUCTIONS = """
+Объяснение не нужно: верни только JSON-объект с полем score.
+"""
+
+# Объяснение уже полученной оценки (режим STAGE3_LAZY_EXPLAIN)
+EXPLAIN_SCORE_INSTRUCTIONS = """
+Ниже приведены новость, критерии оценки и оценка, которую новость уже получила по этим критериям.
+Кратко (1-2 предложения) объясни, чем обусловлена оценка: какие детали новости на нее повлияли.
+Ответь обычным текстом, без JSON и без повторения самой оценки.
+"""
+
 COMMENTARY_RECOMMENDATIONS_INSTRUCTIONS = """
 Ты — эксперт по созданию художественных комментариев к новостям.
 На основе следующей новости и анализа ее характеристик, напиши рекомендации
@@ -293,4 +305,10 @@ COMMENTARY_RECOMMENDATIONS_INSTRUCTIONS = """
 {combined_explains_for_prompt}
 
 Рекомендации:
-"""
\ No newline at end of file
+"""
+
+BATCH_FILTER_INSTRUCTIONS = """
+Ниже перечислены несколько независимых новостей, каждая со своим номером `id`.
+Оцени КАЖДУЮ новость отдельно по критериям из инструкции выше, не сравнивая их между собой.
+Верни по одному объекту на каждую новость с тем же `id`, полями `filter` и `explain`.
+"""
@@ -0,0 +1,175 @@
+# services/checkpoint_store.py
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from config.settings import (
+    CHECKPOINTS_ENABLED, CHECKPOINT_DATABASE_FILE, CHECKPOINT_RETENTION_HOURS, CHECKPOINT_PRUNE_EVERY,
+    RESUME_MAX_ATTEMPTS
+)
+from services import metrics
+
+# Контрольные точки этапов фильтрации. Каждый успешный ответ Deepseek (этап 1, этап 2,
+# каждая из пяти характеристик, рекомендации) сохраняется по ключу сообщения сразу после
+# получения. При повторной обработке того же сообщения (перезапуск бота, повторная выдача
+# задачи из очереди) сохраненные ответы берутся отсюда, и платные запросы не повторяются.
+# Длительность операций пишется в метрику checkpoint_seconds{op="load"|"save"}.
+#
+# Ответы этапов удаляются, когда обработка сообщения завершена (complete_pending_message).
+# Остальное (отметки о пересылке, контрольные точки режима queue, брошенные сообщения)
+# удаляется по истечении CHECKPOINT_RETENTION_HOURS: при подключении и далее через
+# каждые CHECKPOINT_PRUNE_EVERY сохранений.
+
+# Ключ сообщения, обрабатываемого в текущей задаче asyncio (устанавливается в run_pipeline)
+current_message_key = contextvars.ContextVar("current_message_key", default=None)
+
+# Соединение создается отдельно в каждом процессе, внутри процесса доступ сериализуется блокировкой
+_connection = None
+_connection_pid = None
+_connection_lock = threading.Lock()
+
+# Сохранений с последнего удаления устаревших контрольных точек
+_saves_since_prune = 0
+
+def _get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение с базой контрольных точек (вызывать под _connection_lock).
+    При первом подключении создает таблицы и удаляет устаревшие записи.
+    """
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        os.makedirs(os.path.dirname(CHECKPOINT_DATABASE_FILE), exist_ok=True)
+        _connection = sqlite3.connect(CHECKPOINT_DATABASE_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL без fsync на каждую запись: сохранение контрольной точки не должно заметно
+        # удлинять обработку сообщения
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS stage_checkpoints (
+                message_key TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                result TEXT NOT NULL, -- JSON-ответ Deepseek
+                created_at REAL NOT NULL,
+                PRIMARY KEY (message_key, stage)
+            )
+        ''')
+        # Сообщения, обработка которых начата, но не завершена (режим inline)
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS pending_messages (
+                message_key TEXT PRIMARY KEY,
+                main_message TEXT NOT NULL,
+                message_link TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0 -- попытки дообработки после перезапуска
+            )
+        ''')
+        # Таблица могла быть создана более ранней версией бота без колонки attempts
+        if "attempts" not in {row[1] for row in _connection.execute("PRAGMA table_info(pending_messages)")}:
+            _connection.execute("ALTER TABLE pending_messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        _prune(_connection)
+        _connection_pid = os.getpid()
+    return _connection
+
+def _prune(conn: sqlite3.Connection) -> None:
+    """
+    Удаляет контрольные точки старше CHECKPOINT_RETENTION_HOURS (вызывать под _connection_lock).
+    """
+    global _saves_since_prune
+    expire_before = time.time() - CHECKPOINT_RETENTION_HOURS * 3600
+    conn.execute("DELETE FROM stage_checkpoints WHERE created_at < ?", (expire_before,))
+    _saves_since_prune = 0
+
+def close_checkpoints():
+    """
+    Закрывает соединение с базой контрольных точек текущего процесса.
+    """
+    global _connection, _connection_pid
+    with _connection_lock:
+        if _connection is not None and _connection_pid == os.getpid():
+            _connection.close()
+        _connection = None
+        _connection_pid = None
+
+def load_checkpoint(message_key: str, stage: str):
+    """
+    Возвращает сохраненный результат этапа или None, если контрольной точки нет.
+    """
+    if not CHECKPOINTS_ENABLED or message_key is None:
+        return None
+    with metrics.timer("checkpoint_seconds", op="load"), _connection_lock:
+        row = _get_connection().execute(
+            "SELECT result FROM stage_checkpoints WHERE message_key = ? AND stage = ?", (message_key, stage)
+        ).fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_checkpoint(message_key: str, stage: str, result) -> None:
+    """
+    Сохраняет результат этапа (любое JSON-сериализуемое значение).
+    """
+    if not CHECKPOINTS_ENABLED or message_key is None:
+        return
+    global _saves_since_prune
+    with metrics.timer("checkpoint_seconds", op="save"), _connection_lock:
+        conn = _get_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO stage_checkpoints (message_key, stage, result, created_at) VALUES (?, ?, ?, ?)",
+            (message_key, stage, json.dumps(result, ensure_ascii=False), time.time())
+        )
+        _saves_since_prune += 1
+        if _saves_since_prune >= CHECKPOINT_PRUNE_EVERY:
+            _prune(conn)
+
+def register_pending_message(message_key: str, main_message: str, message_link: str) -> None:
+    """
+    Запоминает сообщение, обработка которого начинается, чтобы продолжить ее после перезапуска.
+    """
+    if not CHECKPOINTS_ENABLED:
+        return
+    with _connection_lock:
+        _get_connection().execute(
+            "INSERT OR IGNORE INTO pending_messages (message_key, main_message, message_link, created_at) VALUES (?, ?, ?, ?)",
+            (message_key, main_message, message_link, time.time())
+        )
+
+def complete_pending_message(message_key: str) -> None:
+    """
+    Отмечает обработку сообщения завершенной и удаляет ответы его этапов. Отметка о пересылке
+    остается до истечения срока хранения: повторно доставленное Telegram сообщение не будет
+    переслано второй раз.
+    """
+    if not CHECKPOINTS_ENABLED:
+        return
+    with _connection_lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM pending_messages WHERE message_key = ?", (message_key,))
+        conn.execute("DELETE FROM stage_checkpoints WHERE message_key = ? AND stage != 'forward'", (message_key,))
+
+def get_pending_messages(max_attempts: int = RESUME_MAX_ATTEMPTS) -> tuple[list[tuple[str, str, str]], list[tuple[str, int]]]:
+    """
+    Начинает очередную попытку дообработки незавершенных сообщений. Возвращает сообщения
+    для дообработки как список (message_key, main_message, message_link) и отброшенные
+    сообщения, попытки которых исчерпаны (max_attempts), как список (message_key, attempts).
+    Попытка засчитывается заранее, поэтому сообщение, из-за которого процесс падает, тоже
+    будет отброшено.
+    """
+    if not CHECKPOINTS_ENABLED:
+        return [], []
+    with _connection_lock:
+        conn = _get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            abandoned = conn.execute(
+                "SELECT message_key, attempts FROM pending_messages WHERE attempts >= ? ORDER BY created_at", (max_attempts,)
+            ).fetchall()
+            conn.execute("DELETE FROM pending_messages WHERE attempts >= ?", (max_attempts,))
+            conn.execute("UPDATE pending_messages SET attempts = attempts + 1")
+            pending = conn.execute(
+                "SELECT message_key, main_message, message_link FROM pending_messages ORDER BY created_at"
+            ).fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return pending, abandoned
@@ -0,0 +1,153 @@
+# services/concurrency_limiter.py
+import contextlib
+import threading
+import time
+from services import metrics
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Ограничитель числа одновременных запросов с автоматическим подбором лимита (AIMD).
+
+    - Аддитивное увеличение: каждый успешный ответ при полностью занятом лимите
+      увеличивает лимит на 1/limit, то есть примерно на 1 за "поколение" запросов.
+    - Мультипликативное уменьшение: ответ 429 или таймаут уменьшает лимит в decrease_factor раз.
+      Если сглаженная задержка выросла больше чем в latency_tolerance раз относительно
+      минимальной наблюдаемой, лимит уменьшается мягче (в 0.9 раза) — очередь на стороне API растет.
+      Задержки сравниваются отдельно для каждого вида запросов (key, например этап фильтрации):
+      длинный ответ одного этапа не считается ростом задержки относительно короткого ответа другого.
+      Уменьшение происходит не чаще одного раза за текущую типичную (сглаженную) задержку,
+      чтобы одна "волна" отказов не обрушила лимит до минимума.
+
+    Используется из рабочих потоков (deepseek_request выполняется в пуле потоков Deepseek).
+    Текущий лимит и число запросов в работе публикуются в метриках
+    {name}_concurrency_limit и {name}_inflight.
+    """
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        baseline_window: int = 500
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.baseline_window = baseline_window
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._inflight = 0
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+        # Базовые задержки по видам запросов
+        self._baselines: dict[str, _LatencyBaseline] = {}
+        self._publish()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"{self.name}_concurrency_limit", int(self._limit))
+        metrics.set_gauge(f"{self.name}_inflight", self._inflight)
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._inflight >= int(self._limit):
+                self._condition.wait()
+            self._inflight += 1
+            self._publish()
+
+    def release(self, latency: float | None, congested: bool = False, key: str = "") -> None:
+        """
+        Освобождает слот. latency — длительность запроса (None, если ответ не получен),
+        congested — признак перегрузки (ответ 429 или таймаут), key — вид запроса,
+        с базовой задержкой которого сравнивается latency.
+        """
+        with self._condition:
+            limit_was_reached = self._inflight >= int(self._limit)
+            self._inflight -= 1
+            now = time.monotonic()
+            baseline = self._baselines.get(key)
+            if congested:
+                self._decrease(now, self.decrease_factor, baseline)
+                metrics.inc(f"{self.name}_congestion_total")
+            elif latency is not None:
+                if baseline is None:
+                    baseline = self._baselines[key] = _LatencyBaseline(self.baseline_window)
+                baseline.update(latency)
+                if self.latency_tolerance and baseline.smoothed_latency > baseline.min_latency * self.latency_tolerance:
+                    self._decrease(now, 0.9, baseline)
+                elif limit_was_reached:
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._publish()
+            self._condition.notify_all()
+
+    def _decrease(self, now: float, factor: float, baseline: "_LatencyBaseline | None") -> None:
+        cooldown = baseline.smoothed_latency if baseline else 1.0
+        if now - self._last_decrease < cooldown:
+            return
+        self._limit = max(self.min_limit, self._limit * factor)
+        self._last_decrease = now
+
+    @contextlib.contextmanager
+    def slot(self, key: str = ""):
+        """
+        Занимает слот на время запроса вида key. Внутри блока нужно вызвать outcome.record(...),
+        иначе запрос считается завершившимся без ответа (без изменения лимита).
+        """
+        self.acquire()
+        outcome = _Outcome()
+        try:
+            yield outcome
+        finally:
+            self.release(outcome.latency, outcome.congested, key)
+
+class _LatencyBaseline:
+    """
+    Сглаженная и минимальная задержка одного вида запросов. Минимум берется за текущее
+    и предыдущее окна (окно сдвигается каждые window ответов).
+    """
+    __slots__ = ("window", "min_latency", "smoothed_latency", "_window_min_latency", "_window_samples")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.min_latency = None
+        self.smoothed_latency = None
+        self._window_min_latency = None
+        self._window_samples = 0
+
+    def update(self, latency: float) -> None:
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency = 0.9 * self.smoothed_latency + 0.1 * latency
+        if self._window_min_latency is None or latency < self._window_min_latency:
+            self._window_min_latency = latency
+        self._window_samples += 1
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        if self._window_samples >= self.window:
+            # Базовая задержка может вырасти (например, сменилась длина ответов) —
+            # берем минимум последнего окна, а не минимум за все время
+            self.min_latency = self._window_min_latency
+            self._window_min_latency = None
+            self._window_samples = 0
+
+class _Outcome:
+    __slots__ = ("latency", "congested")
+
+    def __init__(self):
+        self.latency = None
+        self.congested = False
+
+    def record(self, latency: float | None = None, congested: bool = False) -> None:
+        self.latency = latency
+        self.congested = congested
@@ -1,10 +1,63 @@
 # services/database_service.py
+import logging
 import sqlite3
 import os
+import threading
 from datetime import datetime, timedelta
 
-# Путь к файлу базы данных SQLite
-DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/stats.db')
+logger = logging.getLogger(__name__)
+
+# Путь к файлу базы данных SQLite (переменная окружения STATS_DATABASE_FILE позволяет
+# указать отдельную базу, например, для бенчмарков)
+DATABASE_FILE = os.getenv("STATS_DATABASE_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/stats.db')
+
+# Колонки pipeline_results с оценками второго (критерии контекста) и третьего (характеристики) этапов
+PIPELINE_CONTEXT_COLUMNS = ("subject", "object", "which", "action", "time_place", "how", "reason", "consequences")
+PIPELINE_SCORE_COLUMNS = ("emotion_score", "image_score", "heroes_score", "actual_score", "drama_score")
+
+# filter_value_1 сообщения, отброшенного планировщиком как устаревшее (этапы не проводились)
+STALE_FILTER_VALUE = "Отброшено: устарело"
+
+# Одно соединение на процесс: его используют все обработчики (в том числе оба бота,
+# запущенные в одном процессе через supervisor_app.py). Доступ сериализуется блокировкой,
+# так как функции вызываются и из цикла событий, и из рабочих потоков.
+_connection = None
+_connection_lock = threading.Lock()
+
+def _acquire_connection() -> sqlite3.Connection:
+    """
+    Захватывает общее соединение с базой (создает его при первом вызове).
+    Каждый вызов должен завершаться вызовом _release_connection.
+    """
+    global _connection
+    _connection_lock.acquire()
+    try:
+        if _connection is None:
+            _connection = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+        return _connection
+    except Exception:
+        _connection_lock.release()
+        raise
+
+def _release_connection(conn: sqlite3.Connection):
+    """
+    Освобождает общее соединение. Незавершенная (из-за ошибки) транзакция откатывается.
+    """
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    finally:
+        _connection_lock.release()
+
+def close_database():
+    """
+    Закрывает общее соединение с базой (вызывается при остановке бота).
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
 
 def initialize_database():
     """
@@ -16,7 +69,7 @@ def initialize_database():
 
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = _acquire_connection()
         cursor = conn.cursor()
         # Изменяем схему таблицы для хранения отдельных логов сообщений
         cursor.execute('''
@@ -26,37 +79,70 @@ def initialize_database():
                 timestamp TEXT NOT NULL -- Формат ISO 8601 (YYYY-MM-DD HH:MM:SS.mmmmmm)
             )
         ''')
+        # Таблица с результатами всех этапов фильтрации по каждому сообщению
+        # (используется для подбора порогов и офлайн-анализа)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pipeline_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                main_message TEXT,
+                message_link TEXT,
+                filter_value_1 TEXT,
+                filter_value_2 TEXT,
+                total_score_context REAL,
+                subject REAL, object REAL, which REAL, action REAL,
+                time_place REAL, how REAL, reason REAL, consequences REAL,
+                is_filtered_by_stage_2 INTEGER NOT NULL DEFAULT 0,
+                emotion_score REAL, image_score REAL, heroes_score REAL,
+                actual_score REAL, drama_score REAL,
+                total_potential_score REAL,
+                final_filter_value TEXT,
+                human_approved INTEGER, -- NULL = нет оценки, 1 = одобрено человеком, 0 = отклонено
+                skipped_calls INTEGER NOT NULL DEFAULT 0 -- Запросы третьего этапа, пропущенные при досрочном завершении
+            )
+        ''')
+        _add_missing_column(cursor, "pipeline_results", "skipped_calls", "INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pipeline_results_timestamp ON pipeline_results (timestamp)")
         conn.commit()
-        print(f"База данных SQLite '{DATABASE_FILE}' успешно инициализирована с таблицей 'message_logs'.")
+        logger.info("База данных SQLite '%s' успешно инициализирована с таблицами 'message_logs' и 'pipeline_results'.", DATABASE_FILE)
     except sqlite3.Error as e:
-        print(f"Ошибка при инициализации базы данных SQLite: {e}")
+        logger.error("Ошибка при инициализации базы данных SQLite: %s", e)
     finally:
         if conn:
-            conn.close()
+            _release_connection(conn)
+
+def _add_missing_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    """
+    Добавляет колонку в таблицу, созданную более ранней версией бота.
+    """
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info("В таблицу '%s' добавлена колонка '%s'.", table, column)
 
-def _add_message_log(message_type: str):
+def _add_message_log(message_type: str, count: int = 1):
     """
-    Внутренняя функция для добавления записи о сообщении в базу данных.
+    Внутренняя функция для добавления записей о сообщениях в базу данных.
     """
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = _acquire_connection()
         cursor = conn.cursor()
         now = datetime.now().isoformat() # Получаем текущее время в формате ISO 8601
-        cursor.execute("INSERT INTO message_logs (type, timestamp) VALUES (?, ?)", (message_type, now))
+        cursor.executemany("INSERT INTO message_logs (type, timestamp) VALUES (?, ?)", [(message_type, now)] * count)
         conn.commit()
-        print(f"Запись о сообщении '{message_type}' добавлена.")
+        logger.debug("Записи о сообщении '%s' добавлены: %d.", message_type, count)
     except sqlite3.Error as e:
-        print(f"Ошибка при добавлении записи о сообщении '{message_type}': {e}")
+        logger.error("Ошибка при добавлении записи о сообщении '%s': %s", message_type, e)
     finally:
         if conn:
-            conn.close()
+            _release_connection(conn)
 
-def increment_incoming_messages():
+def increment_incoming_messages(count: int = 1):
     """
-    Добавляет запись о входящем сообщении в базу данных.
+    Добавляет запись о входящем сообщении в базу данных (count записей — для пакета новостей).
     """
-    _add_message_log('incoming')
+    _add_message_log('incoming', count)
 
 def increment_outgoing_messages():
     """
@@ -64,6 +150,132 @@ def increment_outgoing_messages():
     """
     _add_message_log('outgoing')
 
+def _as_number(value):
+    """
+    Возвращает число для сохранения в REAL-колонку или None, если значение не числовое.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+def save_pipeline_result(result: dict):
+    """
+    Сохраняет результаты всех этапов фильтрации одного сообщения в таблицу pipeline_results.
+    Нечисловые оценки (например, текст ошибки) сохраняются как NULL.
+    """
+    context_scores = result.get("context_scores") or {}
+    row = (
+        datetime.now().isoformat(),
+        result["main_message"],
+        result["message_link"],
+        result["filter_value_1"],
+        result["filter_value_2"],
+        _as_number(result["total_score_context"]),
+        *(_as_number(context_scores.get(key)) for key in PIPELINE_CONTEXT_COLUMNS),
+        1 if result["is_filtered_by_stage_2"] else 0,
+        *(_as_number(result[key]) for key in PIPELINE_SCORE_COLUMNS),
+        _as_number(result["total_potential_score"]),
+        result["final_filter_value"],
+        result.get("stage3_skipped_calls", 0),
+    )
+    placeholders = ", ".join("?" for _ in row)
+    columns = ", ".join((
+        "timestamp", "main_message", "message_link", "filter_value_1", "filter_value_2", "total_score_context",
+        *PIPELINE_CONTEXT_COLUMNS, "is_filtered_by_stage_2", *PIPELINE_SCORE_COLUMNS,
+        "total_potential_score", "final_filter_value", "skipped_calls",
+    ))
+
+    conn = None
+    try:
+        conn = _acquire_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"INSERT INTO pipeline_results ({columns}) VALUES ({placeholders})", row)
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Ошибка при сохранении результатов фильтрации: %s", e)
+    finally:
+        if conn:
+            _release_connection(conn)
+
+def iter_pipeline_scores(chunk_size: int = 50000):
+    """
+    Построчно (пачками по chunk_size) читает из pipeline_results все, что нужно для
+    пересчета решений: ссылку, флаг первого этапа, оценки второго и третьего этапов и оценку человека.
+    Отброшенные как устаревшие сообщения пропускаются. Возвращает генератор списков кортежей, не загружая таблицу в память целиком.
+    """
+    columns = ", ".join((
+        "message_link", "filter_value_1", "filter_value_2", "total_score_context", *PIPELINE_CONTEXT_COLUMNS,
+        "is_filtered_by_stage_2", *PIPELINE_SCORE_COLUMNS, "human_approved",
+    ))
+    conn = sqlite3.connect(DATABASE_FILE)
+    try:
+        cursor = conn.execute(
+            f"SELECT {columns} FROM pipeline_results WHERE filter_value_1 IS NOT ? ORDER BY id", (STALE_FILTER_VALUE,)
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def get_table_columns(table: str) -> list[tuple[str, str]]:
+    """
+    Возвращает колонки таблицы в виде пар (имя, объявленный тип SQLite).
+    """
+    conn = sqlite3.connect(DATABASE_FILE)
+    try:
+        return [(row[1], row[2].upper()) for row in conn.execute(f"PRAGMA table_info({table})")]
+    finally:
+        conn.close()
+
+def iter_table_rows(table: str, since: str | None = None, until: str | None = None, chunk_size: int = 5000):
+    """
+    Построчно (пачками по chunk_size) читает таблицу с колонкой timestamp в порядке id.
+    since (включительно) и until (не включительно) — границы по timestamp в формате ISO 8601.
+    Используется отдельное соединение, поэтому долгая выгрузка не блокирует бота.
+    """
+    conditions, params = [], []
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = sqlite3.connect(DATABASE_FILE)
+    try:
+        cursor = conn.execute(f"SELECT * FROM {table}{where} ORDER BY id", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def get_characteristic_shortfalls() -> dict:
+    """
+    Возвращает для каждой колонки оценок третьего этапа средний недобор до максимума (10 - оценка)
+    у сообщений, отклоненных на третьем этапе. Учитываются только полученные оценки (не NULL);
+    для характеристики без оценок значение — None.
+    """
+    averages = ", ".join(f"AVG(10 - {column})" for column in PIPELINE_SCORE_COLUMNS)
+    conn = None
+    try:
+        conn = _acquire_connection()
+        row = conn.execute(
+            f"SELECT {averages} FROM pipeline_results WHERE is_filtered_by_stage_2 = 1 AND final_filter_value = 'Нет'"
+        ).fetchone()
+        return dict(zip(PIPELINE_SCORE_COLUMNS, row))
+    except sqlite3.Error as e:
+        logger.error("Ошибка при расчете статистики оценок третьего этапа: %s", e)
+        return dict.fromkeys(PIPELINE_SCORE_COLUMNS)
+    finally:
+        if conn:
+            _release_connection(conn)
+
 def get_stats() -> dict:
     """
     Получает текущую статистику по входящим и исходящим сообщениям
@@ -77,10 +289,12 @@ def get_stats() -> dict:
         'total_percentage': 0.0,
         'last_24h_incoming': 0,
         'last_24h_outgoing': 0,
-        'last_24h_percentage': 0.0
+        'last_24h_percentage': 0.0,
+        'total_skipped_calls': 0,
+        'last_24h_skipped_calls': 0
     }
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = _acquire_connection()
         cursor = conn.cursor()
 
         # Статистика за все время
@@ -113,14 +327,21 @@ def get_stats() -> dict:
         if stats['last_24h_incoming'] > 0:
             stats['last_24h_percentage'] = (stats['last_24h_outgoing'] / stats['last_24h_incoming']) * 100
 
+        # Запросы третьего этапа, сэкономленные досрочным завершением
+        cursor.execute(
+            "SELECT COALESCE(SUM(skipped_calls), 0), COALESCE(SUM(CASE WHEN timestamp >= ? THEN skipped_calls END), 0) FROM pipeline_results",
+            (twenty_four_hours_ago,)
+        )
+        stats['total_skipped_calls'], stats['last_24h_skipped_calls'] = cursor.fetchone()
+
         return stats
 
     except sqlite3.Error as e:
-        print(f"Ошибка при получении статистики: {e}")
+        logger.error("Ошибка при получении статистики: %s", e)
         return stats # Возвращаем дефолтные нули в случае ошибки
     finally:
         if conn:
-            conn.close()
+            _release_connection(conn)
 
 def reset_stats():
     """
@@ -128,16 +349,16 @@ def reset_stats():
     """
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = _acquire_connection()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM message_logs") # Удаляем все записи
         conn.commit()
-        print("Все счетчики сообщений сброшены до нуля (таблица message_logs очищена).")
+        logger.info("Все счетчики сообщений сброшены до нуля (таблица message_logs очищена).")
     except sqlite3.Error as e:
-        print(f"Ошибка при сбросе статистики: {e}")
+        logger.error("Ошибка при сбросе статистики: %s", e)
     finally:
         if conn:
-            conn.close()
+            _release_connection(conn)
 
 # Вызываем инициализацию базы данных при загрузке модуля
 initialize_database()
@@ -1,30 +1,200 @@
 # services/deepseek_processor.py
-from services.deepseek_service import deepseek_request
+import asyncio
+import logging
+import random
+import time
+from services.deepseek_service import is_error_response, run_deepseek_request
 import prompts
 from datetime import datetime
-from config.settings import CONTEXT_THRESHOLD, MAX_POTENTIAL # Импортируем MAX_POTENTIAL
+from config.settings import (
+    CONTEXT_THRESHOLD, MAX_POTENTIAL, SUM_POTENTIAL, STAGE1_BATCH_SIZE, STAGE1_BATCH_MAX_WAIT_MS, INPUT_TRIM_SHADOW_RATE,
+    STAGE3_EARLY_EXIT, STAGE3_ORDER_REFRESH_SECONDS, STAGE3_LAZY_EXPLAIN
+)
+from services import metrics
+from services.checkpoint_store import current_message_key, load_checkpoint, save_checkpoint
+from services.database_service import get_characteristic_shortfalls
+from services.micro_batcher import MicroBatcher
+from services.stage_profiles import get_stage_profile
+from services.tracing import detach_trace, span
+from utils.schema_validator import compile_schema
+from utils.text_trimming import trim_to_budget
+
+logger = logging.getLogger(__name__)
+
+# Критерии второго этапа (Context Filtration) в порядке их перечисления в промпте
+CONTEXT_CRITERIA = ("subject", "object", "which", "action", "time_place", "how", "reason", "consequences")
+
+# Схемы ответов компилируются в функции проверки один раз при импорте модуля
+INITIAL_FILTRATION_SCHEMA = compile_schema({
+    "type": "OBJECT",
+    "properties": {
+        "filter": {"type": "STRING", "enum": ["Да", "Нет"]},
+        "explain": {"type": "STRING"}
+    },
+    "required": ["filter", "explain"]
+})
+
+CONTEXT_FILTRATION_SCHEMA = compile_schema({
+    "type": "OBJECT",
+    "properties": {
+        **{key: {"type": "INTEGER", "minimum": 0, "maximum": 10} for key in CONTEXT_CRITERIA},
+        "explain": {"type": "STRING"}
+    },
+    "required": [*CONTEXT_CRITERIA, "explain"]
+})
+
+# Пакетный вариант первого этапа: по объекту на каждую новость пакета. Некорректный элемент
+# отбрасывается, а не отклоняет весь ответ: его новость уходит на одиночный запрос
+BATCH_FILTRATION_SCHEMA = compile_schema({
+    "type": "OBJECT",
+    "properties": {
+        "items": {
+            "type": "ARRAY",
+            "skip_invalid": True,
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "INTEGER"},
+                    "filter": {"type": "STRING", "enum": ["Да", "Нет"]},
+                    "explain": {"type": "STRING"}
+                },
+                "required": ["id", "filter", "explain"]
+            }
+        }
+    },
+    "required": ["items"]
+})
+
+EVALUATION_SCHEMA = compile_schema({
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "INTEGER", "minimum": 0, "maximum": 10},
+        "explain": {"type": "STRING"}
+    },
+    "required": ["score", "explain"]
+})
+
+# Только оценка характеристики (режим STAGE3_LAZY_EXPLAIN)
+SCORE_SCHEMA = compile_schema({
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "INTEGER", "minimum": 0, "maximum": 10}
+    },
+    "required": ["score"]
+})
+
+# Фоновые задачи теневого сравнения (ссылки хранятся, чтобы задачи не удалил сборщик мусора)
+_shadow_tasks = set()
+
+def fit_input(stage: str, main_message: str) -> str:
+    """
+    Сокращает текст новости до бюджета input_tokens из профиля этапа.
+    Оценки токенов пишутся в метрики input_tokens_total{stage} и input_tokens_saved_total{stage}.
+    """
+    budget = get_stage_profile(stage)["input_tokens"]
+    if not budget:
+        return main_message
+    text, original_tokens, trimmed_tokens = trim_to_budget(main_message, budget)
+    metrics.inc("input_tokens_total", original_tokens, stage=stage)
+    if trimmed_tokens < original_tokens:
+        metrics.inc("input_tokens_saved_total", original_tokens - trimmed_tokens, stage=stage)
+        metrics.inc("input_trimmed_total", stage=stage)
+    return text
+
+def _stage_prompts(stage: str, main_message: str, build_prompt) -> tuple[str, str | None]:
+    """
+    Строит промпт этапа из сокращенного текста. Возвращает (промпт, промпт с полным текстом),
+    второй элемент — None, если текст не сокращался.
+    """
+    text = fit_input(stage, main_message)
+    return build_prompt(text), (build_prompt(main_message) if text != main_message else None)
+
+def _shadow_verdict(stage: str, result: dict) -> tuple[object, float | None]:
+    """
+    Вердикт и балл ответа этапа для теневого сравнения.
+    """
+    if stage == "stage1":
+        return result.get("filter"), None
+    if stage == "stage2":
+        score = sum(result.get(key, 0) for key in CONTEXT_CRITERIA) / 8
+        return score >= CONTEXT_THRESHOLD, score
+    score = result.get("score", 0)
+    return score >= MAX_POTENTIAL, score
+
+def _maybe_shadow(stage: str, result: dict | str, full_prompt: str | None, response_schema) -> None:
+    """
+    Для доли INPUT_TRIM_SHADOW_RATE сокращенных текстов запускает в фоне запрос с полным текстом
+    и сравнивает вердикты (метрики trim_shadow_total, trim_shadow_mismatch_total, trim_shadow_score_diff).
+    """
+    if full_prompt is None or response_schema is None or not isinstance(result, dict):
+        return
+    if random.random() >= INPUT_TRIM_SHADOW_RATE:
+        return
+    task = asyncio.create_task(_shadow_compare(stage, result, full_prompt, response_schema))
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+async def _shadow_compare(stage: str, trimmed_result: dict, full_prompt: str, response_schema) -> None:
+    # Контрольная точка не используется: ответ на полный текст нужен только для сравнения
+    full_result = await run_deepseek_request(prompt=full_prompt, response_schema=response_schema, stage=stage)
+    if not isinstance(full_result, dict):
+        return
+    trimmed_verdict, trimmed_score = _shadow_verdict(stage, trimmed_result)
+    full_verdict, full_score = _shadow_verdict(stage, full_result)
+    metrics.inc("trim_shadow_total", stage=stage)
+    if trimmed_score is not None:
+        metrics.observe("trim_shadow_score_diff", abs(trimmed_score - full_score), stage=stage)
+    if trimmed_verdict != full_verdict:
+        metrics.inc("trim_shadow_mismatch_total", stage=stage)
+        logger.info(
+            "Теневое сравнение (этап %s): вердикт по сокращенному тексту (%s) не совпал с вердиктом по полному тексту (%s).",
+            stage, trimmed_verdict, full_verdict
+        )
+
+async def _deepseek_call(
+    stage: str, shadow_prompt: str | None = None, checkpoint_stage: str | None = None, **request_kwargs
+) -> dict | str:
+    """
+    Выполняет запрос к Deepseek в пуле потоков Deepseek (не блокируя цикл событий)
+    и записывает длительность в метрику deepseek_stage_seconds с меткой этапа.
+    Если для текущего сообщения уже есть контрольная точка этапа, запрос не выполняется;
+    успешный ответ сохраняется как контрольная точка.
+    shadow_prompt — промпт с полным текстом новости, если в prompt текст сокращен.
+    checkpoint_stage — ключ контрольной точки, если ответ этапа бывает в разных форматах
+    (по умолчанию stage).
+    """
+    message_key = current_message_key.get()
+    checkpoint_stage = checkpoint_stage or stage
+    with span(f"stage.{stage}", stage=stage) as stage_span:
+        checkpoint = load_checkpoint(message_key, checkpoint_stage)
+        if checkpoint is not None:
+            metrics.inc("checkpoint_hits_total", stage=stage)
+            stage_span.set_attributes(checkpoint_hit=True)
+            logger.info("Этап %s для сообщения %s восстановлен из контрольной точки.", stage, message_key)
+            return checkpoint
+
+        with metrics.timer("deepseek_stage_seconds", stage=stage):
+            result = await run_deepseek_request(stage=stage, **request_kwargs)
+        if is_error_response(result):
+            stage_span.set_error(result)
+        else:
+            with span("db.save_checkpoint", stage=stage):
+                save_checkpoint(message_key, checkpoint_stage, result)
+        _maybe_shadow(stage, result, shadow_prompt, request_kwargs.get("response_schema"))
+        return result
 
 async def perform_initial_filtration(main_message: str, message_link: str) -> tuple[str, str]:
     """
     Выполняет первый этап фильтрации сообщения с помощью Deepseek.
     Возвращает кортеж (filter_value_1, explain_value_1).
     """
-    deepseek_prompt_1 = f"Сообщение: {main_message}\nСсылка: {message_link}\n\n{prompts.FILTER_INSTRUCTIONS}"
-    
-    deepseek_response_schema_1 = {
-        "type": "OBJECT",
-        "properties": {
-            "filter": {"type": "STRING", "enum": ["Да", "Нет"]},
-            "explain": {"type": "STRING"}
-        },
-        "required": ["filter", "explain"]
-    }
-
-    print(f"Отправка запроса к Deepseek (этап 1) с промптом (часть): '{main_message[:50]}...'")
-    deepseek_result_1 = deepseek_request(
-        prompt=deepseek_prompt_1,
-        response_schema=deepseek_response_schema_1
-    )
+    logger.debug("Отправка запроса к Deepseek (этап 1) с промптом (часть): '%s...'", main_message[:50])
+    text = fit_input("stage1", main_message)
+    shadow_prompt = initial_filtration_prompt(main_message, message_link) if text != main_message else None
+    if STAGE1_BATCH_SIZE > 1:
+        deepseek_result_1 = await _batched_initial_filtration(text, message_link, shadow_prompt)
+    else:
+        deepseek_result_1 = await _single_initial_filtration(text, message_link, shadow_prompt)
     
     filter_value_1 = "Ошибка"
     explain_value_1 = "Не удалось получить объяснение от Deepseek (этап 1)."
@@ -32,178 +202,274 @@ async def perform_initial_filtration(main_message: str, message_link: str) -> tu
     if isinstance(deepseek_result_1, dict):
         filter_value_1 = deepseek_result_1.get("filter", "Ошибка")
         explain_value_1 = deepseek_result_1.get("explain", "Не удалось получить объяснение (этап 1).")
-        print(f"Получен структурированный ответ от Deepseek (этап 1): Filter='{filter_value_1}', Объяснение='{str(explain_value_1)[:50]}...'")
+        logger.debug("Получен структурированный ответ от Deepseek (этап 1): Filter='%s', Объяснение='%.50s...'", filter_value_1, explain_value_1)
     else:
-        print(f"Ошибка при получении структурированного ответа от Deepseek (этап 1): {deepseek_result_1}")
+        logger.warning("Ошибка при получении структурированного ответа от Deepseek (этап 1): %s", deepseek_result_1)
         explain_value_1 = str(deepseek_result_1)
     
     return filter_value_1, explain_value_1
 
-async def perform_context_filtration(main_message: str) -> tuple[str, int, str, bool]:
+# Промпты этапов. Инструкции можно передать явно, чтобы сравнивать варианты промптов
+# (benchmarks/prompt_benchmark.py); по умолчанию они берутся из prompts.py.
+
+def initial_filtration_prompt(main_message: str, message_link: str, instructions: str | None = None) -> str:
+    return f"Сообщение: {main_message}\nСсылка: {message_link}\n\n{instructions or prompts.FILTER_INSTRUCTIONS}"
+
+def context_filtration_prompt(main_message: str, current_date: str, instructions: str | None = None) -> str:
+    return f"Текущая дата: {current_date}\nСообщение: {main_message}\n\n{instructions or prompts.CONTEXT_FILTRATION_INSTRUCTIONS}"
+
+def characteristic_prompt(main_message: str, instructions: str) -> str:
+    return f"Текст новости: {main_message}\n\n{instructions}"
+
+async def _single_initial_filtration(main_message: str, message_link: str, shadow_prompt: str | None = None) -> dict | str:
+    return await _deepseek_call(
+        "stage1",
+        prompt=initial_filtration_prompt(main_message, message_link),
+        shadow_prompt=shadow_prompt,
+        response_schema=INITIAL_FILTRATION_SCHEMA
+    )
+
+# Пакетировщик первого этапа (создается в цикле событий при первом использовании)
+_stage1_batcher = None
+
+async def _batched_initial_filtration(main_message: str, message_link: str, shadow_prompt: str | None = None) -> dict | str:
+    """
+    Первый этап через пакетировщик. Контрольные точки по ключу сообщения работают так же,
+    как при одиночном запросе.
+    """
+    global _stage1_batcher
+    message_key = current_message_key.get()
+    checkpoint = load_checkpoint(message_key, "stage1")
+    if checkpoint is not None:
+        metrics.inc("checkpoint_hits_total", stage="stage1")
+        return checkpoint
+
+    loop = asyncio.get_running_loop()
+    if _stage1_batcher is None or _stage1_batcher.loop is not loop:
+        _stage1_batcher = MicroBatcher("stage1", _run_initial_filtration_batch, STAGE1_BATCH_SIZE, STAGE1_BATCH_MAX_WAIT_MS / 1000)
+
+    with span("stage.stage1", stage="stage1", batched=True), metrics.timer("deepseek_stage_seconds", stage="stage1"):
+        result = await _stage1_batcher.submit((main_message, message_link))
+    if isinstance(result, dict):
+        save_checkpoint(message_key, "stage1", result)
+    _maybe_shadow("stage1", result, shadow_prompt, INITIAL_FILTRATION_SCHEMA)
+    return result
+
+async def _run_initial_filtration_batch(items: list[tuple[str, str]]) -> list[dict | str]:
+    """
+    Отправляет пакет новостей первого этапа одним запросом. Вердикты, прошедшие проверку,
+    используются; новости без корректного вердикта (или весь пакет, если ответ не получен)
+    отправляются одиночными запросами одновременно.
+    """
+    # Пакет выполняется в отдельной задаче; контрольные точки каждой новости сохраняет
+    # вызывающий код, а здесь ключ сообщения, запустившего пакет, не должен использоваться
+    current_message_key.set(None)
+    detach_trace()
+    if len(items) == 1:
+        return [await _fallback_initial_filtration(*items[0])]
+
+    news_list = "\n\n".join(
+        f"Новость id={index}:\nСообщение: {main_message}\nСсылка: {message_link}"
+        for index, (main_message, message_link) in enumerate(items, start=1)
+    )
+    batch_prompt = f"{prompts.FILTER_INSTRUCTIONS}\n{prompts.BATCH_FILTER_INSTRUCTIONS}\n{news_list}"
+    logger.debug("Отправка пакетного запроса к Deepseek (этап 1): %d сообщений.", len(items))
+    batch_result = await run_deepseek_request(
+        prompt=batch_prompt,
+        response_schema=BATCH_FILTRATION_SCHEMA,
+        stage="stage1_batch",
+        max_tokens=min(get_stage_profile("stage1_batch")["max_tokens"], get_stage_profile("stage1")["max_tokens"] * len(items))
+    )
+
+    verdicts = {}
+    if isinstance(batch_result, dict):
+        verdicts = {item["id"]: {"filter": item["filter"], "explain": item["explain"]} for item in batch_result["items"]}
+    else:
+        logger.warning("Пакетный ответ Deepseek (этап 1) не получен: %s. Переход на одиночные запросы.", batch_result)
+
+    # Новости без вердикта в пакетном ответе запрашиваются по одной, одновременно
+    missing = [index for index in range(1, len(items) + 1) if index not in verdicts]
+    if missing:
+        metrics.inc("stage1_batch_fallbacks_total", len(missing))
+        fallbacks = await asyncio.gather(*(_fallback_initial_filtration(*items[index - 1]) for index in missing))
+        verdicts.update(zip(missing, fallbacks))
+    return [verdicts[index] for index in range(1, len(items) + 1)]
+
+async def _fallback_initial_filtration(main_message: str, message_link: str) -> dict | str:
+    # Длительность уже учитывается в deepseek_stage_seconds{stage="stage1"} вызывающего кода
+    return await run_deepseek_request(
+        prompt=initial_filtration_prompt(main_message, message_link),
+        response_schema=INITIAL_FILTRATION_SCHEMA,
+        stage="stage1"
+    )
+
+async def perform_context_filtration(main_message: str, threshold: float = CONTEXT_THRESHOLD) -> tuple[str, int, str, bool, dict]:
     """
     Выполняет второй этап фильтрации сообщения (Context Filtration) с помощью Deepseek.
-    Возвращает кортеж (filter_value_2, total_score_context, explain_value_2, is_filtered_by_stage_2).
+    Возвращает кортеж (filter_value_2, total_score_context, explain_value_2, is_filtered_by_stage_2, context_scores),
+    где context_scores — словарь с оценками по каждому критерию (пустой, если ответ не получен).
+    threshold — порог средней оценки (при перегрузке может быть выше CONTEXT_THRESHOLD).
     """
     filter_value_2 = "Нет"
     total_score_context = 0
     explain_value_2 = "Второй этап фильтрации не проводился (первый этап вернул 'Нет')."
     is_filtered_by_stage_2 = False # Флаг для лог-бота, чтобы знать, проводился ли 3-й этап
+    context_scores = {}
 
     current_date = datetime.now().strftime("%Y-%m-%d")
-    deepseek_prompt_2 = f"Текущая дата: {current_date}\nСообщение: {main_message}\n\n{prompts.CONTEXT_FILTRATION_INSTRUCTIONS}"
-
-    deepseek_response_schema_2 = {
-        "type": "OBJECT",
-        "properties": {
-            "subject": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "object": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "which": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "action": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "time_place": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "how": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "reason": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "consequences": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "explain": {"type": "STRING"}
-        },
-        "required": ["subject", "object", "which", "action", "time_place", "how", "reason", "consequences", "explain"]
-    }
+    deepseek_prompt_2, shadow_prompt_2 = _stage_prompts(
+        "stage2", main_message,
+        lambda text: context_filtration_prompt(text, current_date)
+    )
 
-    print(f"Отправка запроса к Deepseek (этап 2 - Context Filtration) с промптом (часть): '{main_message[:50]}...'")
-    deepseek_result_2 = deepseek_request(
+    logger.debug("Отправка запроса к Deepseek (этап 2 - Context Filtration) с промптом (часть): '%s...'", main_message[:50])
+    deepseek_result_2 = await _deepseek_call(
+        "stage2",
         prompt=deepseek_prompt_2,
-        response_schema=deepseek_response_schema_2
+        shadow_prompt=shadow_prompt_2,
+        response_schema=CONTEXT_FILTRATION_SCHEMA
     )
 
     if isinstance(deepseek_result_2, dict):
-        scores_context = [
-            deepseek_result_2.get("subject", 0),
-            deepseek_result_2.get("object", 0),
-            deepseek_result_2.get("which", 0),
-            deepseek_result_2.get("action", 0),
-            deepseek_result_2.get("time_place", 0),
-            deepseek_result_2.get("how", 0),
-            deepseek_result_2.get("reason", 0),
-            deepseek_result_2.get("consequences", 0)
-        ]
-        total_score_context = sum(scores_context) / 8
+        context_scores = {key: deepseek_result_2.get(key, 0) for key in CONTEXT_CRITERIA}
+        total_score_context = sum(context_scores.values()) / 8
         explain_value_2 = deepseek_result_2.get("explain", "Не удалось получить объяснение (этап 2).")
         
-        if total_score_context >= CONTEXT_THRESHOLD:
+        if total_score_context >= threshold:
             filter_value_2 = "Да"
             is_filtered_by_stage_2 = True
         else:
             filter_value_2 = "Нет"
 
-        print(f"Получен структурированный ответ от Deepseek (этап 2): Сумма баллов={total_score_context}, Фильтр='{filter_value_2}', Объяснение='{str(explain_value_2)[:50]}...'")
+        logger.debug(
+            "Получен структурированный ответ от Deepseek (этап 2): Сумма баллов=%s, Фильтр='%s', Объяснение='%.50s...'",
+            total_score_context, filter_value_2, explain_value_2
+        )
     else:
-        print(f"Ошибка при получении структурированного ответа от Deepseek (этап 2): {deepseek_result_2}")
+        logger.warning("Ошибка при получении структурированного ответа от Deepseek (этап 2): %s", deepseek_result_2)
         explain_value_2 = str(deepseek_result_2)
     
-    return filter_value_2, total_score_context, explain_value_2, is_filtered_by_stage_2
+    return filter_value_2, total_score_context, explain_value_2, is_filtered_by_stage_2, context_scores
+
+# Характеристики третьего этапа: (ключ, этап, инструкции, что оценивается — для сообщений об ошибках)
+CHARACTERISTICS = (
+    ("emotion", "stage3_emotion", prompts.EMOTION_INSTRUCTIONS, "эмоциональной яркости"),
+    ("image", "stage3_image", prompts.IMAGE_INSTRUCTIONS, "образности"),
+    ("heroes", "stage3_heroes", prompts.HEROES_INSTRUCTIONS, "героев"),
+    ("actual", "stage3_actual", prompts.ACTUAL_INSTRUCTIONS, "актуальности"),
+    ("drama", "stage3_drama", prompts.DRAMA_INSTRUCTIONS, "драматичности"),
+)
+# Максимальная оценка характеристики (см. EVALUATION_SCHEMA)
+MAX_CHARACTERISTIC_SCORE = 10
+SKIPPED_EXPLAIN = "Не оценивалась: сумма баллов не могла достичь SUM_POTENTIAL."
+NOT_REQUESTED_EXPLAIN = "Не запрашивалось (STAGE3_LAZY_EXPLAIN)."
+
+# Порядок оценки характеристик и время его последнего пересчета (см. _characteristics_order)
+_order = [key for key, *_ in CHARACTERISTICS]
+_order_updated_at = None
+
+async def _characteristics_order() -> list[str]:
+    """
+    Возвращает порядок оценки характеристик: первыми идут те, по которым отклоненные
+    на третьем этапе сообщения в среднем сильнее всего недобирают до максимума —
+    так досрочное завершение срабатывает раньше. Порядок пересчитывается по pipeline_results
+    не чаще раза в STAGE3_ORDER_REFRESH_SECONDS; без истории используется порядок CHARACTERISTICS.
+    """
+    global _order, _order_updated_at
+    now = time.monotonic()
+    if _order_updated_at is not None and now - _order_updated_at < STAGE3_ORDER_REFRESH_SECONDS:
+        return _order
+    _order_updated_at = now
+    shortfalls = await asyncio.to_thread(get_characteristic_shortfalls)
+    keys = [key for key, *_ in CHARACTERISTICS]
+    _order = sorted(keys, key=lambda key: -(shortfalls.get(f"{key}_score") or 0))
+    logger.debug("Порядок оценки характеристик третьего этапа: %s", _order)
+    return _order
 
-async def evaluate_characteristics(main_message: str) -> tuple[int, str, int, str, int, str, int, str, int, str, int, list]:
+async def evaluate_characteristics(
+    main_message: str, lazy_explain: bool = STAGE3_LAZY_EXPLAIN, early_exit: bool = STAGE3_EARLY_EXIT
+) -> tuple[int, str, int, str, int, str, int, str, int, str, int, list]:
     """
     Выполняет третий этап фильтрации: оценку эмоциональных и стилистических характеристик.
     Возвращает все оценки и объяснения, а также общий потенциал и список баллов.
+
+    Характеристики оцениваются по одной (см. _characteristics_order). При early_exit оценка
+    прекращается, как только даже максимальные баллы за оставшиеся характеристики не дадут
+    SUM_POTENTIAL: у пропущенных характеристик оценка None, пропуски пишутся в метрику
+    stage3_calls_skipped_total.
+    При lazy_explain запрашиваются только оценки, а объяснения заменяются на
+    NOT_REQUESTED_EXPLAIN (нужные объяснения запрашивает explain_characteristic).
+    По умолчанию оба режима берутся из STAGE3_EARLY_EXIT и STAGE3_LAZY_EXPLAIN.
     """
-    emotion_score, emotion_explain = 0, "N/A"
-    image_score, image_explain = 0, "N/A"
-    heroes_score, heroes_explain = 0, "N/A"
-    actual_score, actual_explain = 0, "N/A"
-    drama_score, drama_explain = 0, "N/A"
-
-    evaluation_schema = {
-        "type": "OBJECT",
-        "properties": {
-            "score": {"type": "INTEGER", "minimum": 0, "maximum": 10},
-            "explain": {"type": "STRING"}
-        },
-        "required": ["score", "explain"]
-    }
+    scores = {key: 0 for key, *_ in CHARACTERISTICS}
+    explains = {key: "N/A" for key, *_ in CHARACTERISTICS}
+    characteristics = {key: (stage, instructions, subject) for key, stage, instructions, subject in CHARACTERISTICS}
+    order = await _characteristics_order() if early_exit else list(characteristics)
+    required_sum = SUM_POTENTIAL * len(CHARACTERISTICS)
 
-    # Обработка emotion_result
-    emotion_result = deepseek_request(
-        prompt=f"Текст новости: {main_message}\n\n{prompts.EMOTION_INSTRUCTIONS}",
-        response_schema=evaluation_schema
-    )
-    if isinstance(emotion_result, dict):
-        emotion_score = emotion_result.get("score", 0)
-        emotion_explain = emotion_result.get("explain", "Не получено объяснение.")
-    else:
-        print(f"Ошибка при оценке эмоциональной яркости: {emotion_result}")
-        emotion_explain = str(emotion_result)
-        emotion_score = 0
-    print(f"Эмоциональная яркость: {emotion_score}, Объяснение: {str(emotion_explain)[:50]}...")
+    for position, key in enumerate(order):
+        remaining = len(order) - position
+        collected = sum(scores[done] for done in order[:position] if isinstance(scores[done], int))
+        if early_exit and collected + remaining * MAX_CHARACTERISTIC_SCORE < required_sum:
+            for skipped in order[position:]:
+                scores[skipped], explains[skipped] = None, SKIPPED_EXPLAIN
+            metrics.inc("stage3_calls_skipped_total", remaining)
+            logger.debug("Третий этап завершен досрочно: набрано %s, пропущено оценок: %d", collected, remaining)
+            break
 
+        stage, instructions, subject = characteristics[key]
+        if lazy_explain:
+            instructions += prompts.SCORE_ONLY_INSTRUCTIONS
+        prompt, shadow_prompt = _stage_prompts(
+            stage, main_message, lambda text, instructions=instructions: characteristic_prompt(text, instructions)
+        )
+        result = await _deepseek_call(
+            stage,
+            prompt=prompt,
+            shadow_prompt=shadow_prompt,
+            response_schema=SCORE_SCHEMA if lazy_explain else EVALUATION_SCHEMA,
+            # Ответ только с оценкой не должен подменить полный ответ после смены режима
+            checkpoint_stage=f"{stage}_score" if lazy_explain else stage
+        )
+        if isinstance(result, dict):
+            scores[key] = result.get("score", 0)
+            explains[key] = NOT_REQUESTED_EXPLAIN if lazy_explain else result.get("explain", "Не получено объяснение.")
+        else:
+            logger.warning("Ошибка при оценке %s: %s", subject, result)
+            scores[key], explains[key] = 0, str(result)
+        logger.debug("Оценка %s: %s, Объяснение: %.50s...", subject, scores[key], explains[key])
 
-    # Обработка image_result
-    image_result = deepseek_request(
-        prompt=f"Текст новости: {main_message}\n\n{prompts.IMAGE_INSTRUCTIONS}",
-        response_schema=evaluation_schema
-    )
-    if isinstance(image_result, dict):
-        image_score = image_result.get("score", 0)
-        image_explain = image_result.get("explain", "Не получено объяснение.")
-    else:
-        print(f"Ошибка при оценке образности: {image_result}")
-        image_explain = str(image_result)
-        image_score = 0
-    print(f"Образность: {image_score}, Объяснение: {str(image_explain)[:50]}...")
-
-    # Обработка heroes_instruction
-    heroes_result = deepseek_request(
-        prompt=f"Текст новости: {main_message}\n\n{prompts.HEROES_INSTRUCTIONS}",
-        response_schema=evaluation_schema
-    )
-    if isinstance(heroes_result, dict):
-        heroes_score = heroes_result.get("score", 0)
-        heroes_explain = heroes_result.get("explain", "Не получено объяснение.")
-    else:
-        print(f"Ошибка при оценке юмора: {heroes_result}")
-        heroes_explain = str(heroes_result)
-        heroes_explain = 0
-    print(f"Юмор: {heroes_explain}, Объяснение: {str(heroes_explain)[:50]}...")
-
-    # Обработка actual_result
-    actual_result = deepseek_request(
-        prompt=f"Текст новости: {main_message}\n\n{prompts.ACTUAL_INSTRUCTIONS}",
-        response_schema=evaluation_schema
-    )
-    if isinstance(actual_result, dict):
-        actual_score = actual_result.get("score", 0)
-        actual_explain = actual_result.get("explain", "Не получено объяснение.")
-    else:
-        print(f"Ошибка при оценке неожиданности: {actual_result}")
-        actual_explain = str(actual_result)
-        actual_score = 0
-    print(f"Неожиданность: {actual_score}, Объяснение: {str(actual_explain)[:50]}...")
-
-    # Обработка drama_result
-    drama_result = deepseek_request(
-        prompt=f"Текст новости: {main_message}\n\n{prompts.DRAMA_INSTRUCTIONS}",
-        response_schema=evaluation_schema
-    )
-    if isinstance(drama_result, dict):
-        drama_score = drama_result.get("score", 0)
-        drama_explain = drama_result.get("explain", "Не получено объяснение.")
-    else:
-        print(f"Ошибка при оценке драматичности: {drama_result}")
-        drama_explain = str(drama_result)
-        drama_score = 0
-    print(f"Драматичность: {drama_score}, Объяснение: {str(drama_explain)[:50]}...")
-    
-    potential_scores_list = [emotion_score, image_score, heroes_score, actual_score, drama_score]
+    potential_scores_list = [scores[key] for key, *_ in CHARACTERISTICS]
     total_potential_score = sum(s for s in potential_scores_list if isinstance(s, int)) / 5
 
     return (
-        emotion_score, emotion_explain,
-        image_score, image_explain,
-        heroes_score, heroes_explain,
-        actual_score, actual_explain,
-        drama_score, drama_explain,
+        scores["emotion"], explains["emotion"],
+        scores["image"], explains["image"],
+        scores["heroes"], explains["heroes"],
+        scores["actual"], explains["actual"],
+        scores["drama"], explains["drama"],
         total_potential_score, potential_scores_list
     )
 
+async def explain_characteristic(main_message: str, key: str, score: int) -> str:
+    """
+    Запрашивает объяснение уже полученной оценки характеристики key (режим STAGE3_LAZY_EXPLAIN).
+    Запрос выполняется как этап stage3_{key}_explain со своей контрольной точкой.
+    """
+    stage, instructions, subject = next(
+        (stage, instructions, subject) for name, stage, instructions, subject in CHARACTERISTICS if name == key
+    )
+    explain_stage = f"{stage}_explain"
+    text = fit_input(explain_stage, main_message)
+    result = await _deepseek_call(
+        explain_stage,
+        prompt=f"{prompts.EXPLAIN_SCORE_INSTRUCTIONS}\nТекст новости: {text}\n\nКритерии оценки:\n{instructions}\nОценка: {score}"
+    )
+    if is_error_response(result):
+        logger.warning("Ошибка при получении объяснения оценки %s: %s", subject, result)
+        return str(result)
+    return result.strip()
+
 async def generate_commentary_recommendations(
     main_message: str,
     emotion_score: int, emotion_explain: str,
@@ -241,19 +507,19 @@ async def generate_commentary_recommendations(
 
     # Используем промпт из prompts.py и форматируем его
     commentary_prompt = prompts.COMMENTARY_RECOMMENDATIONS_INSTRUCTIONS.format(
-        main_message=main_message,
+        main_message=fit_input("recommendations", main_message),
         combined_explains_for_prompt=combined_explains_for_prompt
     )
 
-    print(f"Отправка запроса к Deepseek для генерации рекомендаций: '{commentary_prompt[:100]}...'")
-    recommendations_result = deepseek_request(
-        prompt=commentary_prompt,
-        max_tokens=200 # Уменьшаем max_tokens для более короткого ответа (примерно 50 токенов на предложение)
+    logger.debug("Отправка запроса к Deepseek для генерации рекомендаций: '%s...'", commentary_prompt[:100])
+    recommendations_result = await _deepseek_call(
+        "recommendations",
+        prompt=commentary_prompt # max_tokens берется из профиля этапа recommendations (STAGE_PROFILES)
     )
 
     if isinstance(recommendations_result, str):
         return recommendations_result
     else:
-        print(f"Ошибка при получении рекомендаций от Deepseek: {recommendations_result}")
+        logger.warning("Ошибка при получении рекомендаций от Deepseek: %s", recommendations_result)
         return "Не удалось сгенерировать рекомендации."
 
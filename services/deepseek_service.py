@@ -1,137 +1,343 @@
 # services/deepseek_service.py
+import asyncio
 import requests
+import contextvars
+import functools
 import json
-import re
-from config.settings import DEEPSEEK_API_KEY
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from config.settings import (
+    DEEPSEEK_API_KEY, DEEPSEEK_API_URL, DEEPSEEK_ENDPOINTS,
+    DEEPSEEK_EJECT_AFTER_FAILURES, DEEPSEEK_EJECT_SECONDS, DEEPSEEK_EJECT_MAX_SECONDS,
+    DEEPSEEK_ADAPTIVE_CONCURRENCY, DEEPSEEK_CONCURRENCY_INITIAL, DEEPSEEK_CONCURRENCY_MIN, DEEPSEEK_CONCURRENCY_MAX,
+    DEEPSEEK_LATENCY_TOLERANCE, DEEPSEEK_RATE_LIMIT_RETRIES
+)
+from services import metrics
+from services.concurrency_limiter import AdaptiveConcurrencyLimiter
+from services.endpoint_pool import EndpointPool, parse_members
+from services.stage_profiles import get_stage_profile, effective_max_tokens, record_completion, is_auto_sized
+from services.tracing import SPAN_KIND_CLIENT, span
+from utils.schema_validator import CompiledSchema, compile_schema
 
-# Исправлено: URL теперь является простой строкой, а не Markdown-ссылкой
-DEEPSEEK_API_URL = "https://api.deepseek.com/chat/completions"
+logger = logging.getLogger(__name__)
 
-def deepseek_request(
-    prompt: str,
-    model: str = "deepseek-chat",
-    max_tokens: int = 500,
-    response_schema: dict = None
-) -> dict | str:
+# Общая HTTP-сессия на процесс: соединения с Deepseek переиспользуются (keep-alive)
+# всеми этапами и всеми ботами, запущенными в этом процессе.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=DEEPSEEK_CONCURRENCY_MAX))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=DEEPSEEK_CONCURRENCY_MAX))
+
+# Лимит одновременных запросов к Deepseek на процесс (метрики deepseek_concurrency_limit, deepseek_inflight)
+_limiter = AdaptiveConcurrencyLimiter(
+    "deepseek",
+    initial_limit=DEEPSEEK_CONCURRENCY_INITIAL,
+    min_limit=DEEPSEEK_CONCURRENCY_MIN if DEEPSEEK_ADAPTIVE_CONCURRENCY else DEEPSEEK_CONCURRENCY_INITIAL,
+    max_limit=DEEPSEEK_CONCURRENCY_MAX if DEEPSEEK_ADAPTIVE_CONCURRENCY else DEEPSEEK_CONCURRENCY_INITIAL,
+    latency_tolerance=DEEPSEEK_LATENCY_TOLERANCE
+)
+
+# Отдельный пул потоков для запросов к Deepseek (см. run_deepseek_request). Ожидание слота
+# лимитера блокирует поток, поэтому запросы не выполняются в пуле asyncio.to_thread: ожидающие
+# запросы заняли бы его потоки и задержали запись в базу. Потоков не меньше максимального лимита,
+# чтобы лимит DEEPSEEK_CONCURRENCY_MAX был достижим.
+_executor = ThreadPoolExecutor(
+    max_workers=max(DEEPSEEK_CONCURRENCY_MAX, DEEPSEEK_CONCURRENCY_INITIAL),
+    thread_name_prefix="deepseek"
+)
+
+# Пул конечных точек (ключей и адресов API): маршрутизация по нагрузке и исключение неисправных.
+# Лимит одновременных запросов выше — общий на процесс, участник выбирается уже после получения слота.
+_pool = EndpointPool(
+    parse_members(DEEPSEEK_ENDPOINTS, DEEPSEEK_API_URL, DEEPSEEK_API_KEY),
+    eject_after_failures=DEEPSEEK_EJECT_AFTER_FAILURES,
+    eject_seconds=DEEPSEEK_EJECT_SECONDS,
+    max_eject_seconds=DEEPSEEK_EJECT_MAX_SECONDS
+)
+
+# Учет токенов и запросов в текущем контексте (см. track_usage)
+_usage = contextvars.ContextVar("deepseek_usage", default=None)
+
+# Начала строк, которыми deepseek_request сообщает об ошибке вместо ответа модели
+ERROR_PREFIXES = ("Ошибка", "Общая ошибка запроса к Deepseek", "Неизвестная ошибка при работе с Deepseek")
+
+def is_error_response(result) -> bool:
     """
-    Отправляет запрос к Deepseek Chat API и возвращает сгенерированный текст или структурированный JSON.
-    Включает попытку парсинга Markdown-подобного текстового вывода в случае, если модель не возвращает строгий JSON.
-    Установлен таймаут для предотвращения зависаний.
+    Проверяет, является ли результат deepseek_request текстом ошибки, а не ответом модели.
     """
-    if not DEEPSEEK_API_KEY:
-        return "Ошибка: Deepseek API ключ не установлен."
+    return isinstance(result, str) and result.startswith(ERROR_PREFIXES)
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-    }
+def close_session():
+    """
+    Закрывает общую HTTP-сессию (вызывается при остановке бота).
+    """
+    _session.close()
 
-    # Если ожидается структурированный ответ, добавим явную инструкцию в промпт
-    modified_prompt = prompt
-    if response_schema:
-        modified_prompt += "\n\nВерни ответ в формате строгого JSON, соответствующего предоставленной схеме."
+@contextmanager
+def track_usage():
+    """
+    Считает токены (по полю usage) и ответы Deepseek, полученные внутри блока, включая
+    повторы и попытку исправления ответа. Возвращает словарь prompt_tokens,
+    completion_tokens, responses. Контекст копируется в потоки run_deepseek_request, поэтому
+    учитываются и запросы из рабочих потоков.
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "responses": 0}
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+def endpoint_stats() -> list[dict]:
+    """
+    Возвращает сводку по участникам пула конечных точек (запросы, ошибки, задержка, исключение).
+    """
+    return _pool.stats()
 
+def _post_chat(
+    messages: list, model: str, max_tokens: int, temperature: float | None, json_mode: bool, stage: str
+) -> tuple[str | None, str | None, str | None]:
+    """
+    Отправляет запрос к Deepseek Chat API.
+    Возвращает кортеж (content, error, finish_reason): текст ответа модели или текст ошибки
+    и причину завершения генерации ("length" — ответ обрезан по max_tokens).
+    Длина ответа учитывается для автоподбора max_tokens этапа.
+    Установлен таймаут для предотвращения зависаний.
+    Участник пула конечных точек выбирается на каждую попытку; после 429, 401/403, 5xx
+    или ошибки подключения запрос повторяется на другом участнике, если он есть.
+    """
     payload = {
         "model": model,
-        "messages": [
-            {"role": "user", "content": modified_prompt} # Используем модифицированный промпт
-        ],
+        "messages": messages,
         "max_tokens": max_tokens,
         "stream": False
     }
+    if temperature is not None:
+        payload["temperature"] = temperature
+    if json_mode:
+        # Нативный JSON-режим Deepseek: модель гарантированно возвращает JSON-объект
+        payload["response_format"] = {"type": "json_object"}
 
-    if response_schema:
-        payload["generationConfig"] = {
-            "responseMimeType": "application/json",
-            "responseSchema": response_schema
-        }
-
+    failed_member = None # участник, на котором не удалась предыдущая попытка
     try:
-        # Устанавливаем таймаут для запроса (в данном случае 60 секунд)
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, data=json.dumps(payload), timeout=60)
+        for attempt in range(DEEPSEEK_RATE_LIMIT_RETRIES + 1):
+            with span("deepseek.http", kind=SPAN_KIND_CLIENT, stage=stage, attempt=attempt, max_tokens=max_tokens) as request_span:
+                wait_started_at = time.monotonic()
+                # Базовая задержка считается по этапу: длина ответа у этапов разная
+                with _limiter.slot(stage) as outcome:
+                    member = _pool.acquire(exclude=failed_member)
+                    started_at = time.monotonic()
+                    # Ожидание слота лимитера учитывается отдельно от времени самого запроса
+                    request_span.set_attributes(
+                        limiter_wait_seconds=round(started_at - wait_started_at, 3),
+                        endpoint=member.name,
+                        model=member.model or model
+                    )
+                    body = json.dumps({**payload, "model": member.model or model})
+                    try:
+                        # Устанавливаем таймаут для запроса (в данном случае 60 секунд)
+                        response = _session.post(member.url, headers=member.headers, data=body, timeout=60)
+                    except requests.exceptions.RequestException as e:
+                        outcome.record(congested=isinstance(e, requests.exceptions.Timeout))
+                        _pool.release(member, None, ok=False)
+                        # Запрос не дошел до участника — повторяем на другом участнике пула.
+                        # Таймаут ответа не повторяется: модель могла уже выполнить запрос.
+                        if (
+                            isinstance(e, requests.exceptions.ConnectionError)
+                            and attempt < DEEPSEEK_RATE_LIMIT_RETRIES and _pool.has_alternative(member)
+                        ):
+                            request_span.set_error(f"{type(e).__name__}: {e}")
+                            logger.warning("Ошибка подключения к %s: %s, повтор через другого участника пула.", member.name, e)
+                            failed_member = member
+                            continue
+                        raise
+                    latency = time.monotonic() - started_at
+                    rate_limited = response.status_code == 429
+                    # Ошибки, за которые отвечает участник (ключ отозван, лимит аккаунта, сбой сервера),
+                    # а не сам запрос
+                    member_failed = rate_limited or response.status_code in (401, 403) or response.status_code >= 500
+                    _pool.release(member, latency, ok=not member_failed)
+                    failover = member_failed and attempt < DEEPSEEK_RATE_LIMIT_RETRIES and _pool.has_alternative(member)
+                    if failover:
+                        # 429 от одного ключа — лимит этого участника, а не перегрузка API: общий
+                        # лимит процесса не уменьшаем, запрос уйдет другому участнику
+                        outcome.record()
+                    else:
+                        outcome.record(latency, congested=rate_limited)
+                request_span.set_attributes(status_code=response.status_code)
+                if response.status_code >= 400:
+                    request_span.set_error(f"HTTP {response.status_code}")
+            if not member_failed or attempt == DEEPSEEK_RATE_LIMIT_RETRIES:
+                break
+            if failover:
+                # Другой участник пула (другой ключ или адрес) — повторяем сразу через него
+                logger.warning("%s вернул %d, повтор через другого участника пула.", member.name, response.status_code)
+                failed_member = member
+                continue
+            if not rate_limited:
+                break
+            # Лимит уже уменьшен; ждем, сколько просит API, и повторяем
+            retry_after = _retry_after_seconds(response, attempt)
+            logger.warning("Deepseek вернул 429, повтор через %.1f с (лимит одновременных запросов: %d).", retry_after, _limiter.limit)
+            time.sleep(retry_after)
         response.raise_for_status()
 
         response_data = response.json()
-        
+
         if response_data and response_data.get("choices"):
-            content = response_data["choices"][0]["message"]["content"].strip()
-            
-            if response_schema:
-                # Более гибкая попытка очистить от markdown-кодовых блоков
-                content_to_parse = content
-                if content_to_parse.startswith("```json"):
-                    content_to_parse = content_to_parse[len("```json"):].strip()
-                elif content_to_parse.startswith("```"):
-                    content_to_parse = content_to_parse[len("```"):].strip()
-                
-                # Удаляем закрывающий блок, если он есть
-                if content_to_parse.endswith("```"):
-                    content_to_parse = content_to_parse[:-len("```")].strip()
-
-                try:
-                    # 2. Попытка декодировать как строгий JSON
-                    return json.loads(content_to_parse)
-                except json.JSONDecodeError:
-                    # 3. Если не строгий JSON, пытаемся парсить как "**key**: value"
-                    print(f"Предупреждение: Deepseek вернул нестрогий JSON. Попытка парсинга текстового формата: {content_to_parse[:100]}...")
-                    parsed_data = {}
-                    
-                    lines = content_to_parse.split('\n')
-                    pattern = re.compile(r'\*\*(.*?)\*\*:\s*(.*)')
-
-                    for line in lines:
-                        match = pattern.search(line.strip())
-                        if match:
-                            key = match.group(1).strip()
-                            value = match.group(2).strip()
-                            parsed_data[key] = value
-                    
-                    # Попытка преобразовать числовые поля в int
-                    # Проходимся по всем свойствам в response_schema
-                    for prop_name, prop_details in response_schema.get('properties', {}).items():
-                        if prop_name in parsed_data and prop_details.get('type') == 'INTEGER':
-                            try:
-                                parsed_data[prop_name] = int(parsed_data[prop_name])
-                            except ValueError:
-                                pass # Оставляем как строку, если не число
-
-                    # Убедимся, что все "required" поля из response_schema присутствуют
-                    # Если поле отсутствует, добавляем его с дефолтным значением или ошибкой
-                    for required_key in response_schema.get('required', []):
-                        if required_key not in parsed_data:
-                            if response_schema['properties'].get(required_key, {}).get('type') == 'STRING':
-                                parsed_data[required_key] = f"Отсутствует '{required_key}' в ответе Deepseek."
-                            elif response_schema['properties'].get(required_key, {}).get('type') == 'INTEGER':
-                                parsed_data[required_key] = 0 # Дефолтное значение для чисел
-                            else:
-                                parsed_data[required_key] = "N/A" # Общий дефолт
-
-                    # Финальная проверка: если все required поля присутствуют, возвращаем parsed_data
-                    # Иначе, возвращаем ошибку
-                    all_required_present = all(key in parsed_data for key in response_schema.get('required', []))
-                    
-                    if all_required_present:
-                        return parsed_data
-                    else:
-                        return f"Ошибка Deepseek API: Не удалось декодировать JSON или текстовый формат в ожидаемую схему. Отсутствуют обязательные поля. Получено: {content}"
-            else:
-                return content # Если response_schema не предоставлена, возвращаем сырой текст
-        else:
-            return f"Ошибка Deepseek API: Неожиданный формат ответа: {response_data}"
+            choice = response_data["choices"][0]
+            usage = response_data.get("usage") or {}
+            request_span.set_attributes(
+                prompt_tokens=usage.get("prompt_tokens"),
+                completion_tokens=usage.get("completion_tokens"),
+                finish_reason=choice.get("finish_reason")
+            )
+            record_completion(stage, usage.get("completion_tokens"), choice.get("finish_reason"), max_tokens)
+            tracked = _usage.get()
+            if tracked is not None:
+                tracked["prompt_tokens"] += usage.get("prompt_tokens") or 0
+                tracked["completion_tokens"] += usage.get("completion_tokens") or 0
+                tracked["responses"] += 1
+            return (choice["message"]["content"] or "").strip(), None, choice.get("finish_reason")
+        return None, f"Ошибка Deepseek API: Неожиданный формат ответа: {response_data}", None
 
     except requests.exceptions.Timeout as timeout_err:
-        print(f"Таймаут запроса к Deepseek: {timeout_err}")
-        return f"Ошибка: Запрос к Deepseek превысил таймаут ({timeout_err}). Попробуйте позже."
+        logger.warning("Таймаут запроса к Deepseek: %s", timeout_err)
+        return None, f"Ошибка: Запрос к Deepseek превысил таймаут ({timeout_err}). Попробуйте позже.", None
     except requests.exceptions.HTTPError as http_err:
-        print(f"Ошибка HTTP при запросе к Deepseek: {http_err} - {response.text}")
-        return f"Ошибка HTTP при запросе к Deepseek: {http_err}"
+        logger.error("Ошибка HTTP при запросе к Deepseek: %s - %s", http_err, response.text)
+        return None, f"Ошибка HTTP при запросе к Deepseek: {http_err}", None
     except requests.exceptions.ConnectionError as conn_err:
-        print(f"Ошибка подключения к Deepseek: {conn_err}")
-        return f"Ошибка подключения к Deepseek: {conn_err}"
+        logger.error("Ошибка подключения к Deepseek: %s", conn_err)
+        return None, f"Ошибка подключения к Deepseek: {conn_err}", None
     except requests.exceptions.RequestException as req_err:
-        print(f"Общая ошибка запроса к Deepseek: {req_err}")
-        return f"Общая ошибка запроса к Deepseek: {req_err}"
+        logger.error("Общая ошибка запроса к Deepseek: %s", req_err)
+        return None, f"Общая ошибка запроса к Deepseek: {req_err}", None
     except Exception as e:
-        print(f"Неизвестная ошибка при работе с Deepseek: {e}")
-        return f"Неизвестная ошибка при работе с Deepseek: {e}"
+        logger.exception("Неизвестная ошибка при работе с Deepseek: %s", e)
+        return None, f"Неизвестная ошибка при работе с Deepseek: {e}", None
+
+def _complete(
+    messages: list, stage: str, model: str | None, max_tokens: int | None, temperature: float | None, json_mode: bool
+) -> tuple[str | None, str | None]:
+    """
+    Выполняет запрос с параметрами из профиля этапа (явно переданные значения имеют приоритет).
+    Если ответ обрезан из-за автоматически уменьшенного max_tokens, запрос повторяется
+    с max_tokens из профиля, чтобы не потерять корректный ответ.
+    Возвращает кортеж (content, error).
+    """
+    profile = get_stage_profile(stage)
+    model = model or profile["model"]
+    temperature = temperature if temperature is not None else profile["temperature"]
+    limit = max_tokens or effective_max_tokens(stage)
+
+    content, error, finish_reason = _post_chat(messages, model, limit, temperature, json_mode, stage)
+    if finish_reason == "length" and max_tokens is None and is_auto_sized(stage, limit):
+        metrics.inc("deepseek_truncation_retries_total", stage=stage)
+        logger.info("Повтор запроса этапа %s с max_tokens=%d из профиля.", stage, profile["max_tokens"])
+        content, error, finish_reason = _post_chat(messages, model, profile["max_tokens"], temperature, json_mode, stage)
+    return content, error
+
+def _retry_after_seconds(response: requests.Response, attempt: int) -> float:
+    """
+    Пауза перед повтором после 429: заголовок Retry-After или экспоненциальная задержка.
+    """
+    try:
+        return min(float(response.headers.get("Retry-After", "")), 30.0)
+    except ValueError:
+        return min(2 ** attempt, 30.0)
+
+def _parse_structured(content: str, schema: CompiledSchema) -> tuple[dict | None, list[str]]:
+    """
+    Декодирует JSON из ответа модели и проверяет его по скомпилированной схеме.
+    """
+    # На случай, если модель все же обернула ответ в markdown-блок кода
+    if content.startswith("```"):
+        content = content[3:]
+        if content.startswith("json"):
+            content = content[4:]
+        if content.endswith("```"):
+            content = content[:-3]
+        content = content.strip()
+
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        return None, [f"ответ не является корректным JSON ({e.msg})"]
+    return schema.validate(data)
+
+def deepseek_request(
+    prompt: str,
+    model: str = None,
+    max_tokens: int = None,
+    response_schema: CompiledSchema | dict = None,
+    stage: str = "unknown",
+    temperature: float = None
+) -> dict | str:
+    """
+    Отправляет запрос к Deepseek Chat API и возвращает сгенерированный текст или структурированный JSON.
+    Модель, max_tokens и температура по умолчанию берутся из профиля этапа (STAGE_PROFILES).
+
+    Если передана response_schema, используется нативный JSON-режим API, а ответ проверяется
+    заранее скомпилированной схемой (типы, enum, диапазоны). При невалидном ответе делается
+    ровно одна попытка исправления: модели возвращаются ее ответ и список ошибок.
+    Доли неудачного разбора по этапам пишутся в метрики deepseek_parse_*_total{stage}.
+    """
+    if not DEEPSEEK_API_KEY and not DEEPSEEK_ENDPOINTS:
+        return "Ошибка: Deepseek API ключ не установлен."
+
+    if response_schema is None:
+        content, error = _complete([{"role": "user", "content": prompt}], stage, model, max_tokens, temperature, json_mode=False)
+        return error if error else content # Если response_schema не предоставлена, возвращаем сырой текст
+
+    if isinstance(response_schema, dict):
+        response_schema = compile_schema(response_schema)
+
+    # В JSON-режиме Deepseek требует явного упоминания JSON в промпте
+    messages = [{
+        "role": "user",
+        "content": f"{prompt}\n\nВерни ответ строго в формате JSON-объекта с полями:\n{response_schema.description}"
+    }]
+    content, error = _complete(messages, stage, model, max_tokens, temperature, json_mode=True)
+    if error:
+        return error
 
+    metrics.inc("deepseek_parse_attempts_total", stage=stage)
+    parsed, validation_errors = _parse_structured(content, response_schema)
+    if parsed is not None:
+        return parsed
+
+    metrics.inc("deepseek_parse_failures_total", stage=stage)
+    logger.warning("Ответ Deepseek (этап %s) не прошел проверку схемы: %s. Ответ: %s...", stage, validation_errors, content[:100])
+
+    # Одна попытка исправления: показываем модели ее ответ и найденные ошибки
+    messages += [
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": (
+            "Ответ не прошел проверку: " + "; ".join(validation_errors) +
+            ".\nВерни исправленный ответ — только JSON-объект с полями:\n" + response_schema.description
+        )}
+    ]
+    repaired_content, error = _complete(messages, stage, model, max_tokens, temperature, json_mode=True)
+    if error:
+        return error
+
+    metrics.inc("deepseek_parse_attempts_total", stage=stage)
+    parsed, validation_errors = _parse_structured(repaired_content, response_schema)
+    if parsed is not None:
+        metrics.inc("deepseek_parse_repaired_total", stage=stage)
+        return parsed
+
+    metrics.inc("deepseek_parse_failures_total", stage=stage)
+    metrics.inc("deepseek_parse_giveups_total", stage=stage)
+    return f"Ошибка Deepseek API: ответ не соответствует ожидаемой схеме ({'; '.join(validation_errors)}). Получено: {repaired_content}"
+
+async def run_deepseek_request(**kwargs) -> dict | str:
+    """
+    Выполняет deepseek_request в пуле потоков Deepseek, не блокируя цикл событий.
+    Контекст (трасса, ключ сообщения, учет токенов) копируется в поток, как в asyncio.to_thread.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(context.run, deepseek_request, **kwargs))
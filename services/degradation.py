@@ -0,0 +1,217 @@
+# services/degradation.py
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager, suppress
+from config.settings import (
+    CONTEXT_THRESHOLD, DEGRADATION_LEVELS, DEGRADATION_CHECK_SECONDS, DEGRADATION_WINDOW_SECONDS,
+    DEGRADATION_RECOVERY_RATIO, DEGRADATION_RECOVERY_SECONDS, DEGRADATION_STAGE2_THRESHOLD_BOOST,
+    DEGRADATION_LOG_SAMPLE_RATE
+)
+from services import metrics
+from services.metrics import percentile
+from services.telegram_logger import send_service_message
+
+logger = logging.getLogger(__name__)
+
+# Режимы деградации при перегрузке.
+#
+# Когда сообщений приходит больше, чем успевают обрабатываться, очередь растет без ограничений:
+# каждое сообщение по-прежнему проходит все этапы и запрос рекомендаций. Фоновая задача раз
+# в DEGRADATION_CHECK_SECONDS сравнивает очередь (сообщения в обработке и в ожидании) и p95
+# времени обработки с порогами уровней DEGRADATION_LEVELS. Уровень повышается сразу, а снижается
+# на один, только когда нагрузка держится ниже порогов текущего уровня DEGRADATION_RECOVERY_SECONDS.
+# Смена уровня объявляется в чате логирования; текущий уровень — метрика degradation_level,
+# примененные упрощения — degraded_total{action}.
+
+# Действия деградации и их описания для сообщений в чат логирования
+ACTIONS = {
+    "skip_recommendations": "рекомендации к комментарию не запрашиваются",
+    "cheap_stage3": "третий этап только с оценками и с досрочным завершением",
+    "raise_stage2_bar": f"порог второго этапа повышен на {DEGRADATION_STAGE2_THRESHOLD_BOOST:g}",
+    "sample_logs": f"лог отклоненных сообщений отправляется для {DEGRADATION_LOG_SAMPLE_RATE:.0%}",
+}
+
+def parse_levels(entries: list) -> list[dict]:
+    """
+    Проверяет уровни из настройки DEGRADATION_LEVELS и дополняет каждый действиями предыдущих уровней.
+    """
+    levels, actions = [], []
+    for number, entry in enumerate(entries, start=1):
+        unknown = [action for action in entry.get("actions", []) if action not in ACTIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные действия уровня деградации {number}: {', '.join(unknown)}. Доступны: {', '.join(ACTIONS)}")
+        if entry.get("queue_depth") is None and entry.get("latency_p95") is None:
+            raise ValueError(f"У уровня деградации {number} не задан ни queue_depth, ни latency_p95.")
+        actions += [action for action in entry.get("actions", []) if action not in actions]
+        levels.append({"queue_depth": entry.get("queue_depth"), "latency_p95": entry.get("latency_p95"), "actions": list(actions)})
+    return levels
+
+_levels = parse_levels(DEGRADATION_LEVELS)
+_level = 0
+
+# Сообщения в обработке в этом процессе (см. track_message) и дополнительные источники очереди
+_inflight = 0
+_backlog_sources = []
+
+# Времена обработки за последние DEGRADATION_WINDOW_SECONDS: (время наблюдения, длительность)
+_latencies = deque()
+
+# С какого момента нагрузка ниже порогов текущего уровня (None — не ниже)
+_calm_since = None
+
+# Фоновая задача проверки нагрузки (ссылка хранится, чтобы задачу не удалил сборщик мусора)
+_task = None
+
+def level() -> int:
+    """
+    Текущий уровень деградации (0 — полный режим).
+    """
+    return _level
+
+def apply(action: str) -> bool:
+    """
+    Проверяет, действует ли упрощение action на текущем уровне, и учитывает его применение
+    в метрике degraded_total{action}.
+    """
+    if not _level or action not in _levels[_level - 1]["actions"]:
+        return False
+    metrics.inc("degraded_total", action=action)
+    return True
+
+def context_threshold() -> float:
+    """
+    Порог второго этапа с учетом действия raise_stage2_bar.
+    """
+    if apply("raise_stage2_bar"):
+        return CONTEXT_THRESHOLD + DEGRADATION_STAGE2_THRESHOLD_BOOST
+    return CONTEXT_THRESHOLD
+
+def should_send_log(forwarded: bool) -> bool:
+    """
+    Решает, отправлять ли лог сообщения в бот логирования. При действии sample_logs
+    лог отклоненного сообщения отправляется с вероятностью DEGRADATION_LOG_SAMPLE_RATE;
+    логи пересланных сообщений отправляются всегда.
+    """
+    if forwarded or random.random() < DEGRADATION_LOG_SAMPLE_RATE:
+        return True
+    return not apply("sample_logs")
+
+def add_backlog_source(source) -> None:
+    """
+    Добавляет функцию, возвращающую число ожидающих обработки сообщений (очередь обновлений
+    Telegram, планировщик, очередь задач воркеров). Функция вызывается в рабочем потоке.
+    """
+    _backlog_sources.append(source)
+
+def observe_latency(seconds: float) -> None:
+    """
+    Учитывает время обработки сообщения для сигнала latency_p95.
+    """
+    _latencies.append((time.monotonic(), seconds))
+
+@contextmanager
+def track_message():
+    """
+    Учитывает сообщение как обрабатываемое на время блока, а длительность блока — как время обработки.
+    """
+    global _inflight
+    _inflight += 1
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        _inflight -= 1
+        observe_latency(time.monotonic() - started_at)
+
+def _backlog() -> int:
+    return _inflight + sum(source() for source in _backlog_sources)
+
+def _latency_p95() -> float:
+    cutoff = time.monotonic() - DEGRADATION_WINDOW_SECONDS
+    while _latencies and _latencies[0][0] < cutoff:
+        _latencies.popleft()
+    return percentile(sorted(seconds for _, seconds in _latencies), 95)
+
+def _triggered(settings: dict, backlog: int, latency: float, ratio: float = 1.0) -> bool:
+    # Порог уровня достигнут хотя бы одним из заданных сигналов (ratio < 1 — с запасом для снижения)
+    return (
+        (settings["queue_depth"] is not None and backlog >= settings["queue_depth"] * ratio)
+        or (settings["latency_p95"] is not None and latency >= settings["latency_p95"] * ratio)
+    )
+
+def _target_level(backlog: int, latency: float) -> int:
+    return max((number for number, settings in enumerate(_levels, start=1) if _triggered(settings, backlog, latency)), default=0)
+
+async def _set_level(new_level: int, backlog: int, latency: float) -> None:
+    global _level
+    previous, _level = _level, new_level
+    metrics.set_gauge("degradation_level", new_level)
+    metrics.inc("degradation_changes_total", direction="up" if new_level > previous else "down")
+    signals = f"очередь {backlog}, p95 обработки {latency:.1f} с"
+    if new_level:
+        logger.warning("Уровень деградации %d -> %d (%s).", previous, new_level, signals)
+        actions = "\n".join(f"• {ACTIONS[action]}" for action in _levels[new_level - 1]["actions"])
+        text = f"Перегрузка (процесс {os.getpid()}): уровень деградации {previous} → {new_level}, {signals}.\n{actions}"
+    else:
+        logger.warning("Нагрузка снизилась, полный режим восстановлен (%s).", signals)
+        text = f"Нагрузка снизилась (процесс {os.getpid()}): полный режим восстановлен, {signals}."
+    await send_service_message(text)
+
+async def _check() -> None:
+    global _calm_since
+    backlog = await asyncio.to_thread(_backlog)
+    latency = _latency_p95()
+    metrics.set_gauge("degradation_backlog", backlog)
+    metrics.set_gauge("degradation_latency_p95_seconds", latency)
+
+    target = _target_level(backlog, latency)
+    if target > _level:
+        _calm_since = None
+        await _set_level(target, backlog, latency)
+        return
+    if not _level or _triggered(_levels[_level - 1], backlog, latency, DEGRADATION_RECOVERY_RATIO):
+        _calm_since = None
+        return
+    now = time.monotonic()
+    if _calm_since is None:
+        _calm_since = now
+    elif now - _calm_since >= DEGRADATION_RECOVERY_SECONDS:
+        # Следующий шаг вниз — снова после DEGRADATION_RECOVERY_SECONDS спокойной нагрузки
+        _calm_since = now
+        await _set_level(_level - 1, backlog, latency)
+
+async def _monitor() -> None:
+    while True:
+        await asyncio.sleep(DEGRADATION_CHECK_SECONDS)
+        try:
+            await _check()
+        except Exception as e:
+            logger.exception("Ошибка при проверке нагрузки: %s", e)
+
+def start_degradation_monitor() -> None:
+    """
+    Запускает фоновую проверку нагрузки, если заданы уровни DEGRADATION_LEVELS.
+    Повторный вызов ничего не делает.
+    """
+    global _task
+    if not _levels or _task is not None:
+        return
+    metrics.set_gauge("degradation_level", _level)
+    _task = asyncio.create_task(_monitor())
+    logger.info("Режимы деградации включены, уровней: %d.", len(_levels))
+
+async def stop_degradation_monitor() -> None:
+    """
+    Останавливает фоновую проверку нагрузки.
+    """
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    with suppress(asyncio.CancelledError):
+        await _task
+    _task = None
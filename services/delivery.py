@@ -0,0 +1,17 @@
+# services/delivery.py
+import logging
+from config.settings import PRIVATE_GROUP_CHAT_ID
+from services.database_service import increment_outgoing_messages
+from services.pipeline import build_forward_text
+
+logger = logging.getLogger(__name__)
+
+async def forward_to_private_group(bot, result: dict) -> None:
+    """
+    Пересылает прошедшее фильтрацию сообщение в приватную группу и инкрементирует
+    счетчик исходящих. Ошибки отправки пробрасываются вызывающему коду.
+    """
+    response_text = build_forward_text(result)
+    await bot.send_message(chat_id=PRIVATE_GROUP_CHAT_ID, text=response_text)
+    logger.info("Сообщение успешно отправлено в приватную группу %s (финальный фильтр: Да).", PRIVATE_GROUP_CHAT_ID)
+    increment_outgoing_messages()
@@ -0,0 +1,154 @@
+# services/endpoint_pool.py
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from services import metrics
+
+CHAT_COMPLETIONS_PATH = "/chat/completions"
+
+class PoolMember:
+    """
+    Участник пула: адрес OpenAI-совместимого chat/completions, ключ API, вес и,
+    при необходимости, своя модель (например, у локальной заглушки или другого провайдера).
+    """
+    def __init__(self, name: str, url: str, key: str | None, weight: float = 1.0, model: str | None = None):
+        self.name = name
+        self.url = url
+        self.weight = weight
+        self.model = model
+        self.headers = {"Content-Type": "application/json"}
+        if key:
+            self.headers["Authorization"] = f"Bearer {key}"
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ejections = 0 # исключений подряд (сбрасывается успешным ответом)
+        self.ejected_until = 0.0
+
+def parse_members(entries: list, default_url: str, default_key: str | None) -> list[PoolMember]:
+    """
+    Создает участников пула из настройки DEEPSEEK_ENDPOINTS (список словарей с полями
+    url, key, weight, model, name). Пустой список — один участник с адресом и ключом по умолчанию.
+    """
+    if not entries:
+        entries = [{"url": default_url}]
+    members, names = [], set()
+    for index, entry in enumerate(entries):
+        url = (entry.get("url") or default_url).rstrip("/")
+        # Базовый адрес OpenAI-совместимого API дополняется путем chat/completions
+        if not url.endswith(CHAT_COMPLETIONS_PATH):
+            url += CHAT_COMPLETIONS_PATH
+        name = entry.get("name") or urlparse(url).netloc
+        if name in names:
+            name = f"{name}#{index}"
+        names.add(name)
+        weight = float(entry.get("weight", 1.0))
+        if weight <= 0:
+            raise ValueError(f"Вес участника пула {name} должен быть положительным: {weight}")
+        members.append(PoolMember(name, url, entry.get("key", default_key), weight, entry.get("model")))
+    return members
+
+class EndpointPool:
+    """
+    Пул конечных точек API с маршрутизацией по взвешенному наименьшему числу запросов в работе.
+
+    - Запрос получает участник с наименьшим (запросов в работе + 1) / вес среди исправных;
+      при равенстве выбор случайный, чтобы нагрузка не собиралась на первом участнике.
+    - После eject_after_failures ошибок подряд (таймаут, ошибка соединения, 429, 5xx) участник
+      исключается из маршрутизации на eject_seconds, умноженные на число исключений подряд
+      (не больше max_eject_seconds). Успешный ответ сбрасывает счетчики ошибок и исключений.
+    - Если исключены все участники, запрос получает наименее загруженный из них: лучше
+      попробовать, чем отказать сразу.
+
+    Используется из рабочих потоков (deepseek_request выполняется в пуле потоков Deepseek).
+    Метрики по участникам: deepseek_endpoint_seconds{endpoint}, deepseek_endpoint_requests_total{endpoint,outcome},
+    deepseek_endpoint_ejections_total{endpoint}, deepseek_endpoint_inflight{endpoint}, deepseek_endpoint_ejected{endpoint}.
+    """
+    def __init__(
+        self,
+        members: list[PoolMember],
+        eject_after_failures: int = 3,
+        eject_seconds: float = 30.0,
+        max_eject_seconds: float = 300.0
+    ):
+        if not members:
+            raise ValueError("Пул конечных точек не может быть пустым.")
+        self.members = members
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._lock = threading.Lock()
+        for member in members:
+            metrics.set_gauge("deepseek_endpoint_inflight", 0, endpoint=member.name)
+            metrics.set_gauge("deepseek_endpoint_ejected", 0, endpoint=member.name)
+
+    def acquire(self, exclude: PoolMember | None = None) -> PoolMember:
+        """
+        Выбирает участника для запроса и учитывает запрос как выполняющийся.
+        exclude — участник, на котором не удалась предыдущая попытка (выбирается, только если других нет).
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [member for member in self.members if member.ejected_until <= now and member is not exclude]
+            if not candidates:
+                candidates = [member for member in self.members if member.ejected_until <= now] or self.members
+            member = min(candidates, key=lambda m: ((m.inflight + 1) / m.weight, random.random()))
+            member.inflight += 1
+            metrics.set_gauge("deepseek_endpoint_inflight", member.inflight, endpoint=member.name)
+            return member
+
+    def release(self, member: PoolMember, latency: float | None, ok: bool) -> None:
+        """
+        Завершает запрос участника. latency — длительность запроса (None, если ответ не получен),
+        ok — признак исправного ответа (не 429, не 5xx и не ошибка соединения).
+        """
+        now = time.monotonic()
+        with self._lock:
+            member.inflight -= 1
+            member.requests += 1
+            if ok:
+                member.consecutive_failures = 0
+                member.ejections = 0
+            else:
+                member.errors += 1
+                member.consecutive_failures += 1
+                if member.consecutive_failures >= self.eject_after_failures and member.ejected_until <= now:
+                    member.ejections += 1
+                    member.consecutive_failures = 0
+                    member.ejected_until = now + min(self.eject_seconds * member.ejections, self.max_eject_seconds)
+                    metrics.inc("deepseek_endpoint_ejections_total", endpoint=member.name)
+            metrics.set_gauge("deepseek_endpoint_inflight", member.inflight, endpoint=member.name)
+            metrics.set_gauge("deepseek_endpoint_ejected", int(member.ejected_until > now), endpoint=member.name)
+        metrics.inc("deepseek_endpoint_requests_total", endpoint=member.name, outcome="ok" if ok else "error")
+        if latency is not None:
+            metrics.observe("deepseek_endpoint_seconds", latency, endpoint=member.name)
+
+    def has_alternative(self, member: PoolMember) -> bool:
+        """
+        Проверяет, есть ли в пуле другой исправный участник для повтора запроса.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return any(other is not member and other.ejected_until <= now for other in self.members)
+
+    def stats(self) -> list[dict]:
+        """
+        Сводка по участникам: запросы, доля ошибок, перцентили задержки, текущее состояние.
+        """
+        now = time.monotonic()
+        with self._lock:
+            rows = [{
+                "name": member.name,
+                "url": member.url,
+                "weight": member.weight,
+                "inflight": member.inflight,
+                "requests": member.requests,
+                "errors": member.errors,
+                "error_rate": member.errors / member.requests if member.requests else 0.0,
+                "ejected_seconds": max(member.ejected_until - now, 0.0),
+            } for member in self.members]
+        for row in rows:
+            row.update(metrics.percentiles("deepseek_endpoint_seconds", (50, 95), endpoint=row["name"]))
+        return rows
@@ -0,0 +1,85 @@
+# services/export_service.py
+import csv
+import logging
+from datetime import datetime
+from services.database_service import get_table_columns, iter_table_rows
+
+logger = logging.getLogger(__name__)
+
+# Выгрузка истории из data/stats.db для офлайн-анализа.
+# Строки читаются пачками (fetchmany) и сразу дописываются в файл, поэтому память
+# не зависит от размера таблицы: в CSV пачка пишется построчно, в Parquet — отдельной row group.
+
+EXPORT_TABLES = ("message_logs", "pipeline_results")
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_CHUNK_SIZE = 5000
+
+# Типы Arrow для объявленных типов колонок SQLite (схема Parquet задается заранее,
+# чтобы не зависеть от значений первой пачки, например от колонки из одних NULL)
+_ARROW_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+def parse_export_date(value: str | None) -> str | None:
+    """
+    Проверяет границу периода (YYYY-MM-DD или дата и время в ISO 8601) и возвращает
+    ее в формате колонки timestamp. Неверный формат — ValueError.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Неверная дата: {value} (ожидается YYYY-MM-DD или дата и время в ISO 8601).") from None
+
+def export_table(
+    table: str,
+    output_path: str,
+    export_format: str = "csv",
+    since: str | None = None,
+    until: str | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> int:
+    """
+    Выгружает строки таблицы table за период [since, until) в файл output_path (CSV или Parquet).
+    Возвращает количество выгруженных строк.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}. Доступны: {', '.join(EXPORT_TABLES)}.")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {export_format}. Доступны: {', '.join(EXPORT_FORMATS)}.")
+
+    columns = get_table_columns(table)
+    chunks = iter_table_rows(table, parse_export_date(since), parse_export_date(until), chunk_size)
+    if export_format == "parquet":
+        exported = _write_parquet(output_path, columns, chunks)
+    else:
+        exported = _write_csv(output_path, columns, chunks)
+    logger.info("Выгружено строк из '%s': %d (%s).", table, exported, output_path)
+    return exported
+
+def _write_csv(output_path: str, columns: list, chunks) -> int:
+    exported = 0
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(name for name, _ in columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            exported += len(rows)
+    return exported
+
+def _write_parquet(output_path: str, columns: list, chunks) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Для выгрузки в Parquet установите пакет pyarrow (pip install pyarrow).") from e
+
+    schema = pa.schema([(name, _ARROW_TYPES.get(declared_type, "string")) for name, declared_type in columns])
+    exported = 0
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for rows in chunks:
+            arrays = [
+                pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            exported += len(rows)
+    return exported
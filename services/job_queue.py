@@ -0,0 +1,197 @@
+# services/job_queue.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config.settings import QUEUE_DATABASE_FILE, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# Долговременная очередь задач фильтрации в отдельной базе SQLite (режим WAL).
+# Производитель — handle_message (PIPELINE_MODE=queue), потребители — процессы worker_app.py.
+# Задача берется в работу с арендой (lease): если воркер упал или завис, по истечении
+# аренды задача снова становится доступной (семантика "хотя бы один раз").
+
+# База и таблицы создаются при первом обращении, поэтому в режиме inline файл очереди не появляется.
+# Соединение создается отдельно в каждом процессе (после fork/spawn соединение
+# родителя использовать нельзя), внутри процесса доступ сериализуется блокировкой.
+_connection = None
+_connection_pid = None
+_connection_lock = threading.Lock()
+
+def _get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение с базой очереди для текущего процесса (вызывать под _connection_lock).
+    """
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        os.makedirs(os.path.dirname(QUEUE_DATABASE_FILE), exist_ok=True)
+        # isolation_level=None: транзакциями управляем явно (BEGIN IMMEDIATE при захвате задачи)
+        _connection = sqlite3.connect(QUEUE_DATABASE_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _create_tables(_connection)
+        _connection_pid = os.getpid()
+    return _connection
+
+def close_queue():
+    """
+    Закрывает соединение с базой очереди текущего процесса.
+    """
+    global _connection, _connection_pid
+    with _connection_lock:
+        if _connection is not None and _connection_pid == os.getpid():
+            _connection.close()
+        _connection = None
+        _connection_pid = None
+
+def _create_tables(conn: sqlite3.Connection):
+    """
+    Создает таблицы очереди, если они не существуют.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_key TEXT NOT NULL UNIQUE, -- "chat_id:message_id", защищает от повторной постановки
+            payload TEXT NOT NULL, -- JSON с текстом и ссылкой
+            status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'leased', 'done' или 'failed'
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_until)')
+    # Отметки о пересылке в приватную группу: при повторной обработке задачи
+    # (после падения воркера) сообщение не будет переслано второй раз
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS forwards (
+            message_key TEXT PRIMARY KEY,
+            forwarded_at REAL NOT NULL
+        )
+    ''')
+
+def enqueue_job(message_key: str, payload: dict) -> bool:
+    """
+    Ставит сообщение в очередь. Возвращает False, если задача с таким ключом уже есть.
+    """
+    now = time.time()
+    with _connection_lock:
+        cursor = _get_connection().execute(
+            "INSERT OR IGNORE INTO jobs (message_key, payload, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (message_key, json.dumps(payload, ensure_ascii=False), now, now)
+        )
+        return cursor.rowcount == 1
+
+def claim_job(owner: str, lease_seconds: int = QUEUE_LEASE_SECONDS, max_attempts: int = QUEUE_MAX_ATTEMPTS) -> dict | None:
+    """
+    Захватывает самую старую доступную задачу: ожидающую или с истекшей арендой.
+    Возвращает словарь с полями id, message_key, payload, attempts или None, если очередь пуста.
+    Задачи с истекшей арендой, попытки которых исчерпаны (max_attempts), помечаются как failed:
+    попытка засчитывается при захвате, поэтому задача, из-за которой воркер падает, тоже
+    не будет выдаваться бесконечно.
+    """
+    now = time.time()
+    with _connection_lock:
+        conn = _get_connection()
+        # BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два процесса
+        # не могут захватить одну и ту же задачу
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            abandoned = conn.execute(
+                "SELECT id, message_key, attempts FROM jobs WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, max_attempts)
+            ).fetchall()
+            conn.execute(
+                '''UPDATE jobs SET status = 'failed', lease_owner = NULL, lease_until = NULL,
+                   last_error = 'Аренда истекла, попытки исчерпаны', updated_at = ?
+                   WHERE status = 'leased' AND lease_until < ? AND attempts >= ?''',
+                (now, now, max_attempts)
+            )
+            row = conn.execute(
+                '''SELECT id, message_key, payload, attempts FROM jobs
+                   WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?)
+                   ORDER BY id LIMIT 1''',
+                (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    '''UPDATE jobs SET status = 'leased', lease_owner = ?, lease_until = ?,
+                       attempts = attempts + 1, updated_at = ? WHERE id = ?''',
+                    (owner, now + lease_seconds, now, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    for job_id, message_key, attempts in abandoned:
+        logger.error("Задача %d (%s) не выполнена за %d попыток (аренда истекла), она помечена как failed.", job_id, message_key, attempts, extra={"message_key": message_key})
+    if row is None:
+        return None
+    return {"id": row[0], "message_key": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+def extend_lease(job_id: int, owner: str, lease_seconds: int = QUEUE_LEASE_SECONDS) -> bool:
+    """
+    Продлевает аренду задачи. Возвращает False, если задача уже принадлежит другому воркеру.
+    """
+    now = time.time()
+    with _connection_lock:
+        cursor = _get_connection().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+            (now + lease_seconds, now, job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+def complete_job(job_id: int, owner: str) -> None:
+    """
+    Помечает задачу выполненной.
+    """
+    with _connection_lock:
+        _get_connection().execute(
+            "UPDATE jobs SET status = 'done', lease_owner = NULL, lease_until = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (time.time(), job_id, owner)
+        )
+
+def fail_job(job_id: int, owner: str, error: str, max_attempts: int = QUEUE_MAX_ATTEMPTS) -> None:
+    """
+    Возвращает задачу в очередь после ошибки или, если попытки исчерпаны, помечает ее как failed.
+    """
+    with _connection_lock:
+        _get_connection().execute(
+            '''UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+               lease_owner = NULL, lease_until = NULL, last_error = ?, updated_at = ?
+               WHERE id = ? AND lease_owner = ?''',
+            (max_attempts, error, time.time(), job_id, owner)
+        )
+
+def is_forwarded(message_key: str) -> bool:
+    """
+    Проверяет, пересылалось ли уже сообщение в приватную группу.
+    """
+    with _connection_lock:
+        row = _get_connection().execute("SELECT 1 FROM forwards WHERE message_key = ?", (message_key,)).fetchone()
+        return row is not None
+
+def mark_forwarded(message_key: str) -> None:
+    """
+    Запоминает, что сообщение переслано в приватную группу.
+    """
+    with _connection_lock:
+        _get_connection().execute(
+            "INSERT OR IGNORE INTO forwards (message_key, forwarded_at) VALUES (?, ?)",
+            (message_key, time.time())
+        )
+
+def get_queue_depth() -> dict:
+    """
+    Возвращает количество задач по статусам (pending, leased, done, failed).
+    """
+    with _connection_lock:
+        rows = _get_connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    depth = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+    depth.update(dict(rows))
+    return depth
@@ -0,0 +1,171 @@
+# services/memory_watchdog.py
+import asyncio
+import html
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import suppress
+from config.settings import (
+    MEMORY_WATCHDOG_INTERVAL_SECONDS, MEMORY_ALERT_GROWTH_MB, MEMORY_TRACEMALLOC_FRAMES, MEMORY_TOP_N
+)
+from services import metrics
+from services.telegram_logger import send_service_message
+
+logger = logging.getLogger(__name__)
+
+# Наблюдение за памятью долгоживущего процесса бота.
+#
+# Фоновая задача раз в MEMORY_WATCHDOG_INTERVAL_SECONDS измеряет RSS процесса. Первое измерение
+# (после одного интервала, когда кэши уже прогреты) служит точкой отсчета; когда RSS вырастает
+# на MEMORY_ALERT_GROWTH_MB относительно нее или прошлого предупреждения, в чат логирования
+# отправляется отчет: крупнейшие места выделения памяти по tracemalloc и их изменение с
+# предыдущего снимка. Тот же отчет по запросу отдает команда /memory.
+#
+# tracemalloc видит только память, выделенную после его запуска, и замедляет выделение памяти,
+# поэтому глубина стека по умолчанию — один кадр (MEMORY_TRACEMALLOC_FRAMES).
+
+# Служебные выделения памяти, которые не относятся к коду бота
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# Предыдущий снимок tracemalloc (время, снимок): его обновляют и отчеты наблюдения, и /memory
+_previous_snapshot = None
+_snapshot_lock = threading.Lock()
+
+# RSS в начале наблюдения и при последнем предупреждении
+_baseline_rss = None
+_alert_rss = None
+
+# Фоновая задача наблюдения (ссылка хранится, чтобы задачу не удалил сборщик мусора)
+_task = None
+
+def current_rss() -> int | None:
+    """
+    Возвращает текущий RSS процесса в байтах. Вне Linux — пиковый RSS из getrusage,
+    на Windows — None.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss — в килобайтах на Linux и в байтах на macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _mb(size: int | None) -> str:
+    return "н/д" if size is None else f"{size / 1024 / 1024:.1f} МБ"
+
+def _size(size: int) -> str:
+    # Размер места выделения: мелкие места в килобайтах, чтобы не показывать «0.0 МБ»
+    return _mb(size) if size >= 1024 * 1024 else f"{size / 1024:.1f} КБ"
+
+def _location(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[0]
+    # Последних двух частей пути достаточно, чтобы различать модули и пакеты
+    path = "/".join(frame.filename.replace("\\", "/").split("/")[-2:])
+    return f"{path}:{frame.lineno}"
+
+def memory_report(limit: int = MEMORY_TOP_N) -> str:
+    """
+    Формирует текстовый отчет о памяти: RSS, объем памяти под наблюдением tracemalloc,
+    крупнейшие места выделения и их изменение с предыдущего снимка. Снимок tracemalloc
+    занимает заметное время, поэтому функцию следует вызывать через asyncio.to_thread.
+    """
+    global _previous_snapshot
+    rss = current_rss()
+    lines = [f"RSS: {_mb(rss)}" + (f" (в начале наблюдения: {_mb(_baseline_rss)})" if _baseline_rss else "")]
+    if not tracemalloc.is_tracing():
+        lines.append("tracemalloc не включен (MEMORY_TRACEMALLOC_FRAMES=0), места выделения памяти не отслеживаются.")
+        return "\n".join(lines)
+
+    traced, peak = tracemalloc.get_traced_memory()
+    lines.append(f"tracemalloc: {_mb(traced)}, пик {_mb(peak)}")
+    snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    with _snapshot_lock:
+        previous = _previous_snapshot
+        _previous_snapshot = (time.time(), snapshot)
+
+    lines += ["", "Крупнейшие места выделения памяти (объем, блоков):"]
+    for stat in snapshot.statistics("lineno")[:limit]:
+        lines.append(f"{_size(stat.size):>10} {stat.count:>8}  {_location(stat.traceback)}")
+    if previous is None:
+        lines += ["", "Предыдущего снимка нет, изменение будет в следующем отчете."]
+    else:
+        taken_at, previous_snapshot = previous
+        lines += ["", f"Изменение с предыдущего снимка ({(time.time() - taken_at) / 60:.0f} мин назад):"]
+        for stat in snapshot.compare_to(previous_snapshot, "lineno")[:limit]:
+            sign = "+" if stat.size_diff >= 0 else "-"
+            lines.append(f"{sign + _size(abs(stat.size_diff)):>10} {stat.count_diff:>+8}  {_location(stat.traceback)}")
+    return "\n".join(lines)
+
+async def _watch(interval: float) -> None:
+    global _baseline_rss, _alert_rss
+    while True:
+        await asyncio.sleep(interval)
+        rss = current_rss()
+        if rss is None:
+            continue
+        metrics.set_gauge("process_rss_bytes", rss)
+        if tracemalloc.is_tracing():
+            metrics.set_gauge("tracemalloc_traced_bytes", tracemalloc.get_traced_memory()[0])
+
+        if _baseline_rss is None:
+            # Точка отсчета: снимок для сравнения в первом отчете
+            _baseline_rss = _alert_rss = rss
+            try:
+                await asyncio.to_thread(memory_report)
+            except Exception as e:
+                logger.exception("Ошибка при формировании отчета о памяти: %s", e)
+            logger.info("Наблюдение за памятью: RSS в начале наблюдения %s.", _mb(rss))
+            continue
+
+        if rss - _alert_rss < MEMORY_ALERT_GROWTH_MB * 1024 * 1024:
+            continue
+        logger.warning("RSS процесса вырос до %s (в начале наблюдения %s).", _mb(rss), _mb(_baseline_rss))
+        metrics.inc("memory_alerts_total")
+        _alert_rss = rss
+        try:
+            report = await asyncio.to_thread(memory_report)
+        except Exception as e:
+            logger.exception("Ошибка при формировании отчета о памяти: %s", e)
+            continue
+        await send_service_message(
+            f"Рост памяти процесса {os.getpid()}: RSS {_mb(rss)}, в начале наблюдения {_mb(_baseline_rss)}.\n\n"
+            f"<pre>{html.escape(report)}</pre>"
+        )
+
+def start_memory_watchdog() -> None:
+    """
+    Включает tracemalloc и запускает фоновое наблюдение за памятью.
+    Повторный вызов (например, из post_init обоих ботов в supervisor_app.py) ничего не делает.
+    """
+    global _task
+    if MEMORY_TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACEMALLOC_FRAMES)
+        logger.info("tracemalloc включен (глубина стека: %d).", MEMORY_TRACEMALLOC_FRAMES)
+    if MEMORY_WATCHDOG_INTERVAL_SECONDS > 0 and _task is None:
+        _task = asyncio.create_task(_watch(MEMORY_WATCHDOG_INTERVAL_SECONDS))
+
+async def stop_memory_watchdog() -> None:
+    """
+    Останавливает фоновое наблюдение за памятью.
+    """
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    with suppress(asyncio.CancelledError):
+        await _task
+    _task = None
@@ -0,0 +1,122 @@
+# services/metrics.py
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Сколько последних наблюдений хранится для расчета перцентилей по каждой метрике
+HISTOGRAM_WINDOW = 10000
+
+# Метрики обновляются и из цикла событий, и из потоков с запросами к Deepseek
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = defaultdict(lambda: deque(maxlen=HISTOGRAM_WINDOW))
+_histogram_counts = defaultdict(int)
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+def format_key(key: tuple) -> str:
+    """
+    Превращает ключ метрики в строку вида name{label="value"}.
+    """
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    """
+    Увеличивает счетчик.
+    """
+    with _lock:
+        _counters[_key(name, labels)] += amount
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """
+    Устанавливает текущее значение показателя (например, текущий лимит параллелизма).
+    """
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def remove_gauge(name: str, **labels) -> None:
+    """
+    Удаляет показатель (например, глубину очереди чата, который больше не отслеживается).
+    """
+    with _lock:
+        _gauges.pop(_key(name, labels), None)
+
+def observe(name: str, value: float, **labels) -> None:
+    """
+    Добавляет наблюдение в гистограмму (длительность, размер и т.п.).
+    """
+    with _lock:
+        key = _key(name, labels)
+        _histograms[key].append(value)
+        _histogram_counts[key] += 1
+
+@contextmanager
+def timer(name: str, **labels):
+    """
+    Контекстный менеджер, записывающий длительность блока в секундах в гистограмму name.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started_at, **labels)
+
+def get_counter(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+def get_gauge(name: str, default: float = None, **labels) -> float:
+    with _lock:
+        return _gauges.get(_key(name, labels), default)
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    Перцентиль методом ближайшего ранга.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def percentiles(name: str, qs: tuple = (50, 95, 99), **labels) -> dict:
+    """
+    Возвращает перцентили последних HISTOGRAM_WINDOW наблюдений метрики.
+    """
+    with _lock:
+        values = list(_histograms.get(_key(name, labels), ()))
+    values.sort()
+    return {f"p{q}": percentile(values, q) for q in qs}
+
+def snapshot(qs: tuple = (50, 95, 99)) -> dict:
+    """
+    Возвращает копию всех метрик: счетчики, показатели и сводку по гистограммам.
+    """
+    with _lock:
+        counters = {format_key(key): value for key, value in _counters.items()}
+        gauges = {format_key(key): value for key, value in _gauges.items()}
+        histograms = {key: (list(values), _histogram_counts[key]) for key, values in _histograms.items()}
+
+    summary = {}
+    for key, (values, count) in histograms.items():
+        values.sort()
+        entry = {"count": count}
+        entry.update({f"p{q}": percentile(values, q) for q in qs})
+        summary[format_key(key)] = entry
+    return {"counters": counters, "gauges": gauges, "histograms": summary}
+
+def reset() -> None:
+    """
+    Сбрасывает все метрики (используется в бенчмарках между прогонами).
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _histogram_counts.clear()
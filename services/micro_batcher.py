@@ -0,0 +1,66 @@
+# services/micro_batcher.py
+import asyncio
+from services import metrics
+
+class MicroBatcher:
+    """
+    Оппортунистическое объединение однотипных запросов в пакеты.
+
+    Если в момент вызова submit других запросов нет (ни в работе, ни в ожидании), элемент
+    сразу обрабатывается отдельно — при низкой нагрузке задержка не увеличивается.
+    Если же предыдущие запросы еще выполняются, элементы копятся до max_items штук
+    или max_wait секунд и передаются в run_batch одним списком.
+
+    run_batch(items) — корутина, возвращающая список результатов той же длины и в том же
+    порядке, что и items. Исключение run_batch передается всем элементам пакета.
+    Размеры пакетов пишутся в метрику {name}_batch_size.
+    """
+    def __init__(self, name: str, run_batch, max_items: int, max_wait: float):
+        self.name = name
+        self._run_batch = run_batch
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._pending = []
+        self._flush_handle = None
+        self._inflight = 0
+        self._tasks = set()
+        # Пакетировщик привязан к циклу событий, в котором создан
+        self.loop = asyncio.get_running_loop()
+
+    async def submit(self, item):
+        future = self.loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_items or (self._inflight == 0 and len(self._pending) == 1):
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending[:self.max_items], self._pending[self.max_items:]
+        if self._pending:
+            self._flush_handle = self.loop.call_later(self.max_wait, self._flush)
+        self._inflight += 1
+        task = asyncio.create_task(self._execute(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, batch: list) -> None:
+        metrics.observe(f"{self.name}_batch_size", len(batch))
+        try:
+            results = await self._run_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._inflight -= 1
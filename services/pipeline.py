@@ -0,0 +1,225 @@
+# services/pipeline.py
+import asyncio
+import contextlib
+import logging
+from config.settings import MAX_POTENTIAL, SUM_POTENTIAL, STAGE3_EARLY_EXIT, STAGE3_LAZY_EXPLAIN
+from services import degradation, metrics
+from services.checkpoint_store import current_message_key
+from services.deepseek_processor import (
+    perform_initial_filtration,
+    perform_context_filtration,
+    evaluate_characteristics,
+    explain_characteristic,
+    generate_commentary_recommendations
+)
+
+logger = logging.getLogger(__name__)
+
+# Текст вместо рекомендаций, когда они не запрашиваются из-за перегрузки (services/degradation.py)
+RECOMMENDATIONS_SKIPPED = "Рекомендации не запрашивались: бот перегружен."
+
+# Поля результата, которые принимает send_log_message
+LOG_FIELDS = (
+    "main_message", "message_link",
+    "filter_value_1", "explain_value_1",
+    "filter_value_2", "total_score_context", "explain_value_2",
+    "final_filter_value", "total_potential_score",
+    "emotion_score", "emotion_explain",
+    "image_score", "image_explain",
+    "heroes_score", "heroes_explain",
+    "actual_score", "actual_explain",
+    "drama_score", "drama_explain",
+    "is_filtered_by_stage_2",
+)
+
+def new_pipeline_result(main_message: str, message_link: str) -> dict:
+    """
+    Создает словарь результата с дефолтными значениями для этапов, которые еще не проводились.
+    """
+    return {
+        "main_message": main_message,
+        "message_link": message_link,
+        "filter_value_1": "Не проводился",
+        "explain_value_1": "Не проводился",
+        "filter_value_2": "Не проводился",
+        "total_score_context": 0,
+        "explain_value_2": "Не проводился",
+        "is_filtered_by_stage_2": False, # Флаг, что 3-й этап не проводился
+        "context_scores": {}, # Оценки по критериям второго этапа
+        "final_filter_value": "Нет",
+        "total_potential_score": 0,
+        "emotion_score": 0,
+        "emotion_explain": "Не проводился",
+        "image_score": 0,
+        "image_explain": "Не проводился",
+        "heroes_score": 0,
+        "heroes_explain": "Не проводился",
+        "actual_score": 0,
+        "actual_explain": "Не проводился",
+        "drama_score": 0,
+        "drama_explain": "Не проводился",
+        "stage3_skipped_calls": 0,
+        "commentary_recommendations": "Рекомендации пока отсутствуют.",
+    }
+
+def get_log_fields(result: dict) -> dict:
+    """
+    Возвращает из результата только те поля, которые нужны для send_log_message.
+    """
+    return {field: result[field] for field in LOG_FIELDS}
+
+def build_forward_text(result: dict) -> str:
+    """
+    Формирует текст сообщения для пересылки в приватную группу.
+    """
+    return (
+        f"{result['main_message']}\n\n"
+        f"1111\n\n"
+        f"{result['message_link']}\n\n"
+        f"1111\n\n"
+        f"Общий потенциал: {result['total_potential_score']}\n"
+        f"1. Эмоции: {result['emotion_score']}\n"
+        f"2. Образность: {result['image_score']}\n"
+        f"3. Герои: {result['heroes_score']}\n"
+        f"4. Актуальность: {result['actual_score']}\n"
+        f"5. Драма: {result['drama_score']}\n\n"
+        f"1111\n\n"
+        f"Рекомендации: {result['commentary_recommendations']}"
+    )
+
+@contextlib.contextmanager
+def _message_context(message_key: str | None):
+    """
+    Делает message_key текущим ключом контрольных точек на время выполнения этапов.
+    """
+    token = current_message_key.set(message_key)
+    try:
+        yield
+    finally:
+        current_message_key.reset(token)
+
+async def run_pipeline(main_message: str, message_link: str, message_key: str | None = None) -> dict:
+    """
+    Проводит новость через все этапы фильтрации Deepseek и принимает финальное решение.
+    Не выполняет никаких побочных действий (пересылка, логирование, статистика) —
+    только возвращает словарь с результатами всех этапов.
+    Если передан message_key, ответ каждого этапа сохраняется как контрольная точка, а уже
+    сохраненные этапы при повторном прогоне того же сообщения не запрашиваются заново.
+    Общая длительность записывается в метрику pipeline_seconds.
+    """
+    with _message_context(message_key), metrics.timer("pipeline_seconds"), degradation.track_message():
+        result = new_pipeline_result(main_message, message_link)
+        if await _run_initial_stage(result):
+            await _run_remaining_stages(result)
+        return result
+
+async def run_initial_stage(main_message: str, message_link: str, message_key: str | None = None) -> dict:
+    """
+    Выполняет только первый этап фильтрации и возвращает словарь результата.
+    Если первый этап пройден (passed_initial_stage), обработку продолжает run_remaining_stages.
+    Используется планировщиком, который выполняет этапы сообщения в два приема.
+    """
+    with _message_context(message_key):
+        result = new_pipeline_result(main_message, message_link)
+        await _run_initial_stage(result)
+        return result
+
+async def run_remaining_stages(result: dict, message_key: str | None = None) -> dict:
+    """
+    Выполняет второй и третий этапы и финальное решение для результата run_initial_stage.
+    """
+    with _message_context(message_key):
+        await _run_remaining_stages(result)
+        return result
+
+def passed_initial_stage(result: dict) -> bool:
+    """
+    Проверяет, нужно ли продолжать обработку после первого этапа.
+    """
+    return result["filter_value_1"] != "Нет"
+
+async def _fetch_explanations(result: dict) -> None:
+    """
+    Запрашивает объяснения оценок (режим STAGE3_LAZY_EXPLAIN) только для характеристик,
+    которые попадут в промпт рекомендаций, — с оценкой не ниже MAX_POTENTIAL.
+    """
+    keys = [
+        key for key in ("emotion", "image", "heroes", "actual", "drama")
+        if isinstance(result[f"{key}_score"], int) and result[f"{key}_score"] >= MAX_POTENTIAL
+    ]
+    explains = await asyncio.gather(*(
+        explain_characteristic(result["main_message"], key, result[f"{key}_score"]) for key in keys
+    ))
+    for key, explain in zip(keys, explains):
+        result[f"{key}_explain"] = explain
+
+async def _run_initial_stage(result: dict) -> bool:
+    # --- Первый этап фильтрации ---
+    result["filter_value_1"], result["explain_value_1"] = await perform_initial_filtration(result["main_message"], result["message_link"])
+
+    # Если первый фильтр вернул "Нет", прекращаем дальнейшую обработку
+    if not passed_initial_stage(result):
+        logger.info("Сообщение НЕ прошло первичную фильтрацию.")
+        logger.debug("Причина: %s", result["explain_value_1"])
+        return False
+    return True
+
+async def _run_remaining_stages(result: dict) -> None:
+    main_message = result["main_message"]
+
+    # --- Второй этап фильтрации (Context Filtration) ---
+    (
+        result["filter_value_2"],
+        result["total_score_context"],
+        result["explain_value_2"],
+        result["is_filtered_by_stage_2"],
+        result["context_scores"]
+    ) = await perform_context_filtration(main_message, degradation.context_threshold())
+
+    # Если второй фильтр вернул "Нет", прекращаем дальнейшую обработку
+    if result["filter_value_2"] == "Нет":
+        logger.info("Сообщение НЕ прошло контекстную фильтрацию.")
+        logger.debug("Причина: %s", result["explain_value_2"])
+        return
+
+    # --- Третий этап: Оценка эмоциональных и стилистических характеристик ---
+    logger.debug("Начало третьего этапа фильтрации (оценка характеристик)...")
+    # При перегрузке — упрощенный третий этап: только оценки и досрочное завершение
+    cheap_stage3 = degradation.apply("cheap_stage3")
+    lazy_explain = STAGE3_LAZY_EXPLAIN or cheap_stage3
+    (
+        result["emotion_score"], result["emotion_explain"],
+        result["image_score"], result["image_explain"],
+        result["heroes_score"], result["heroes_explain"],
+        result["actual_score"], result["actual_explain"],
+        result["drama_score"], result["drama_explain"],
+        result["total_potential_score"], potential_scores_list
+    ) = await evaluate_characteristics(
+        main_message, lazy_explain=lazy_explain, early_exit=STAGE3_EARLY_EXIT or cheap_stage3
+    )
+    # Оценки, пропущенные при досрочном завершении третьего этапа (сохраняются в pipeline_results)
+    result["stage3_skipped_calls"] = sum(1 for score in potential_scores_list if score is None)
+
+    has_max_potential = any(score >= MAX_POTENTIAL for score in potential_scores_list if isinstance(score, int))
+    if result["total_potential_score"] >= SUM_POTENTIAL and has_max_potential:
+        result["final_filter_value"] = "Да"
+        if degradation.apply("skip_recommendations"):
+            result["commentary_recommendations"] = RECOMMENDATIONS_SKIPPED
+        else:
+            if lazy_explain:
+                await _fetch_explanations(result)
+            result["commentary_recommendations"] = await generate_commentary_recommendations(
+                main_message,
+                result["emotion_score"], result["emotion_explain"], # Передаем все оценки и объяснения
+                result["image_score"], result["image_explain"],
+                result["heroes_score"], result["heroes_explain"],
+                result["actual_score"], result["actual_explain"],
+                result["drama_score"], result["drama_explain"]
+            )
+    else:
+        result["final_filter_value"] = "Нет"
+
+    logger.info(
+        "Финальная фильтрация: Сумма потенциальных баллов=%s, Есть MAX_POTENTIAL=%s, Результат='%s'",
+        result["total_potential_score"], has_max_potential, result["final_filter_value"]
+    )
@@ -0,0 +1,136 @@
+# services/profiler.py
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Семплирующий профилировщик для работающего процесса (команда /profile бота логирования).
+#
+# Отдельный поток раз в интервал снимает стеки всех потоков процесса через sys._current_frames()
+# и считает одинаковые стеки. Профилируемый код не инструментируется, поэтому накладные расходы
+# определяются только частотой снимков. Стеки выдаются в «свернутом» формате
+# (поток;функция;...;функция количество), который принимают flamegraph.pl, speedscope и inferno.
+#
+# Простаивающие потоки (цикл событий в select, свободные потоки пула to_thread, ожидание
+# событий и очередей) в стеки не попадают, а только учитываются в счетчике idle: иначе
+# они занимали бы большую часть профиля.
+
+# (функция, файл) верхнего кадра, по которым поток считается простаивающим
+IDLE_FRAMES = {
+    ("select", "selectors.py"),
+    ("_write_to_self", "selector_events.py"), # пробуждение цикла событий из потока to_thread
+    ("_worker", "thread.py"),
+    ("wait", "threading.py"),
+    ("_wait_for_tstate_lock", "threading.py"),
+    ("get", "queue.py"),
+}
+
+class ProfileResult:
+    """
+    Результат профилирования: количество снимков, счетчик свернутых стеков активных
+    потоков и число пропущенных стеков простаивающих потоков.
+    """
+    def __init__(self, stacks: Counter, samples: int, idle: int, duration: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.idle = idle
+        self.duration = duration
+
+    @property
+    def active(self) -> int:
+        """
+        Количество стеков активных потоков (сумма по всем снимкам).
+        """
+        return sum(self.stacks.values())
+
+    def collapsed(self) -> str:
+        """
+        Стеки в свернутом формате для построения flame graph.
+        """
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int) -> list[tuple[str, int, int]]:
+        """
+        Функции с наибольшим собственным временем: (функция, собственные снимки, снимки со вложенными).
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack[1:] # первый элемент — имя потока
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+class SamplingProfiler:
+    """
+    Снимает стеки потоков процесса в фоновом потоке, пока не вызван stop().
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stacks = Counter()
+        self._samples = 0
+        self._idle = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._started_at = None
+
+    def start(self) -> None:
+        self._started_at = time.monotonic()
+        self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        self._stop_event.set()
+        self._thread.join()
+        return ProfileResult(self._stacks, self._samples, self._idle, time.monotonic() - self._started_at)
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        labels = {} # кэш подписей по объектам кода
+        while not self._stop_event.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)) in IDLE_FRAMES:
+                    self._idle += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)).replace(";", ","))
+                self._stacks[tuple(reversed(stack))] += 1
+            self._samples += 1
+
+def _frame_label(code) -> str:
+    # Функции группируются по первой строке определения; ";" зарезервирован форматом стеков
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+_running_lock = asyncio.Lock()
+
+def is_running() -> bool:
+    """
+    Проверяет, выполняется ли уже профилирование (одновременно допускается одно).
+    """
+    return _running_lock.locked()
+
+async def profile_for(seconds: float, interval: float) -> ProfileResult:
+    """
+    Профилирует процесс в течение seconds секунд, не блокируя цикл событий.
+    """
+    async with _running_lock:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            result = await asyncio.to_thread(profiler.stop)
+        return result
@@ -0,0 +1,294 @@
+# services/scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Планировщик сообщений для режима PIPELINE_MODE=scheduled.
+#
+# Обработчик сообщения только ставит новость в планировщик, а обработку выполняют
+# concurrency фоновых задач. Порядок выбора следующей работы:
+#   1. сообщения, уже прошедшие первый этап (продолжение начатой работы);
+#   2. устаревшие сообщения (старше stale_after секунд) — при политике "fast_track",
+#      чтобы они не ждали бесконечно за свежими; при политике "drop" они отбрасываются;
+#   3. новые сообщения — чат выбирается взвешенной справедливой очередью (см. ниже),
+#      внутри чата сначала самые свежие по дате сообщения Telegram.
+#
+# Справедливость между чатами: у каждого чата есть счетчик полученного обслуживания
+# (виртуальное время), который растет на 1/weight при каждом взятом сообщении. Следующим
+# обслуживается чат с наименьшим счетчиком, поэтому пачка пересланных из одного чата
+# новостей не задерживает остальные чаты: они получают долю обработки по своим весам.
+# Чат, который простаивал, при появлении сообщений начинает с текущего виртуального
+# времени и не может "накопить" приоритет. У чата также может быть лимит сообщений
+# в обработке одновременно (max_inflight); чаты, достигшие лимита, пропускаются.
+#
+# Метрики по чатам: глубина очереди публикуется только для чатов с ожидающими сообщениями
+# (у опустевшего чата показатель удаляется), а гистограммы ожидания и задержки
+# ведутся отдельно только для чатов из chat_policies, остальные чаты сводятся в chat="other",
+# чтобы число рядов метрик не росло с числом чатов.
+
+STALE_POLICIES = ("drop", "fast_track")
+
+class ScheduledItem:
+    """
+    Сообщение в планировщике. chat_id — чат-источник (ключ справедливой очереди),
+    payload — произвольные данные обработчика (бот, апдейт и т.п.),
+    result — результат после первого этапа (None, пока первый этап не выполнен).
+    """
+    __slots__ = ("message_key", "message_date", "chat_id", "payload", "submitted_at", "enqueued_at", "result", "taken")
+
+    def __init__(self, message_key: str, message_date: float, payload=None, chat_id=None):
+        self.message_key = message_key
+        self.message_date = message_date
+        self.chat_id = chat_id
+        self.payload = payload
+        self.submitted_at = self.enqueued_at = time.monotonic()
+        self.result = None
+        self.taken = False
+
+    def age(self) -> float:
+        """Возраст новости в секундах по дате сообщения."""
+        return time.time() - self.message_date
+
+class _ChatQueue:
+    """
+    Новые сообщения одного чата (по убыванию даты) и его доля в справедливой очереди.
+    """
+    __slots__ = ("chat_id", "weight", "max_inflight", "newest_first", "pending", "inflight", "served")
+
+    def __init__(self, chat_id, weight: float, max_inflight: int):
+        self.chat_id = chat_id
+        self.weight = weight
+        self.max_inflight = max_inflight
+        self.newest_first = []
+        self.pending = 0
+        self.inflight = 0
+        self.served = 0.0
+
+    def can_start(self) -> bool:
+        return self.pending > 0 and (not self.max_inflight or self.inflight < self.max_inflight)
+
+class FreshnessScheduler:
+    """
+    process(item) — корутина, выполняющая очередную фазу обработки. Если она возвращает True,
+    сообщение прошло первый этап и возвращается в планировщик с приоритетом продолжения.
+    on_drop(item) — корутина, вызываемая для отброшенных устаревших сообщений.
+    chat_policies — {chat_id: {"weight": ..., "max_inflight": ...}} для отдельных чатов;
+    остальные чаты получают default_weight и default_max_inflight (0 — без лимита).
+    """
+    def __init__(
+        self,
+        process,
+        on_drop,
+        concurrency: int,
+        stale_after: float,
+        stale_policy: str,
+        chat_policies: dict | None = None,
+        default_weight: float = 1.0,
+        default_max_inflight: int = 0
+    ):
+        if stale_policy not in STALE_POLICIES:
+            raise ValueError(f"Неизвестная политика для устаревших сообщений: {stale_policy}")
+        self._process = process
+        self._on_drop = on_drop
+        self._concurrency = concurrency
+        self._stale_after = stale_after
+        self._stale_policy = stale_policy
+        self._chat_policies = {str(chat_id): policy for chat_id, policy in (chat_policies or {}).items()}
+        self._default_weight = default_weight
+        self._default_max_inflight = default_max_inflight
+        self._sequence = itertools.count()
+        # Продолжения — в порядке завершения первого этапа
+        self._in_progress = []
+        # Новые сообщения лежат в кучах своих чатов (по убыванию даты) и в общей куче по
+        # возрастанию даты (проверка самого старого на устаревание). Взятое из одной кучи
+        # сообщение помечается taken и лениво удаляется из другой.
+        self._chats = {}
+        self._oldest_first = []
+        self._intake_count = 0
+        # Сообщения, взятые в обработку и еще не завершенные (в том числе ожидающие продолжения)
+        self._active_count = 0
+        self._virtual_time = 0.0
+        self._available = asyncio.Condition()
+        self._workers = []
+
+    def start(self) -> None:
+        """
+        Запускает фоновые задачи обработки (вызывается из работающего цикла событий).
+        """
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self._concurrency)]
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновые задачи. Необработанные сообщения остаются незавершенными
+        в хранилище контрольных точек и будут дообработаны после перезапуска.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def depth(self) -> int:
+        """
+        Число незавершенных сообщений: ожидающих в планировщике и взятых в обработку.
+        """
+        return self._intake_count + self._active_count
+
+    def _metric_chat(self, chat_id) -> str:
+        chat_id = str(chat_id)
+        return chat_id if chat_id in self._chat_policies else "other"
+
+    def _chat(self, chat_id) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            policy = self._chat_policies.get(str(chat_id), {})
+            chat = _ChatQueue(
+                chat_id,
+                weight=float(policy.get("weight", self._default_weight)),
+                max_inflight=int(policy.get("max_inflight", self._default_max_inflight))
+            )
+            self._chats[chat_id] = chat
+        return chat
+
+    async def submit(self, item: ScheduledItem) -> None:
+        """
+        Ставит новое сообщение в планировщик.
+        """
+        async with self._available:
+            chat = self._chat(item.chat_id)
+            if chat.pending == 0:
+                # Простаивавший чат не получает преимущества за время простоя
+                chat.served = max(chat.served, self._virtual_time)
+            sequence = next(self._sequence)
+            heapq.heappush(chat.newest_first, (-item.message_date, sequence, item))
+            heapq.heappush(self._oldest_first, (item.message_date, sequence, item))
+            chat.pending += 1
+            self._intake_count += 1
+            self._update_depth(chat)
+            self._available.notify()
+
+    async def _resubmit(self, item: ScheduledItem) -> None:
+        async with self._available:
+            item.enqueued_at = time.monotonic()
+            heapq.heappush(self._in_progress, (next(self._sequence), item))
+            self._update_depth()
+            self._available.notify()
+
+    async def _finish(self, item: ScheduledItem) -> None:
+        async with self._available:
+            chat = self._chats[item.chat_id]
+            chat.inflight -= 1
+            self._active_count -= 1
+            metrics.observe("scheduler_chat_latency_seconds", time.monotonic() - item.submitted_at, chat=self._metric_chat(item.chat_id))
+            self._forget_idle(chat)
+            # Освободился слот чата с лимитом — его сообщения снова можно брать
+            self._available.notify()
+
+    def _forget_idle(self, chat: _ChatQueue) -> None:
+        # Чат без сообщений и без опережения виртуального времени ничем не отличается от нового
+        if chat.pending == 0 and chat.inflight == 0 and chat.served <= self._virtual_time:
+            del self._chats[chat.chat_id]
+
+    def _update_depth(self, chat: _ChatQueue | None = None) -> None:
+        metrics.set_gauge("scheduler_queue_depth", len(self._in_progress), phase="in_progress")
+        metrics.set_gauge("scheduler_queue_depth", self._intake_count, phase="intake")
+        if chat is not None and chat.pending:
+            metrics.set_gauge("scheduler_chat_queue_depth", chat.pending, chat=str(chat.chat_id))
+        elif chat is not None:
+            metrics.remove_gauge("scheduler_chat_queue_depth", chat=str(chat.chat_id))
+
+    def _pop_intake(self, heap: list) -> ScheduledItem | None:
+        while heap:
+            item = heapq.heappop(heap)[-1]
+            if not item.taken:
+                item.taken = True
+                chat = self._chats[item.chat_id]
+                chat.pending -= 1
+                self._intake_count -= 1
+                self._update_depth(chat)
+                return item
+        return None
+
+    def _pop_fair(self) -> ScheduledItem | None:
+        """
+        Берет самое свежее сообщение чата с наименьшим полученным обслуживанием
+        среди чатов, не достигших лимита сообщений в обработке.
+        """
+        chat = min(
+            (chat for chat in self._chats.values() if chat.can_start()),
+            key=lambda chat: chat.served,
+            default=None
+        )
+        if chat is None:
+            return None
+        self._virtual_time = chat.served
+        chat.served += 1 / chat.weight
+        return self._pop_intake(chat.newest_first)
+
+    def _peek_oldest(self) -> ScheduledItem | None:
+        while self._oldest_first and self._oldest_first[0][-1].taken:
+            heapq.heappop(self._oldest_first)
+        return self._oldest_first[0][-1] if self._oldest_first else None
+
+    def _select(self) -> tuple[ScheduledItem | None, list[ScheduledItem]]:
+        """
+        Выбирает следующее сообщение. Возвращает (сообщение, отброшенные устаревшие сообщения).
+        """
+        dropped = []
+        if self._in_progress:
+            return heapq.heappop(self._in_progress)[-1], dropped
+
+        oldest = self._peek_oldest()
+        while oldest is not None and oldest.age() > self._stale_after:
+            item = self._pop_intake(self._oldest_first)
+            if self._stale_policy == "fast_track":
+                # Устаревшее сообщение обрабатывается вне очереди, в том числе сверх лимита чата
+                metrics.inc("scheduler_fast_tracked_total")
+                self._chats[item.chat_id].inflight += 1
+                self._active_count += 1
+                return item, dropped
+            dropped.append(item)
+            self._forget_idle(self._chats[item.chat_id])
+            oldest = self._peek_oldest()
+
+        item = self._pop_fair()
+        if item is not None:
+            self._chats[item.chat_id].inflight += 1
+            self._active_count += 1
+        return item, dropped
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._available:
+                item, dropped = self._select()
+                while item is None and not dropped:
+                    await self._available.wait()
+                    item, dropped = self._select()
+                self._update_depth()
+
+            for stale_item in dropped:
+                metrics.inc("scheduler_dropped_total")
+                try:
+                    await self._on_drop(stale_item)
+                except Exception as e:
+                    logger.exception("Ошибка при отбрасывании устаревшего сообщения %s: %s", stale_item.message_key, e)
+            if item is None:
+                continue
+
+            phase = "in_progress" if item.result is not None else "intake"
+            wait = time.monotonic() - item.enqueued_at
+            metrics.observe("scheduler_wait_seconds", wait, phase=phase)
+            if phase == "intake":
+                metrics.observe("scheduler_chat_wait_seconds", wait, chat=self._metric_chat(item.chat_id))
+            try:
+                if await self._process(item):
+                    await self._resubmit(item)
+                    continue
+            except Exception as e:
+                logger.exception("Ошибка при обработке сообщения %s в планировщике: %s", item.message_key, e)
+            await self._finish(item)
@@ -0,0 +1,90 @@
+# services/side_effects.py
+import asyncio
+import logging
+import time
+from config.settings import SIDE_EFFECT_CONCURRENCY, SIDE_EFFECT_DRAIN_SECONDS
+from services import metrics
+from services.tracing import detach_trace, trace_message
+
+logger = logging.getLogger(__name__)
+
+# Побочные действия после решения по сообщению: сохранение результата, пересылка в приватную
+# группу, лог в бот логирования. Они выполняются фоновыми задачами, поэтому обработчик
+# освобождается сразу после решения и не ждет запросов к Telegram и записи в базу.
+#
+# Одновременно выполняется не больше SIDE_EFFECT_CONCURRENCY действий. Ошибки пишутся в журнал
+# и в метрику side_effect_failures_total{effect}. При остановке бота drain() дожидается
+# незавершенных задач, пока Bot еще может отправлять сообщения.
+
+_semaphore = asyncio.Semaphore(SIDE_EFFECT_CONCURRENCY)
+
+# Незавершенные фоновые задачи (ссылки хранятся, чтобы задачи не удалил сборщик мусора)
+_tasks = set()
+
+async def run_effect(effect: str, coro, message_key: str | None = None) -> Exception | None:
+    """
+    Выполняет одно побочное действие с ограничением параллелизма.
+    Ошибка не пробрасывается, а журналируется и возвращается (None — действие выполнено).
+    """
+    async with _semaphore:
+        started_at = time.monotonic()
+        try:
+            await coro
+        except Exception as e:
+            metrics.inc("side_effect_failures_total", effect=effect)
+            logger.error("Ошибка фонового действия %s: %s", effect, e, extra={"message_key": message_key})
+            return e
+        finally:
+            metrics.observe("side_effect_seconds", time.monotonic() - started_at, effect=effect)
+    return None
+
+async def _run_task(name: str, coro, message_key: str | None) -> None:
+    # Трасса обработчика к этому времени может быть уже записана, поэтому задача пишет свою трассу.
+    # Идентификатор трассы выводится из ключа сообщения, и обе части попадают в одну трассу.
+    detach_trace()
+    with trace_message(message_key, name):
+        try:
+            await coro
+        except Exception as e:
+            metrics.inc("side_effect_failures_total", effect=name)
+            logger.exception("Ошибка фоновой задачи %s: %s", name, e, extra={"message_key": message_key})
+
+def _task_done(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    metrics.set_gauge("side_effects_pending", len(_tasks))
+
+def submit(name: str, coro, message_key: str | None = None) -> asyncio.Task:
+    """
+    Запускает coro фоновой задачей, которую отслеживает drain(). Исключение задачи
+    журналируется и не теряется молча.
+    """
+    task = asyncio.create_task(_run_task(name, coro, message_key))
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    metrics.set_gauge("side_effects_pending", len(_tasks))
+    return task
+
+def pending() -> int:
+    """
+    Возвращает число незавершенных фоновых задач.
+    """
+    return len(_tasks)
+
+async def drain(timeout: float = SIDE_EFFECT_DRAIN_SECONDS) -> None:
+    """
+    Дожидается завершения фоновых задач (вызывается при остановке бота). Задачи, не
+    завершившиеся за timeout секунд, отменяются: их сообщения остаются незавершенными
+    в хранилище контрольных точек и будут дообработаны после перезапуска.
+    """
+    if not _tasks:
+        return
+    logger.info("Ожидание завершения фоновых действий: %d.", len(_tasks))
+    deadline = time.monotonic() + timeout
+    # Повторяем, пока задачи не закончатся: завершающиеся задачи могут запускать новые
+    while _tasks and time.monotonic() < deadline:
+        await asyncio.wait(set(_tasks), timeout=deadline - time.monotonic())
+    if _tasks:
+        logger.warning("Фоновые действия не завершились за %.0f с и отменены: %d.", timeout, len(_tasks))
+        for task in set(_tasks):
+            task.cancel()
+        await asyncio.gather(*_tasks, return_exceptions=True)
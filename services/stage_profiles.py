@@ -0,0 +1,87 @@
+# services/stage_profiles.py
+import logging
+import math
+import threading
+from collections import deque
+from config.settings import (
+    STAGE_PROFILES, DEEPSEEK_AUTO_MAX_TOKENS, DEEPSEEK_AUTO_MAX_TOKENS_MIN_SAMPLES, DEEPSEEK_AUTO_MAX_TOKENS_MARGIN
+)
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Профили запросов по этапам и автоподбор max_tokens по наблюдаемой длине ответов.
+# Время генерации растет с длиной ответа, а фактические ответы этапов (JSON с оценкой
+# и коротким объяснением) обычно намного короче значения max_tokens из профиля.
+
+DEFAULT_PROFILE = {"model": "deepseek-chat", "max_tokens": 500, "temperature": None, "input_tokens": None}
+
+# Сколько последних длин ответа хранить и как часто пересчитывать p99
+COMPLETION_WINDOW = 1000
+RECALCULATE_EVERY = 50
+
+# Небольшой абсолютный запас поверх p99 * margin для очень коротких ответов
+MIN_HEADROOM_TOKENS = 16
+
+_lock = threading.Lock()
+_completion_tokens = {} # stage -> deque последних длин ответов
+_pending_recalculation = {} # stage -> ответов с последнего пересчета
+_auto_max_tokens = {} # stage -> подобранный max_tokens
+
+def get_stage_profile(stage: str) -> dict:
+    """
+    Возвращает профиль этапа (model, max_tokens, temperature, input_tokens) из config.settings.STAGE_PROFILES.
+    """
+    return {**DEFAULT_PROFILE, **STAGE_PROFILES.get(stage, {})}
+
+def effective_max_tokens(stage: str) -> int:
+    """
+    max_tokens для очередного запроса этапа: подобранный по наблюдениям (в режиме
+    DEEPSEEK_AUTO_MAX_TOKENS, когда набралось достаточно ответов) или из профиля.
+    """
+    ceiling = get_stage_profile(stage)["max_tokens"]
+    if not DEEPSEEK_AUTO_MAX_TOKENS:
+        return ceiling
+    with _lock:
+        auto = _auto_max_tokens.get(stage)
+    return min(ceiling, auto) if auto else ceiling
+
+def record_completion(stage: str, completion_tokens: int | None, finish_reason: str | None, max_tokens: int) -> None:
+    """
+    Учитывает длину ответа модели. Обрезанные ответы (finish_reason=length) логируются
+    и считаются в метрике deepseek_truncated_total{stage}.
+    """
+    if finish_reason == "length":
+        metrics.inc("deepseek_truncated_total", stage=stage)
+        logger.warning("Ответ Deepseek (этап %s) обрезан по max_tokens=%d.", stage, max_tokens)
+    if completion_tokens is None:
+        return
+
+    metrics.observe("deepseek_completion_tokens", completion_tokens, stage=stage)
+    # Обрезанный ответ не показывает настоящую длину — в статистику для подбора его не берем
+    if not DEEPSEEK_AUTO_MAX_TOKENS or finish_reason == "length":
+        return
+
+    with _lock:
+        window = _completion_tokens.setdefault(stage, deque(maxlen=COMPLETION_WINDOW))
+        window.append(completion_tokens)
+        _pending_recalculation[stage] = _pending_recalculation.get(stage, 0) + 1
+        if len(window) < DEEPSEEK_AUTO_MAX_TOKENS_MIN_SAMPLES or _pending_recalculation[stage] < RECALCULATE_EVERY:
+            return
+        _pending_recalculation[stage] = 0
+        values = sorted(window)
+
+    p99 = metrics.percentile(values, 99)
+    auto = math.ceil(p99 * DEEPSEEK_AUTO_MAX_TOKENS_MARGIN) + MIN_HEADROOM_TOKENS
+    with _lock:
+        previous = _auto_max_tokens.get(stage)
+        _auto_max_tokens[stage] = auto
+    metrics.set_gauge("deepseek_auto_max_tokens", auto, stage=stage)
+    if previous != auto:
+        logger.info("Автоподбор max_tokens для этапа %s: %d (p99 длины ответа: %s).", stage, auto, p99)
+
+def is_auto_sized(stage: str, max_tokens: int) -> bool:
+    """
+    Проверяет, был ли max_tokens запроса уменьшен автоподбором относительно профиля.
+    """
+    return max_tokens < get_stage_profile(stage)["max_tokens"]
@@ -1,19 +1,44 @@
 # services/telegram_logger.py
+import logging
 from telegram import Bot
 from telegram.constants import ParseMode # Исправлено: теперь импортируем ParseMode из telegram.constants
 import html
 from config.settings import LOGGING_BOT_TOKEN, LOGGING_CHAT_ID
 
-# Инициализируем Bot для логирования один раз при загрузке модуля
+logger = logging.getLogger(__name__)
+
+# Bot для логирования создается один раз — при первой отправке лога.
+# Если бот логирования запущен в этом же процессе (supervisor_app.py), вместо отдельного
+# экземпляра используется его Bot, переданный через set_logging_bot.
 logging_bot = None
-if LOGGING_BOT_TOKEN:
-    try:
-        logging_bot = Bot(token=LOGGING_BOT_TOKEN)
-        print("Бот для логирования успешно инициализирован в telegram_logger.")
-    except Exception as e:
-        print(f"Ошибка при инициализации бота для логирования в telegram_logger: {e}")
-else:
-    print("Внимание: LOGGING_BOT_TOKEN не установлен, логирование в отдельный бот будет недоступно.")
+if not LOGGING_BOT_TOKEN:
+    logger.warning("LOGGING_BOT_TOKEN не установлен, логирование в отдельный бот будет недоступно.")
+
+def set_logging_bot(bot: Bot) -> None:
+    """
+    Задает уже созданный Bot (например, бота приложения логирования) для отправки логов.
+    """
+    global logging_bot
+    logging_bot = bot
+
+def get_logging_bot() -> Bot | None:
+    """
+    Возвращает Bot для логирования, создавая его при первом обращении.
+    """
+    global logging_bot
+    if logging_bot is None and LOGGING_BOT_TOKEN:
+        try:
+            logging_bot = Bot(token=LOGGING_BOT_TOKEN)
+            logger.info("Бот для логирования успешно инициализирован в telegram_logger.")
+        except Exception as e:
+            logger.error("Ошибка при инициализации бота для логирования в telegram_logger: %s", e)
+    return logging_bot
+
+def _format_score(score) -> str:
+    """
+    Экранирует оценку характеристики для HTML-лога.
+    """
+    return "не оценивалась" if score is None else html.escape(str(score))
 
 async def send_log_message(
     main_message: str,
@@ -41,7 +66,8 @@ async def send_log_message(
     Отправляет лог-сообщение в отдельный Telegram-бот.
     Текст сообщения форматируется без жирного выделения и с учетом ваших стилистических предпочтений.
     """
-    if logging_bot and LOGGING_CHAT_ID:
+    bot = get_logging_bot()
+    if bot and LOGGING_CHAT_ID:
         # Убедимся, что все explain_value_X являются строками перед экранированием
         escaped_main_message = html.escape(main_message)
         escaped_message_link = html.escape(message_link)
@@ -51,12 +77,13 @@ async def send_log_message(
         escaped_total_score_context = html.escape(str(total_score_context))
         escaped_explain_value_2 = html.escape(str(explain_value_2))
 
-        # Экранированные значения для оценок характеристик (только баллы, без объяснений)
-        escaped_emotion_score = html.escape(str(emotion_score))
-        escaped_image_score = html.escape(str(image_score))
-        escaped_heroes_score = html.escape(str(heroes_score))
-        escaped_actual_score = html.escape(str(actual_score))
-        escaped_drama_score = html.escape(str(drama_score))
+        # Экранированные значения для оценок характеристик (только баллы, без объяснений);
+        # None — характеристика не оценивалась из-за досрочного завершения третьего этапа
+        escaped_emotion_score = _format_score(emotion_score)
+        escaped_image_score = _format_score(image_score)
+        escaped_heroes_score = _format_score(heroes_score)
+        escaped_actual_score = _format_score(actual_score)
+        escaped_drama_score = _format_score(drama_score)
 
         log_message_text = (
             f"Исходное сообщение:\n\n{escaped_main_message}\n\n"
@@ -82,15 +109,29 @@ async def send_log_message(
             )
 
         try:
-            sent_message = await logging_bot.send_message(
+            sent_message = await bot.send_message(
                 chat_id=LOGGING_CHAT_ID,
                 text=log_message_text,
                 parse_mode=ParseMode.HTML
             )
             log_message_id = sent_message.message_id
-            print(f"Лог успешно отправлен ботом логирования в чат {LOGGING_CHAT_ID}. Message ID: {log_message_id}")
+            logger.debug("Лог успешно отправлен ботом логирования в чат %s. Message ID: %s", LOGGING_CHAT_ID, log_message_id)
         except Exception as e:
-            print(f"Ошибка при отправке лога ботом логирования в чат {LOGGING_CHAT_ID}: {e}")
+            logger.error("Ошибка при отправке лога ботом логирования в чат %s: %s", LOGGING_CHAT_ID, e)
     else:
-        print("Бот для логирования или LOGGING_CHAT_ID не инициализирован, лог не отправлен.")
+        logger.debug("Бот для логирования или LOGGING_CHAT_ID не инициализирован, лог не отправлен.")
+
 
+async def send_service_message(text: str) -> None:
+    """
+    Отправляет служебное сообщение (например, предупреждение наблюдения за памятью)
+    в чат логирования. Текст передается в разметке HTML.
+    """
+    bot = get_logging_bot()
+    if not bot or not LOGGING_CHAT_ID:
+        logger.debug("Бот для логирования или LOGGING_CHAT_ID не инициализирован, служебное сообщение не отправлено.")
+        return
+    try:
+        await bot.send_message(chat_id=LOGGING_CHAT_ID, text=text, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.error("Ошибка при отправке служебного сообщения в чат %s: %s", LOGGING_CHAT_ID, e)
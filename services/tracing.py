@@ -0,0 +1,259 @@
+# services/tracing.py
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from config.settings import LOG_QUEUE_SIZE, TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS
+from services import metrics
+
+# Трассировка обработки сообщений.
+#
+# Обработка сообщения (handle_message, фаза планировщика или задача воркера) — это трасса
+# из вложенных спанов: разбор сообщения, этапы и HTTP-запросы к Deepseek, запись в базу,
+# отправка в Telegram. Трасса целиком пишется одной строкой в TRACE_FILE в формате OTLP/JSON
+# (как ExportTraceServiceRequest), поэтому файл можно загрузить в OpenTelemetry Collector
+# (приемник otlpjsonfile) и смотреть в Jaeger или Tempo.
+#
+# Решение о сохранении принимается в конце трассы: сохраняется доля TRACE_SAMPLE_RATE
+# сообщений (детерминированно по ключу) и всегда — медленные (TRACE_SLOW_SECONDS) и
+# завершившиеся ошибкой трассы. Текущий спан хранится в contextvars и поэтому виден и в
+# потоках, где выполняются запросы к Deepseek.
+#
+# Как и журнал (utils/logger_config.py), трассы пишутся в файл отдельным потоком QueueListener:
+# завершившая трассу корутина только кладет ее в очередь. При переполнении очереди трасса
+# отбрасывается и учитывается в метрике traces_dropped_total.
+
+SERVICE_NAME = "news-filter-bot"
+
+# Виды спанов OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+# Коды статуса спана OTLP
+STATUS_OK = 0
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Поток записи создается при первой сохраненной трассе, отдельно в каждом процессе
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+class _Trace:
+    """
+    Спаны одной трассы. Спаны добавляются и из цикла событий, и из рабочих потоков.
+    """
+    def __init__(self, message_key: str | None):
+        # Идентификатор трассы выводится из ключа сообщения: фазы обработки одного сообщения
+        # (например, два приема в планировщике) попадают в одну трассу
+        self.trace_id = hashlib.sha256(message_key.encode()).hexdigest()[:32] if message_key else os.urandom(16).hex()
+        self.sampled = message_key is not None and zlib.crc32(message_key.encode()) % 10000 < TRACE_SAMPLE_RATE * 10000
+        self.failed = False
+        self.spans = []
+        self.lock = threading.Lock()
+
+class Span:
+    """
+    Спан трассы: имя, время начала и конца, атрибуты и статус.
+    """
+    def __init__(self, trace: _Trace, name: str, parent: "Span | None", kind: int, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.status = STATUS_OK
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attributes(self, **attributes) -> None:
+        """
+        Добавляет атрибуты к спану (значения None пропускаются).
+        """
+        self.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def set_error(self, message: str) -> None:
+        """
+        Отмечает спан как завершившийся ошибкой; такая трасса сохраняется всегда.
+        """
+        self.status = STATUS_ERROR
+        self.status_message = str(message)[:500]
+        self.trace.failed = True
+
+    def _end(self) -> None:
+        self.end_ns = time.time_ns()
+        with self.trace.lock:
+            self.trace.spans.append(self)
+
+class _NoopSpan:
+    """
+    Заглушка спана, когда трассировка выключена или трасса не начата.
+    """
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """
+    Контекстный менеджер спана внутри текущей трассы. Исключение отмечает спан как ошибочный
+    и пробрасывается дальше. Вне трассы ничего не делает.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield _NOOP_SPAN
+        return
+    current = Span(parent.trace, name, parent, kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        current._end()
+
+@contextmanager
+def trace_message(message_key: str | None, name: str, **attributes):
+    """
+    Начинает трассу обработки сообщения с корневым спаном name и по завершении
+    сохраняет ее в TRACE_FILE, если она попала в выборку, медленная или с ошибкой.
+    Внутри уже начатой трассы работает как обычный спан.
+    """
+    if not TRACE_FILE or _current_span.get() is not None:
+        with span(name, **attributes) as current:
+            yield current
+        return
+
+    trace = _Trace(message_key)
+    root = Span(trace, name, None, SPAN_KIND_INTERNAL, {"message.key": message_key, **attributes})
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        root._end()
+        duration = (root.end_ns - root.start_ns) / 1e9
+        metrics.observe("trace_duration_seconds", duration, root=name)
+        reason = "error" if trace.failed else "slow" if duration >= TRACE_SLOW_SECONDS else "sampled" if trace.sampled else None
+        if reason:
+            _write_trace(trace, reason)
+
+def detach_trace() -> None:
+    """
+    Отвязывает текущий контекст от трассы (например, в задаче, которая выполняет пакет
+    запросов нескольких сообщений и не должна попадать в трассу одного из них).
+    """
+    _current_span.set(None)
+
+def current_span() -> Span | _NoopSpan:
+    """
+    Возвращает текущий спан (или заглушку вне трассы), например, чтобы добавить атрибуты.
+    """
+    return _current_span.get() or _NOOP_SPAN
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _span_to_otlp(current: Span) -> dict:
+    entry = {
+        "traceId": current.trace.trace_id,
+        "spanId": current.span_id,
+        "name": current.name,
+        "kind": current.kind,
+        "startTimeUnixNano": str(current.start_ns),
+        "endTimeUnixNano": str(current.end_ns),
+        "attributes": [
+            {"key": key, "value": _attribute_value(value)} for key, value in current.attributes.items() if value is not None
+        ],
+        "status": {"code": current.status},
+    }
+    if current.parent_id:
+        entry["parentSpanId"] = current.parent_id
+    if current.status_message:
+        entry["status"]["message"] = current.status_message
+    return entry
+
+class _OtlpFormatter(logging.Formatter):
+    """
+    Сериализует трассу (словарь ExportTraceServiceRequest) в JSON в потоке записи.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False)
+
+def _writer_queue() -> queue.Queue:
+    """
+    Возвращает очередь потока записи трасс текущего процесса, при необходимости запуская его.
+    """
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            directory = os.path.dirname(TRACE_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = logging.FileHandler(TRACE_FILE, encoding="utf-8")
+            handler.setFormatter(_OtlpFormatter())
+            _writer = logging.handlers.QueueListener(queue.Queue(maxsize=LOG_QUEUE_SIZE), handler)
+            _writer.start()
+            if _writer_pid is None:
+                atexit.register(close_tracing)
+            _writer_pid = os.getpid()
+        return _writer.queue
+
+def close_tracing() -> None:
+    """
+    Дописывает трассы, накопленные в очереди, и останавливает поток записи.
+    """
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            _writer.stop()
+            for handler in _writer.handlers:
+                handler.close()
+        _writer = None
+
+def _write_trace(trace: _Trace, reason: str) -> None:
+    """
+    Передает трассу потоку записи, который допишет ее одной строкой OTLP/JSON в TRACE_FILE.
+    """
+    with trace.lock:
+        spans = [_span_to_otlp(current) for current in trace.spans]
+    request = {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            {"key": "trace.keep_reason", "value": {"stringValue": reason}},
+        ]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+    }]}
+    try:
+        _writer_queue().put_nowait(logging.makeLogRecord({"msg": request}))
+    except queue.Full:
+        metrics.inc("traces_dropped_total")
+        return
+    metrics.inc("traces_written_total", reason=reason)
@@ -0,0 +1,109 @@
+# supervisor_app.py
+import asyncio
+import logging
+import signal
+from telegram import Update
+from config.settings import TELEGRAM_BOT_TOKEN, PRIVATE_GROUP_CHAT_ID, LOGGING_BOT_TOKEN
+from services.checkpoint_store import close_checkpoints
+from services.database_service import close_database
+from services.deepseek_service import close_session
+from services.telegram_logger import set_logging_bot
+from utils.logger_config import setup_logging
+import main_bot_app
+import logging_bot_app
+
+logger = logging.getLogger(__name__)
+
+async def _start_application(application, name: str) -> None:
+    """
+    Запускает Application и опрос обновлений без собственного цикла событий
+    (в отличие от run_polling, который занимает цикл целиком).
+    """
+    await application.initialize()
+    # post_init вызывается только из run_polling, поэтому здесь — явно
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    logger.info("%s: прослушивание новых сообщений запущено (polling).", name)
+
+async def _stop_application(application, name: str) -> None:
+    """
+    Останавливает опрос, обработку обновлений и освобождает ресурсы Application.
+    Безопасна для частично запущенного приложения.
+    """
+    try:
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+            # post_stop, как и post_init, вызывается только из run_polling
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info("%s остановлен.", name)
+    except Exception as e:
+        logger.exception("Ошибка при остановке (%s): %s", name, e)
+
+async def run_bots() -> None:
+    """
+    Запускает основной бот и бот логирования в одном цикле событий.
+    Оба бота используют общие HTTP-сессию Deepseek и соединение с SQLite, а логи
+    отправляются через Bot приложения логирования, а не через отдельный экземпляр.
+    """
+    applications = [(main_bot_app.build_application(), "Основной бот")]
+    if LOGGING_BOT_TOKEN:
+        logging_application = logging_bot_app.build_application()
+        set_logging_bot(logging_application.bot)
+        applications.append((logging_application, "Бот для логирования"))
+    else:
+        logger.warning("LOGGING_BOT_TOKEN не установлен, бот для логирования не запускается.")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass # Windows: остановка по KeyboardInterrupt
+
+    started = []
+    try:
+        for application, name in applications:
+            started.append((application, name))
+            await _start_application(application, name)
+        logger.info("Все боты запущены. Для остановки нажмите Ctrl+C.")
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки.")
+    finally:
+        # Сначала останавливаем основной бот (он дорабатывает текущие сообщения и еще
+        # отправляет по ним логи), затем бот логирования
+        for application, name in started:
+            await _stop_application(application, name)
+        close_session()
+        close_database()
+        close_checkpoints()
+
+def main():
+    """Запускает оба бота в одном процессе."""
+    setup_logging("supervisor")
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("Токен основного Telegram-бота не найден. Убедитесь, что он указан в файле .env")
+        return
+    if not PRIVATE_GROUP_CHAT_ID:
+        logger.error("Chat ID приватной группы не найден. Убедитесь, что он указан в файле .env")
+        return
+
+    try:
+        asyncio.run(run_bots())
+    except KeyboardInterrupt:
+        logger.info("Боты остановлены пользователем (KeyboardInterrupt).")
+    except Exception as e:
+        logger.exception("Ошибка при работе ботов: %s", e)
+    finally:
+        logger.info("Все боты завершили работу.")
+
+if __name__ == '__main__':
+    main()
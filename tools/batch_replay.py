@@ -0,0 +1,168 @@
+# tools/batch_replay.py
+"""
+Офлайн-прогон новостей из файла через этапы фильтрации Deepseek без Telegram.
+
+Входной файл — JSONL (по объекту на строку) или CSV. Поле `text` содержит сообщение
+в том же формате, что и в Telegram (текст и ссылка разделены '1111\\n\\n');
+необязательное поле `link` переопределяет ссылку. Остальные поля записи
+копируются в результат как есть (в ключ `input`).
+
+Результаты пишутся построчно в JSONL-файл и сразу сбрасываются на диск. Этот же
+файл служит контрольной точкой: при повторном запуске уже обработанные записи
+(по номеру `index`) пропускаются, поэтому прерванный прогон можно просто перезапустить.
+
+Пример запуска:
+    python -m tools.batch_replay corpus.jsonl results.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+from services.pipeline import run_pipeline
+from utils.logger_config import setup_logging
+from utils.telegram_utils import parse_news_message
+
+logger = logging.getLogger(__name__)
+
+def iter_input_items(input_path: str, input_format: str):
+    """
+    Лениво читает входной файл и возвращает пары (index, item).
+    Файл не загружается в память целиком.
+    """
+    with open(input_path, "r", encoding="utf-8", newline="") as f:
+        if input_format == "csv":
+            for index, row in enumerate(csv.DictReader(f)):
+                yield index, row
+        else:
+            index = 0
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                yield index, json.loads(line)
+                index += 1
+
+def load_completed_indexes(output_path: str) -> set[int]:
+    """
+    Читает уже записанные результаты и возвращает множество обработанных индексов.
+    Недописанная последняя строка (после аварийной остановки) отрезается.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    valid_size = 0
+    with open(output_path, "rb") as f:
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            try:
+                completed.add(json.loads(raw_line)["index"])
+            except (ValueError, KeyError):
+                break
+            valid_size += len(raw_line)
+
+    if valid_size != os.path.getsize(output_path):
+        logger.warning("Обнаружена недописанная строка в %s, файл обрезан до %d байт.", output_path, valid_size)
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_size)
+
+    return completed
+
+def detect_format(input_path: str) -> str:
+    """
+    Определяет формат входного файла по расширению.
+    """
+    return "csv" if input_path.lower().endswith(".csv") else "jsonl"
+
+async def process_item(index: int, item: dict) -> dict:
+    """
+    Прогоняет одну запись через пайплайн и возвращает строку результата.
+    """
+    main_message, message_link = parse_news_message(item.get("text") or "")
+    if item.get("link"):
+        message_link = str(item["link"]).strip()
+
+    record = {
+        "index": index,
+        "input": {key: value for key, value in item.items() if key not in ("text", "link")},
+    }
+    started_at = time.perf_counter()
+    try:
+        record.update(await run_pipeline(main_message, message_link))
+    except Exception as e:
+        logger.exception("Ошибка при обработке записи %d: %s", index, e)
+        record["error"] = str(e)
+    record["elapsed_seconds"] = round(time.perf_counter() - started_at, 3)
+    return record
+
+async def run_batch(input_path: str, output_path: str, concurrency: int, input_format: str) -> None:
+    """
+    Обрабатывает входной файл с ограниченным параллелизмом, дописывая результаты в output_path.
+    """
+    completed = load_completed_indexes(output_path)
+    if completed:
+        logger.info("Возобновление прогона: %d записей уже обработаны и будут пропущены.", len(completed))
+
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    processed = 0
+    started_at = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as output_file:
+
+        async def worker():
+            nonlocal processed
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    queue.task_done()
+                    return
+                record = await process_item(*entry)
+                # Запись строки целиком без await между write и flush — строки не перемешиваются
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output_file.flush()
+                processed += 1
+                if processed % 50 == 0:
+                    rate = processed / (time.perf_counter() - started_at)
+                    logger.info("Обработано %d записей (%.2f записей/с).", processed, rate)
+                queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+        for index, item in iter_input_items(input_path, input_format):
+            if index in completed:
+                continue
+            await queue.put((index, item))
+
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    logger.info("Прогон завершен: обработано %d записей за %.1f с.", processed, time.perf_counter() - started_at)
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-прогон новостей через фильтры Deepseek.")
+    parser.add_argument("input", help="Входной файл (JSONL или CSV) с полем text.")
+    parser.add_argument("output", help="Выходной JSONL-файл (он же контрольная точка для возобновления).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Количество одновременно обрабатываемых записей.")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="Формат входного файла (по умолчанию — по расширению).")
+    args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error("--concurrency должен быть не меньше 1")
+
+    setup_logging("batch_replay")
+    input_format = args.format or detect_format(args.input)
+    try:
+        asyncio.run(run_batch(args.input, args.output, args.concurrency, input_format))
+    except KeyboardInterrupt:
+        logger.warning("Прогон прерван. Повторный запуск с теми же файлами продолжит с места остановки.")
+        sys.exit(130)
+
+if __name__ == '__main__':
+    main()
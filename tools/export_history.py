@@ -0,0 +1,41 @@
+# tools/export_history.py
+"""
+Выгрузка журнала сообщений (message_logs) и результатов этапов фильтрации
+(pipeline_results) из data/stats.db в CSV или Parquet для офлайн-анализа.
+
+Строки читаются и записываются пачками, поэтому память не растет с размером таблицы.
+Период задается по колонке timestamp: --since включительно, --until не включительно
+(YYYY-MM-DD или дата и время в ISO 8601). Для Parquet нужен пакет pyarrow.
+
+Пример запуска:
+    python -m tools.export_history pipeline_results results.parquet --since 2025-01-01 --until 2025-02-01
+"""
+import argparse
+import logging
+import os
+
+from services.export_service import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORT_TABLES, export_table
+from utils.logger_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка истории из data/stats.db в CSV или Parquet.")
+    parser.add_argument("table", choices=EXPORT_TABLES, help="Выгружаемая таблица.")
+    parser.add_argument("output", help="Выходной файл.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default=None, help="Формат (по умолчанию — по расширению, иначе csv).")
+    parser.add_argument("--since", default=None, help="Начало периода, включительно (YYYY-MM-DD или ISO 8601).")
+    parser.add_argument("--until", default=None, help="Конец периода, не включительно (YYYY-MM-DD или ISO 8601).")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="Строк в одной пачке чтения и записи.")
+    args = parser.parse_args()
+
+    setup_logging("export_history")
+    export_format = args.format or ("parquet" if os.path.splitext(args.output)[1].lower() == ".parquet" else "csv")
+    try:
+        export_table(args.table, args.output, export_format, args.since, args.until, args.chunk_size)
+    except (ValueError, RuntimeError) as e:
+        logger.error("Выгрузка не выполнена: %s", e)
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+# tools/threshold_simulator.py
+"""
+Симулятор порогов CONTEXT_THRESHOLD, MAX_POTENTIAL и SUM_POTENTIAL по сохраненным оценкам.
+
+Загружает исторические оценки второго (8 критериев контекста) и третьего (5 характеристик)
+этапов в массивы NumPy и пересчитывает решение perform_context_filtration и handle_message
+сразу для всей сетки комбинаций порогов. Новые запросы к Deepseek не выполняются.
+
+Источники данных:
+    * таблица pipeline_results в data/stats.db (по умолчанию);
+    * JSONL-результаты tools/batch_replay.py (--source results.jsonl), где оценка человека
+      берется из поля input.approved.
+
+Оценка человека может быть задана и отдельным файлом (--approved-links) со ссылками
+одобренных новостей — по одной на строку.
+
+Ограничение: оценки третьего этапа есть только у сообщений, прошедших второй этап при
+пороге, действовавшем в момент обработки. Сообщения, которые прошли бы второй этап при
+более низком пороге, но не имеют оценок третьего этапа, выводятся отдельно как "unknown".
+Кроме того, при STAGE3_EARLY_EXIT часть оценок отклоненных сообщений не запрашивается (NULL
+и считается нулем), поэтому для подбора SUM_POTENTIAL ниже текущего данные нужно собирать
+с STAGE3_EARLY_EXIT=false.
+
+Пример запуска:
+    python -m tools.threshold_simulator --context 4:8:0.5 --max 6:10:1 --sum 4:8:0.25 --output grid.csv
+"""
+import argparse
+import csv
+import json
+import time
+
+import numpy as np
+
+from config.settings import CONTEXT_THRESHOLD, MAX_POTENTIAL, SUM_POTENTIAL
+from services.database_service import iter_pipeline_scores, PIPELINE_CONTEXT_COLUMNS, PIPELINE_SCORE_COLUMNS
+
+CHUNK_SIZE = 50000
+
+def _score_or_none(value):
+    """
+    Оставляет только числовые оценки (как при сохранении в pipeline_results), остальное — None.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+def iter_batch_results(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Читает JSONL-результаты batch_replay и возвращает пачки строк в том же формате,
+    что и iter_pipeline_scores.
+    """
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "error" in record:
+                continue
+            context_scores = record.get("context_scores") or {}
+            approved = (record.get("input") or {}).get("approved")
+            rows.append((
+                record["message_link"],
+                record["filter_value_1"],
+                record["filter_value_2"],
+                record["total_score_context"],
+                *(_score_or_none(context_scores.get(key)) for key in PIPELINE_CONTEXT_COLUMNS),
+                1 if record["is_filtered_by_stage_2"] else 0,
+                *(_score_or_none(record[key]) for key in PIPELINE_SCORE_COLUMNS),
+                None if approved is None else int(bool(approved)),
+            ))
+            if len(rows) >= chunk_size:
+                yield rows
+                rows = []
+    if rows:
+        yield rows
+
+def _numeric_column(values) -> np.ndarray:
+    """
+    Переводит колонку в float64; None становится NaN.
+    """
+    return np.array(values, dtype=np.float64)
+
+def load_score_arrays(chunks, approved_links: set[str] | None = None) -> dict:
+    """
+    Собирает пачки строк в массивы NumPy, нужные для пересчета решений.
+    """
+    n_context = len(PIPELINE_CONTEXT_COLUMNS)
+    n_scores = len(PIPELINE_SCORE_COLUMNS)
+    parts = {"stage1_ok": [], "context": [], "stage3_ran": [], "scores": [], "approved": []}
+
+    for rows in chunks:
+        columns = list(zip(*rows))
+        links, filter_1 = columns[0], columns[1]
+        context = np.column_stack([_numeric_column(columns[4 + i]) for i in range(n_context)])
+        stage3_ran_index = 4 + n_context
+        scores = np.column_stack([_numeric_column(columns[stage3_ran_index + 1 + i]) for i in range(n_scores)])
+
+        parts["stage1_ok"].append(np.array([value != "Нет" for value in filter_1], dtype=bool))
+        parts["context"].append(context)
+        parts["stage3_ran"].append(np.array(columns[stage3_ran_index], dtype=bool))
+        parts["scores"].append(scores)
+        if approved_links is not None:
+            parts["approved"].append(np.array([link in approved_links for link in links], dtype=np.float64))
+        else:
+            parts["approved"].append(_numeric_column(columns[-1]))
+
+    if not parts["stage1_ok"]:
+        raise ValueError("Нет сохраненных результатов для симуляции.")
+
+    return {
+        "stage1_ok": np.concatenate(parts["stage1_ok"]),
+        "context": np.concatenate(parts["context"]),
+        "stage3_ran": np.concatenate(parts["stage3_ran"]),
+        "scores": np.concatenate(parts["scores"]),
+        "approved": np.concatenate(parts["approved"]),
+    }
+
+def _threshold_bins(values: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    Для каждого значения возвращает количество порогов t (по возрастанию), для которых value >= t.
+    NaN не проходит ни один порог.
+    """
+    bins = np.searchsorted(thresholds, values, side="right")
+    bins[np.isnan(values)] = 0
+    return bins
+
+def _suffix_sum(histogram: np.ndarray) -> np.ndarray:
+    """
+    Накопленная сумма "с конца" по всем осям: result[a, b, c] = sum(histogram[a:, b:, c:]).
+    """
+    for axis in range(histogram.ndim):
+        histogram = np.flip(np.cumsum(np.flip(histogram, axis), axis=axis), axis)
+    return histogram
+
+def simulate_grid(arrays: dict, context_grid: np.ndarray, max_grid: np.ndarray, sum_grid: np.ndarray) -> dict:
+    """
+    Пересчитывает финальное решение для всех комбинаций порогов.
+
+    Логика повторяет пайплайн:
+        этап 1: filter_value_1 != "Нет";
+        этап 2: sum(8 критериев) / 8 >= CONTEXT_THRESHOLD (только если ответ этапа 2 получен);
+        финал:  sum(5 оценок) / 5 >= SUM_POTENTIAL и хотя бы одна оценка >= MAX_POTENTIAL
+                (нечисловые оценки не учитываются, как и в handle_message).
+
+    Вместо перебора сетки значения раскладываются по корзинам порогов, после чего число
+    прошедших сообщений для каждой комбинации получается накопленными суммами
+    трехмерной гистограммы — O(N log G + G) вместо O(N * G).
+    """
+    context = arrays["context"]
+    stage2_ok = arrays["stage1_ok"] & ~np.all(np.isnan(context), axis=1)
+    context_mean = np.where(stage2_ok, np.nansum(context, axis=1) / 8, np.nan)
+
+    scores = arrays["scores"]
+    total_potential = np.nansum(scores, axis=1) / 5
+    max_score = np.max(np.where(np.isnan(scores), -np.inf, scores), axis=1)
+    max_score[np.isneginf(max_score)] = np.nan
+
+    shape = (len(context_grid) + 1, len(max_grid) + 1, len(sum_grid) + 1)
+    context_bins = _threshold_bins(context_mean, context_grid)
+    max_bins = _threshold_bins(max_score, max_grid)
+    sum_bins = _threshold_bins(total_potential, sum_grid)
+
+    with_stage3 = stage2_ok & arrays["stage3_ran"]
+    flat_index = np.ravel_multi_index((context_bins[with_stage3], max_bins[with_stage3], sum_bins[with_stage3]), shape)
+    size = shape[0] * shape[1] * shape[2]
+
+    approved = arrays["approved"]
+    is_approved = approved == 1
+    passed = _suffix_sum(np.bincount(flat_index, minlength=size).reshape(shape))[1:, 1:, 1:]
+    passed_approved = _suffix_sum(
+        np.bincount(flat_index, weights=is_approved[with_stage3], minlength=size).reshape(shape)
+    )[1:, 1:, 1:]
+
+    # Сообщения, которые прошли бы второй этап, но оценок третьего этапа для них нет
+    without_stage3 = stage2_ok & ~arrays["stage3_ran"]
+    unknown = np.cumsum(np.bincount(context_bins[without_stage3], minlength=shape[0])[::-1])[::-1][1:]
+
+    return {
+        "total": len(context_mean),
+        "labeled": int(np.count_nonzero(~np.isnan(approved))),
+        "approved_total": int(np.count_nonzero(is_approved)),
+        "passed": passed,
+        "passed_approved": passed_approved,
+        "unknown": unknown,
+    }
+
+def iter_grid_rows(simulation: dict, context_grid, max_grid, sum_grid):
+    """
+    Разворачивает результаты симуляции в строки (словарь на каждую комбинацию порогов).
+    """
+    total = simulation["total"]
+    approved_total = simulation["approved_total"]
+    for i, context_threshold in enumerate(context_grid):
+        for j, max_potential in enumerate(max_grid):
+            for k, sum_potential in enumerate(sum_grid):
+                passed = int(simulation["passed"][i, j, k])
+                passed_approved = int(simulation["passed_approved"][i, j, k])
+                precision = passed_approved / passed if passed else 0.0
+                recall = passed_approved / approved_total if approved_total else 0.0
+                yield {
+                    "context_threshold": float(context_threshold),
+                    "max_potential": float(max_potential),
+                    "sum_potential": float(sum_potential),
+                    "passed": passed,
+                    "pass_rate": passed / total if total else 0.0,
+                    "unknown": int(simulation["unknown"][i]),
+                    "passed_approved": passed_approved,
+                    "precision": precision,
+                    "recall": recall,
+                    "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+                }
+
+def parse_grid(value: str) -> np.ndarray:
+    """
+    Разбирает сетку порогов: "start:stop:step" (stop включительно) или список через запятую.
+    """
+    if ":" in value:
+        start, stop, step = (float(part) for part in value.split(":"))
+        grid = np.arange(start, stop + step / 2, step)
+    else:
+        grid = np.array([float(part) for part in value.split(",")])
+    return np.unique(grid)
+
+def _format_row(row: dict) -> str:
+    return (
+        f"C={row['context_threshold']:<5g} M={row['max_potential']:<5g} S={row['sum_potential']:<5g} "
+        f"прошло={row['passed']:<7} ({row['pass_rate'] * 100:6.2f}%) unknown={row['unknown']:<6} "
+        f"одобр.={row['passed_approved']:<6} precision={row['precision']:.3f} recall={row['recall']:.3f} f1={row['f1']:.3f}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция порогов фильтрации по сохраненным оценкам.")
+    parser.add_argument("--source", default=None, help="JSONL-результаты batch_replay (по умолчанию — таблица pipeline_results).")
+    parser.add_argument("--approved-links", default=None, help="Файл со ссылками одобренных человеком новостей (по одной на строку).")
+    parser.add_argument("--context", default="0:10:0.5", help="Сетка CONTEXT_THRESHOLD (start:stop:step или список через запятую).")
+    parser.add_argument("--max", default="0:10:1", help="Сетка MAX_POTENTIAL.")
+    parser.add_argument("--sum", default="0:10:0.5", help="Сетка SUM_POTENTIAL.")
+    parser.add_argument("--top", type=int, default=10, help="Сколько лучших комбинаций (по f1) вывести.")
+    parser.add_argument("--output", default=None, help="CSV-файл для полной сетки результатов.")
+    args = parser.parse_args()
+
+    context_grid = np.unique(np.append(parse_grid(args.context), CONTEXT_THRESHOLD))
+    max_grid = np.unique(np.append(parse_grid(args.max), MAX_POTENTIAL))
+    sum_grid = np.unique(np.append(parse_grid(args.sum), SUM_POTENTIAL))
+
+    approved_links = None
+    if args.approved_links:
+        with open(args.approved_links, "r", encoding="utf-8") as f:
+            approved_links = {line.strip() for line in f if line.strip()}
+
+    started_at = time.perf_counter()
+    chunks = iter_batch_results(args.source) if args.source else iter_pipeline_scores(CHUNK_SIZE)
+    arrays = load_score_arrays(chunks, approved_links)
+    loaded_at = time.perf_counter()
+    simulation = simulate_grid(arrays, context_grid, max_grid, sum_grid)
+    finished_at = time.perf_counter()
+
+    combinations = len(context_grid) * len(max_grid) * len(sum_grid)
+    print(f"Записей: {simulation['total']}, с оценкой человека: {simulation['labeled']}, одобрено: {simulation['approved_total']}")
+    print(f"Загрузка: {loaded_at - started_at:.2f} с, симуляция {combinations} комбинаций: {finished_at - loaded_at:.3f} с")
+
+    rows = list(iter_grid_rows(simulation, context_grid, max_grid, sum_grid))
+    current = next(
+        row for row in rows
+        if row["context_threshold"] == CONTEXT_THRESHOLD and row["max_potential"] == MAX_POTENTIAL and row["sum_potential"] == SUM_POTENTIAL
+    )
+    print("\nТекущие настройки:")
+    print(_format_row(current))
+
+    if simulation["approved_total"]:
+        print(f"\nЛучшие {args.top} комбинаций по f1:")
+        for row in sorted(rows, key=lambda r: (r["f1"], -r["passed"]), reverse=True)[:args.top]:
+            print(_format_row(row))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nПолная сетка сохранена в {args.output}")
+
+if __name__ == '__main__':
+    main()
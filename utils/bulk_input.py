@@ -0,0 +1,76 @@
+# utils/bulk_input.py
+import csv
+import io
+import json
+import re
+from config.settings import BULK_ITEM_SEPARATOR
+from utils.telegram_utils import parse_news_message
+
+# Пакетный ввод: одно сообщение или один документ с несколькими новостями.
+#
+# В тексте сообщения и в TXT-документе новости разделяются строкой, состоящей только из
+# BULK_ITEM_SEPARATOR; внутри новости текст и ссылка, как обычно, разделены '1111\n\n'.
+# JSONL и CSV — тот же формат, что у tools/batch_replay.py: поле text и необязательное поле link.
+
+BULK_DOCUMENT_EXTENSIONS = ("jsonl", "csv", "txt")
+
+_SEPARATOR_LINE = re.compile(rf"^[ \t]*{re.escape(BULK_ITEM_SEPARATOR)}[ \t]*$", re.MULTILINE)
+
+def split_bulk_text(text: str) -> list[tuple[str, str]]:
+    """
+    Разбивает текст на новости по строкам-разделителям BULK_ITEM_SEPARATOR и возвращает
+    пары (текст новости, ссылка). Пустые фрагменты пропускаются.
+    """
+    items = []
+    for part in _SEPARATOR_LINE.split(text):
+        main_message, message_link = parse_news_message(part)
+        if main_message:
+            items.append((main_message, message_link))
+    return items
+
+def is_bulk_text(text: str) -> bool:
+    """
+    Проверяет, содержит ли текст сообщения разделители пакетного ввода.
+    """
+    return bool(_SEPARATOR_LINE.search(text))
+
+def _item_from_record(record: dict) -> tuple[str, str] | None:
+    main_message, message_link = parse_news_message(str(record.get("text") or ""))
+    if record.get("link"):
+        message_link = str(record["link"]).strip()
+    return (main_message, message_link) if main_message else None
+
+def parse_bulk_document(data: bytes, filename: str) -> list[tuple[str, str]]:
+    """
+    Разбирает документ с новостями (JSONL, CSV или TXT, по расширению имени файла)
+    и возвращает пары (текст новости, ссылка). Неверный формат — ValueError.
+    """
+    try:
+        content = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("Документ должен быть в кодировке UTF-8.") from None
+
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension == "txt":
+        return split_bulk_text(content)
+    if extension == "csv":
+        records = csv.DictReader(io.StringIO(content, newline=""))
+        if "text" not in (records.fieldnames or ()):
+            raise ValueError("В CSV нет колонки text.")
+        return [item for item in map(_item_from_record, records) if item]
+    if extension == "jsonl":
+        items = []
+        for line_number, line in enumerate(content.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Строка {line_number}: некорректный JSON ({e.msg}).") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"Строка {line_number}: ожидается JSON-объект с полем text.")
+            item = _item_from_record(record)
+            if item:
+                items.append(item)
+        return items
+    raise ValueError(f"Неподдерживаемый формат документа. Доступны: {', '.join(BULK_DOCUMENT_EXTENSIONS)}.")
@@ -0,0 +1,145 @@
+# utils/logger_config.py
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import zlib
+from datetime import datetime, timezone
+from config.settings import (
+    LOG_LEVEL, LOG_FORMAT, LOG_DIR, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_DEBUG_SAMPLE_RATE
+)
+from services import metrics
+from services.checkpoint_store import current_message_key
+
+# Журналирование без блокировки цикла событий.
+#
+# Модули пишут в стандартные логгеры (logging.getLogger(__name__)). Вызывающий поток только
+# подставляет аргументы в сообщение и кладет запись в очередь; форматирование в JSON и запись
+# в консоль и файл выполняет отдельный поток QueueListener. Если очередь переполнена (поток
+# записи не успевает), запись отбрасывается и учитывается в метрике log_records_dropped_total —
+# медленный диск или консоль не должны тормозить обработку сообщений.
+
+# Атрибуты LogRecord, которые есть у любой записи; остальные (переданные через extra=) пишутся в JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись — одна строка JSON (JSON Lines).
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _DebugSamplingFilter(logging.Filter):
+    """
+    Пропускает DEBUG-записи только для доли сообщений LOG_DEBUG_SAMPLE_RATE.
+    Выборка детерминирована по ключу сообщения: для выбранного сообщения видны все его записи.
+    """
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        message_key = getattr(record, "message_key", None)
+        if message_key is None:
+            return random.random() < self.rate
+        return zlib.crc32(str(message_key).encode()) % 10000 < self.rate * 10000
+
+class _MessageKeyFilter(logging.Filter):
+    """
+    Добавляет к записи ключ обрабатываемого сообщения из контекста вызывающей задачи
+    (в потоке записи этого контекста уже нет).
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "message_key", None) is None:
+            record.message_key = current_message_key.get()
+        return True
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы подставляются сразу (объекты могут измениться до записи), а само
+        # форматирование в JSON остается потоку записи
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+def setup_logging(component: str = "app") -> None:
+    """
+    Настраивает журналирование процесса. component — имя файла журнала в LOG_DIR
+    (у каждого процесса свой файл, чтобы процессы не мешали друг другу при ротации).
+    Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    ))
+    handlers = [console_handler]
+    if LOG_DIR:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(LOG_DIR, f"{component}.log"),
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    queue_handler = _NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(_MessageKeyFilter())
+    queue_handler.addFilter(_DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    # httpx (используется python-telegram-bot) пишет INFO на каждый запрос к Telegram API
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging() -> None:
+    """
+    Дописывает накопленные в очереди записи и останавливает поток записи.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,164 @@
+# utils/schema_validator.py
+import math
+
+# Названия типов в схемах ответов Deepseek (как в deepseek_processor)
+_TYPE_NAMES = {
+    "STRING": "строка",
+    "INTEGER": "целое число",
+    "NUMBER": "число",
+    "BOOLEAN": "true/false",
+    "OBJECT": "объект",
+    "ARRAY": "список",
+}
+
+class CompiledSchema:
+    """
+    Схема ответа, заранее превращенная в набор функций проверки полей.
+    Создается один раз (при импорте модуля со схемами) и затем только вызывается.
+
+    validate(data) возвращает (нормализованный_словарь, []) при успехе
+    или (None, [список ошибок]) — ошибки формулируются так, чтобы их можно было
+    вернуть модели в запросе на исправление.
+    """
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.required = tuple(schema.get("required", ()))
+        self._checkers = tuple(
+            (name, _compile_property(name, spec)) for name, spec in schema.get("properties", {}).items()
+        )
+        self.description = _describe(schema)
+
+    def validate(self, data) -> tuple[dict | None, list[str]]:
+        if not isinstance(data, dict):
+            return None, ["ответ должен быть JSON-объектом"]
+
+        result = {}
+        errors = []
+        for name, check in self._checkers:
+            if name not in data:
+                if name in self.required:
+                    errors.append(f"отсутствует обязательное поле '{name}'")
+                continue
+            value, error = check(data[name])
+            if error:
+                errors.append(error)
+            else:
+                result[name] = value
+        if errors:
+            return None, errors
+        return result, []
+
+def compile_schema(schema: dict) -> CompiledSchema:
+    """
+    Компилирует схему вида {"type": "OBJECT", "properties": {...}, "required": [...]}.
+    Поддерживаются типы STRING (с enum), INTEGER/NUMBER (с minimum/maximum), BOOLEAN,
+    вложенные OBJECT и ARRAY (с описанием элементов в "items"). У ARRAY с "skip_invalid": true
+    элементы, не прошедшие проверку, отбрасываются, а не делают невалидным весь ответ.
+    """
+    return CompiledSchema(schema)
+
+def _compile_property(name: str, spec: dict):
+    value_type = spec.get("type")
+    minimum = spec.get("minimum")
+    maximum = spec.get("maximum")
+
+    def check_range(value):
+        if minimum is not None and value < minimum or maximum is not None and value > maximum:
+            return None, f"поле '{name}' должно быть в диапазоне от {minimum} до {maximum}, получено {value}"
+        return value, None
+
+    if value_type == "INTEGER":
+        def check(value):
+            if isinstance(value, bool):
+                return None, f"поле '{name}' должно быть целым числом"
+            if isinstance(value, int):
+                return check_range(value)
+            if isinstance(value, float) and value.is_integer():
+                return check_range(int(value))
+            if isinstance(value, str):
+                # Только ASCII-цифры: isdigit() пропускает, например, "²", которые int() не разбирает
+                digits = value.strip().removeprefix("-")
+                if digits.isascii() and digits.isdecimal():
+                    return check_range(int(value.strip()))
+            return None, f"поле '{name}' должно быть целым числом, получено {value!r}"
+        return check
+
+    if value_type == "NUMBER":
+        def check(value):
+            if isinstance(value, bool):
+                return None, f"поле '{name}' должно быть числом"
+            try:
+                number = value if isinstance(value, int) else float(value)
+            except (TypeError, ValueError):
+                return None, f"поле '{name}' должно быть числом, получено {value!r}"
+            if isinstance(number, float) and not math.isfinite(number):
+                return None, f"поле '{name}' должно быть конечным числом, получено {value!r}"
+            return check_range(number)
+        return check
+
+    if value_type == "OBJECT":
+        nested = CompiledSchema(spec)
+
+        def check(value):
+            parsed, errors = nested.validate(value)
+            if errors:
+                return None, f"поле '{name}': " + "; ".join(errors)
+            return parsed, None
+        return check
+
+    if value_type == "ARRAY":
+        check_item = _compile_property(f"{name}[]", spec.get("items", {}))
+        skip_invalid = spec.get("skip_invalid", False)
+
+        def check(value):
+            if not isinstance(value, list):
+                return None, f"поле '{name}' должно быть списком"
+            result = []
+            for index, item in enumerate(value):
+                parsed, error = check_item(item)
+                if error and skip_invalid:
+                    continue
+                if error:
+                    return None, f"элемент {index} поля '{name}': {error}"
+                result.append(parsed)
+            return result, None
+        return check
+
+    if value_type == "BOOLEAN":
+        def check(value):
+            if isinstance(value, bool):
+                return value, None
+            return None, f"поле '{name}' должно быть true или false"
+        return check
+
+    enum = tuple(spec.get("enum", ()))
+
+    def check(value):
+        if not isinstance(value, str):
+            return None, f"поле '{name}' должно быть строкой"
+        value = value.strip()
+        if enum and value not in enum:
+            return None, f"поле '{name}' должно быть одним из {list(enum)}, получено {value!r}"
+        return value, None
+    return check
+
+def _describe(schema: dict) -> str:
+    """
+    Текстовое описание полей схемы для инструкции в промпте.
+    """
+    return "\n".join(f'- "{name}": {_describe_field(spec)}' for name, spec in schema.get("properties", {}).items())
+
+def _describe_field(spec: dict) -> str:
+    description = _TYPE_NAMES.get(spec.get("type"), "строка")
+    if spec.get("enum"):
+        description += ", одно из: " + ", ".join(f'"{value}"' for value in spec["enum"])
+    if "minimum" in spec or "maximum" in spec:
+        description += f" от {spec.get('minimum')} до {spec.get('maximum')}"
+    if spec.get("type") == "ARRAY" and spec.get("items", {}).get("type") == "OBJECT":
+        description += " объектов с полями " + _describe_nested(spec["items"])
+    elif spec.get("type") == "OBJECT":
+        description += " с полями " + _describe_nested(spec)
+    return description
+
+def _describe_nested(spec: dict) -> str:
+    return "; ".join(f'"{name}" ({_describe_field(field)})' for name, field in spec.get("properties", {}).items())
@@ -0,0 +1,22 @@
+# utils/telegram_utils.py
+
+# Разделитель между текстом новости и ссылкой во входящих сообщениях
+MESSAGE_PARTS_SEPARATOR = '1111\n\n'
+
+def parse_news_message(user_full_message: str) -> tuple[str, str]:
+    """
+    Разбивает входящее сообщение на основной текст новости и ссылку.
+    Текст и ссылка разделяются строкой '1111\\n\\n'. Если ссылки нет,
+    возвращается "Нет ссылки".
+    """
+    parts = user_full_message.split(MESSAGE_PARTS_SEPARATOR)
+
+    main_message = ""
+    message_link = "Нет ссылки"
+
+    if len(parts) >= 1:
+        main_message = parts[0].strip()
+    if len(parts) >= 2:
+        message_link = parts[1].strip()
+
+    return main_message, message_link
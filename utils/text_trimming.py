@@ -0,0 +1,104 @@
+# utils/text_trimming.py
+import re
+
+# Сокращение длинных постов перед встраиванием в промпты Deepseek.
+# Сначала из текста убирается то, что не влияет на оценку новости (ссылки, эмодзи, хештеги,
+# подписи каналов), затем, если текст все еще длиннее бюджета, оставляются первые
+# предложения (лид) и наиболее информативные предложения из остального текста.
+
+URL_PATTERN = re.compile(r"(https?://\S+|www\.\S+|t\.me/\S+)", re.IGNORECASE)
+HASHTAG_PATTERN = re.compile(r"(?<!\w)#[\w_]+")
+MENTION_PATTERN = re.compile(r"(?<!\w)@[A-Za-z0-9_]{4,}")
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F000-\U0001FAFF"  # смайлики, пиктограммы, флаги
+    "\U00002600-\U000027BF"  # разные символы и дингбаты
+    "\U0000FE00-\U0000FE0F"  # селекторы вариантов
+    "\U0000200D"             # соединитель для составных эмодзи
+    "]+"
+)
+# Типовые подписи каналов и призывы, которые добавляются в конец поста
+BOILERPLATE_PATTERN = re.compile(
+    r"^\s*(подпи(сат|сыв)\w*|подпишись|читайте (нас|также)|наш канал|прислать новость|предложить новость|"
+    r"реклама|источник:|фото:|видео:|❗️?\s*$)",
+    re.IGNORECASE
+)
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?…])\s+(?=[A-ZА-ЯЁ«\"0-9])")
+WORD_PATTERN = re.compile(r"\w+")
+
+# Сколько первых предложений (лид) сохраняется всегда
+LEAD_SENTENCES = 2
+
+def estimate_tokens(text: str) -> int:
+    """
+    Быстрая локальная оценка числа токенов без токенизатора.
+    Для BPE-токенизаторов латиница дает около 4 символов на токен, кириллица — около 2.5.
+    """
+    ascii_chars = sum(1 for char in text if char < "\x80")
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 2.5) + 1
+
+def clean_text(text: str) -> str:
+    """
+    Удаляет ссылки, эмодзи, хештеги, упоминания каналов и строки-подписи.
+    """
+    lines = []
+    for line in text.splitlines():
+        if BOILERPLATE_PATTERN.match(line):
+            continue
+        line = URL_PATTERN.sub("", line)
+        line = HASHTAG_PATTERN.sub("", line)
+        line = MENTION_PATTERN.sub("", line)
+        line = EMOJI_PATTERN.sub("", line)
+        line = re.sub(r"[ \t]{2,}", " ", line).strip()
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+def _sentence_score(sentence: str, lead_words: set) -> float:
+    """
+    Информативность предложения: числа и даты, имена собственные и пересечение с лидом.
+    """
+    words = WORD_PATTERN.findall(sentence)
+    if not words:
+        return 0.0
+    digits = sum(1 for word in words if any(char.isdigit() for char in word))
+    proper_names = sum(1 for word in words[1:] if word[0].isupper())
+    overlap = sum(1 for word in words if word.lower() in lead_words)
+    return (2 * digits + proper_names + overlap) / len(words) ** 0.5
+
+def trim_to_budget(text: str, max_tokens: int) -> tuple[str, int, int]:
+    """
+    Сокращает текст до бюджета max_tokens (по estimate_tokens).
+    Возвращает (текст, оценка токенов до, оценка токенов после).
+    """
+    original_tokens = estimate_tokens(text)
+    if original_tokens <= max_tokens:
+        return text, original_tokens, original_tokens
+
+    cleaned = clean_text(text)
+    if estimate_tokens(cleaned) <= max_tokens:
+        return cleaned, original_tokens, estimate_tokens(cleaned)
+
+    sentences = [s.strip() for paragraph in cleaned.split("\n") for s in SENTENCE_SPLIT_PATTERN.split(paragraph) if s.strip()]
+    lead = sentences[:LEAD_SENTENCES]
+    lead_words = {word.lower() for sentence in lead for word in WORD_PATTERN.findall(sentence) if len(word) > 3}
+
+    selected = set(range(len(lead)))
+    used_tokens = sum(estimate_tokens(sentence) for sentence in lead)
+    ranked = sorted(
+        range(len(lead), len(sentences)),
+        key=lambda index: _sentence_score(sentences[index], lead_words),
+        reverse=True
+    )
+    for index in ranked:
+        sentence_tokens = estimate_tokens(sentences[index])
+        if used_tokens + sentence_tokens > max_tokens:
+            continue
+        selected.add(index)
+        used_tokens += sentence_tokens
+
+    trimmed = " ".join(sentences[index] for index in sorted(selected))
+    # Если даже лид длиннее бюджета — обрезаем по символам с запасом
+    if estimate_tokens(trimmed) > max_tokens:
+        trimmed = trimmed[:int(max_tokens * 2.5)].rsplit(" ", 1)[0] + "…"
+    return trimmed, original_tokens, estimate_tokens(trimmed)
@@ -0,0 +1,163 @@
+# worker_app.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from telegram import Bot
+from config.settings import (
+    TELEGRAM_BOT_TOKEN, PRIVATE_GROUP_CHAT_ID, QUEUE_WORKERS, QUEUE_WORKER_CONCURRENCY, QUEUE_LEASE_SECONDS
+)
+from services.database_service import save_pipeline_result, close_database
+from services.checkpoint_store import close_checkpoints
+from services.deepseek_service import close_session
+from services.degradation import add_backlog_source, should_send_log, start_degradation_monitor, stop_degradation_monitor
+from services.delivery import forward_to_private_group
+from services.job_queue import claim_job, extend_lease, complete_job, fail_job, is_forwarded, mark_forwarded, close_queue, get_queue_depth
+from services.pipeline import run_pipeline, get_log_fields
+from services.telegram_logger import send_log_message
+from services.tracing import SPAN_KIND_CLIENT, close_tracing, span, trace_message
+from utils.logger_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Пауза между опросами пустой очереди
+POLL_INTERVAL_SECONDS = 0.5
+
+async def _heartbeat(job_id: int, owner: str) -> None:
+    """
+    Продлевает аренду задачи, пока она обрабатывается, чтобы долгий запрос к Deepseek
+    не привел к повторной выдаче задачи другому воркеру.
+    """
+    while True:
+        await asyncio.sleep(max(QUEUE_LEASE_SECONDS / 3, 1))
+        if not await asyncio.to_thread(extend_lease, job_id, owner):
+            logger.warning("[%s] Аренда задачи %d потеряна.", owner, job_id)
+            return
+
+async def process_job(job: dict, owner: str, bot: Bot) -> None:
+    """
+    Выполняет все этапы фильтрации для задачи из очереди, сохраняет результат,
+    пересылает сообщение (не более одного раза на ключ) и отправляет лог.
+    """
+    with trace_message(job["message_key"], "worker.process_job", worker=owner):
+        payload = job["payload"]
+        # Контрольные точки по ключу задачи: при повторной выдаче задачи после падения воркера
+        # уже полученные ответы Deepseek не запрашиваются заново
+        result = await run_pipeline(payload["main_message"], payload["message_link"], message_key=job["message_key"])
+        with span("db.save_pipeline_result"):
+            await asyncio.to_thread(save_pipeline_result, result)
+
+        if result["final_filter_value"] == "Да":
+            # Задача могла уже обрабатываться воркером, который упал после пересылки
+            if await asyncio.to_thread(is_forwarded, job["message_key"]):
+                logger.info("[%s] Сообщение %s уже пересылалось, повторная пересылка пропущена.", owner, job["message_key"])
+            else:
+                with span("telegram.forward", kind=SPAN_KIND_CLIENT):
+                    await forward_to_private_group(bot, result)
+                await asyncio.to_thread(mark_forwarded, job["message_key"])
+        else:
+            logger.info("[%s] Сообщение %s НЕ отправлено в приватную группу (финальный фильтр: Нет).", owner, job["message_key"])
+
+        if should_send_log(result["final_filter_value"] == "Да"):
+            with span("telegram.send_log", kind=SPAN_KIND_CLIENT):
+                await send_log_message(**get_log_fields(result))
+
+async def consume(owner: str, bot: Bot, stop_event) -> None:
+    """
+    Цикл одного потребителя: берет задачу, обрабатывает ее и подтверждает выполнение.
+    При ошибке задача возвращается в очередь (или помечается failed после QUEUE_MAX_ATTEMPTS попыток).
+    """
+    while not stop_event.is_set():
+        job = await asyncio.to_thread(claim_job, owner)
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            continue
+
+        logger.info("[%s] Взята задача %d (%s), попытка %d.", owner, job["id"], job["message_key"], job["attempts"])
+        heartbeat = asyncio.create_task(_heartbeat(job["id"], owner))
+        try:
+            await process_job(job, owner, bot)
+            await asyncio.to_thread(complete_job, job["id"], owner)
+        except Exception as e:
+            logger.exception("[%s] Ошибка при обработке задачи %d: %s", owner, job["id"], e)
+            await asyncio.to_thread(fail_job, job["id"], owner, str(e))
+        finally:
+            heartbeat.cancel()
+
+async def run_worker(worker_index: int, stop_event) -> None:
+    """
+    Запускает QUEUE_WORKER_CONCURRENCY потребителей в цикле событий процесса-воркера
+    и проверку нагрузки для режимов деградации (по общей очереди задач).
+    """
+    base_owner = f"{socket.gethostname()}:{os.getpid()}"
+    add_backlog_source(lambda: get_queue_depth()["pending"])
+    start_degradation_monitor()
+    try:
+        async with Bot(TELEGRAM_BOT_TOKEN) as bot:
+            await asyncio.gather(*(
+                consume(f"{base_owner}:{slot}", bot, stop_event) for slot in range(QUEUE_WORKER_CONCURRENCY)
+            ))
+    finally:
+        await stop_degradation_monitor()
+        close_session()
+        close_database()
+        close_queue()
+        close_checkpoints()
+        close_tracing()
+        logger.info("Воркер %d (pid %d) остановлен.", worker_index, os.getpid())
+
+def worker_main(worker_index: int, stop_event) -> None:
+    """
+    Точка входа процесса-воркера. Ctrl+C обрабатывает родительский процесс:
+    воркер дорабатывает текущие задачи и завершается по stop_event.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(f"worker-{worker_index}")
+    logger.info("Воркер %d (pid %d) запущен.", worker_index, os.getpid())
+    asyncio.run(run_worker(worker_index, stop_event))
+
+def main():
+    """Запускает QUEUE_WORKERS процессов, обрабатывающих очередь задач фильтрации."""
+    setup_logging("worker")
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("Токен основного Telegram-бота не найден. Убедитесь, что он указан в файле .env")
+        return
+    if not PRIVATE_GROUP_CHAT_ID:
+        logger.error("Chat ID приватной группы не найден. Убедитесь, что он указан в файле .env")
+        return
+
+    # spawn: каждый воркер получает чистый процесс без унаследованных соединений и сессий
+    mp_context = multiprocessing.get_context("spawn")
+    stop_event = mp_context.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    def start_worker(worker_index: int):
+        process = mp_context.Process(target=worker_main, args=(worker_index, stop_event), name=f"worker-{worker_index}")
+        process.start()
+        return process
+
+    processes = {index: start_worker(index) for index in range(QUEUE_WORKERS)}
+    logger.info("Запущено воркеров: %d (по %d задачи одновременно). Для остановки нажмите Ctrl+C.", QUEUE_WORKERS, QUEUE_WORKER_CONCURRENCY)
+    try:
+        while not stop_event.is_set():
+            # Перезапускаем воркеры, завершившиеся аварийно; их задачи вернутся в очередь по истечении аренды
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.warning("Воркер %d завершился с кодом %s, перезапуск...", index, process.exitcode)
+                    processes[index] = start_worker(index)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Получен сигнал остановки.")
+    finally:
+        stop_event.set()
+        for process in processes.values():
+            process.join(QUEUE_LEASE_SECONDS)
+            if process.is_alive():
+                process.terminate()
+        logger.info("Все воркеры завершили работу.")
+
+if __name__ == '__main__':
+    main()